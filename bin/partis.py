@@ -3,9 +3,14 @@ import argparse
 import time
 import random
 import sys
-from multiprocessing import Process, active_children
+import pipes
 import os
 sys.path.insert(1, './python')
+if '--profile-startup' in sys.argv:  # have to start timing before we import anything else
+    import atexit
+    import importtimer
+    importtimer.install()
+    atexit.register(importtimer.report)
 
 import utils
 # merged data: /shared/silo_researcher/Matsen_F/MatsenGrp/data/bcr/output_sw/A/04-A-M_merged.tsv.bz2
@@ -13,6 +18,7 @@ parser = argparse.ArgumentParser()
 parser.add_argument('--debug', type=int, default=0, choices=[0, 1, 2])
 parser.add_argument('--sw-debug', type=int, default=0, choices=[0, 1, 2], help='debug level for smith-waterman')
 parser.add_argument('--no-clean', action='store_true', help='Don\'t remove the various temp files')
+parser.add_argument('--profile-startup', action='store_true', help='Print how long each module took to import (on exit)')
 
 # basic actions
 parser.add_argument('--action', choices=('cache-parameters', 'run-viterbi', 'run-forward', 'partition', 'simulate', 'build-hmms', 'generate-trees'), help='What do you want to do?')
@@ -33,6 +39,7 @@ parser.add_argument('--print-partitions', action='store_true', help='Print parti
 parser.add_argument('--annotation-clustering-thresholds', default='0.9', help='colon-separated list of thresholds for annotation-based (e.g. vollmers) clustering')
 parser.add_argument('--naive-vsearch', action='store_true')
 parser.add_argument('--naive-swarm', action='store_true')
+parser.add_argument('--naive-single-linkage', action='store_true', help='Instead of vsearch or swarm, cluster the naive sequences by single linkage on naive hamming fraction in python, with all the cores on this machine (and without any temporary files).')
 parser.add_argument('--no-indels', action='store_true', help='don\'t account for indels (hm, not actually sure if I implemented this, or if I just thought it was a good idea.)')
 parser.add_argument('--n-partition-steps', type=int, default=99999, help='Instead of proceeding until we reach 1 process, stop after <n> partitioning steps.')
 parser.add_argument('--no-random-divvy', action='store_true', help='Don\'t shuffle the order of the input sequences before passing on to ham')  # it's imperative to shuffle if you're partitioning on simulation, or if you're partitioning with more than one process. But it may also be kinda slow.
@@ -41,6 +48,7 @@ parser.add_argument('--naivety', default='M', choices=['M', 'N'])
 parser.add_argument('--print-cluster-annotations', action='store_true', help='print annotation for each final cluster')
 parser.add_argument('--presto-output', action='store_true', help='write output file in presto format')
 parser.add_argument('--only-csv-plots', action='store_true', help='only write csv plots')
+parser.add_argument('--collapse-duplicates', action='store_true', help='Collapse queries with identical sequences into one representative before smith-waterman, and add the duplicates back in to the output annotations and partitions')
 
 # input and output locations
 parser.add_argument('--seqfile', help='input sequence file')
@@ -55,9 +63,21 @@ parser.add_argument('--persistent-cachefname')
 # run/batch control
 parser.add_argument('--n-procs', default='1', help='Max/initial number of processes over which to parallelize (Can be colon-separated list: first number is procs for hmm, second (should be smaller) is procs for smith-waterman, hamming, etc.)')
 parser.add_argument('--n-max-procs', default=500, help='never allow more processes than this')
-parser.add_argument('--slurm', action='store_true', help='Run multiple processes with slurm, otherwise just runs them on local machine. NOTE make sure to set <workdir> to something visible on all batch nodes.')
+parser.add_argument('--divvy-balance', default='queries', choices=['queries', 'cost'], help='When divvying similar sequences together for each partition step (with --no-random-divvy), give each process an equal number of queries, or an equal predicted cost (estimated from the number of uncached pairs within the naive hamming bounds, weighted by cluster size). Either way, we print the predicted vs actual imbalance among processes after each step.')
+parser.add_argument('--n-shards-per-proc', type=int, default=1, help='Split the hmm input into this many times as many pieces as there are processes, and have each process pick up the next piece as soon as it finishes one (so one slow piece doesn\'t hold everybody up). NOTE when partitioning, sequences in different pieces can\'t be merged in that step, so it may take more steps to get down to one process.')
+parser.add_argument('--n-procs-objective', default='fixed-factor', choices=['fixed-factor', 'wall', 'cpu'], help='How to choose the number of processes for each partition step. The default reduces it by a fixed factor whenever the processes did only a few calculations in the previous step, while \'wall\' and \'cpu\' fit a timing model to the previous steps and choose whichever number of processes minimizes the predicted wall or total cpu time of the next step (but never more than the fixed factor would give).')
+parser.add_argument('--n-procs-logfname', help='If set, write the number of processes, calculation counts, and predicted and actual times for each partition step to this csv file (e.g. for tuning --n-procs-objective)')
+parser.add_argument('--hung-timeout', type=float, help='When partitioning, kill (and rerun) any bcrham process that hasn\'t reported any progress in this many seconds. Processes report at most every five seconds, and only after finishing a calculation, so make sure this is longer than your slowest single calculation. Only for the local batch system.')
+parser.add_argument('--worker-pool', action='store_true', help='When partitioning, keep one long-lived bcrham process per proc (rather than starting new ones at each step), so each only reads the hmm files once. Not used with slurm.')
+parser.add_argument('--slurm', action='store_true', help='Run multiple processes with slurm, otherwise just runs them on local machine. NOTE make sure to set <workdir> to something visible on all batch nodes. Same as --batch-system slurm.')
+parser.add_argument('--batch-system', choices=['local', 'slurm', 'queue'], help='How to run multiple processes: as subprocesses on this machine, with srun, or by putting them in a file queue (in --queue-dir) for somebody else (e.g. ./bin/serve-queue.py) to run. Default is local, unless --slurm is set, or there are more processes than cores and slurm is installed.')
+parser.add_argument('--queue-dir', help='Directory in which to put jobs for --batch-system queue. NOTE whoever serves it has to be able to see <workdir>.')
+parser.add_argument('--queue-timeout', type=float, default=600., help='With --batch-system queue, give up if nobody has claimed any of our jobs from --queue-dir after this many seconds.')
+parser.add_argument('--jobs-per-batch', type=int, default=1, help='With slurm or queue batch systems, pack up to this many processes into each submission, so small processes don\'t each pay the queueing latency.')
+parser.add_argument('--sim-iproc', type=int, help=argparse.SUPPRESS)  # internal: this is the <iproc>th simulation subprocess (see run_simulation())
 parser.add_argument('--queries', help='Colon-separated list of query names to which we restrict ourselves')
 parser.add_argument('--reco-ids', help='Colon-separated list of rearrangement-event IDs to which we restrict ourselves')  # or recombination events
+parser.add_argument('--chunk-size', type=int, help='For run-viterbi and run-forward, read, align, annotate, and write this many queries at a time (so memory doesn\'t grow with the size of the input file). Duplicates are only collapsed within each chunk.')
 parser.add_argument('--n-max-queries', type=int, default=-1, help='Maximum number of query sequences on which to run (except for simulator, where it\'s the number of rearrangement events)')
 parser.add_argument('--only-genes', help='Colon-separated list of genes to which to restrict the analysis')
 parser.add_argument('--n-best-events', default=None, help='Number of best events to print (i.e. n-best viterbi paths). Default is set in bcrham.')
@@ -106,13 +126,25 @@ if args.smc_particles != 1:
 
 if args.workdir is None:  # set default here so we know whether it was set by hand or not
     args.workdir = '/tmp/' + os.path.basename(os.getenv('HOME')) + '/hmms/' + str(random.randint(0, 999999))
-if os.path.exists(args.workdir):
+if os.path.exists(args.workdir) and args.sim_iproc is None:
     raise Exception('workdir %s already exists' % args.workdir)
 
 if args.plot_performance:
     if args.plotdir is None:
         raise Exception('can\'t plot performance unless --plotdir is specified')
 
+if args.chunk_size is not None:
+    if args.chunk_size < 1:
+        raise Exception('--chunk-size has to be a positive number')
+    if 'run-' not in args.action:  # partitioning and parameter caching need all the queries at once
+        raise Exception('--chunk-size only works with run-viterbi and run-forward (not %s)' % args.action)
+    if args.seqfile is None:
+        raise Exception('--chunk-size needs a --seqfile to read from')
+    if args.plot_performance or args.annotation_clustering is not None:
+        raise Exception('--chunk-size can\'t be used with --plot-performance or --annotation-clustering, since they need all the queries at once')
+    if args.sw_debug > 0:
+        raise Exception('--chunk-size can\'t be used with --sw-debug, since the waterer appends its debug output to --outfname')
+
 # ----------------------------------------------------------------------------------------
 def run_simulation(args):
     if args.outfname is None:
@@ -121,8 +153,6 @@ def run_simulation(args):
         raise Exception('parameter dir %s d.n.e.' % args.parameter_dir)
     if not args.n_sim_events > 0:
         raise Exception('--n-sim-events has to be a positivie number')
-    if args.slurm:
-        raise Exception('simulator parallelization does not handle slurm')
 
     def make_events(n_events, iproc, random_ints):
         assert n_events > 0
@@ -145,13 +175,16 @@ def run_simulation(args):
     all_random_ints = []
     for iproc in range(args.n_procs):  # have to generate these all at once, 'cause each of the subprocesses is going to reset its seed and god knows what happens to our seed at that point
         all_random_ints.append([random.randint(0, sys.maxint) for i in range(n_per_proc)])
-    for iproc in range(args.n_procs):
-        proc = Process(target=make_events, args=(n_per_proc, iproc, all_random_ints[iproc]))
-        proc.start()
-    while len(active_children()) > 0:
-        # print ' wait %s' % len(active_children()),
-        sys.stdout.flush()
-        time.sleep(1)
+    if args.sim_iproc is not None:  # we're one of the subprocesses
+        make_events(n_per_proc, args.sim_iproc, all_random_ints[args.sim_iproc])
+        return
+
+    # run this script once for each subprocess (with the same seed, so they all generate the same random ints)
+    from executor import get_executor
+    from jobscheduler import Job
+    cmd_str = ' '.join([pipes.quote(a) for a in [sys.executable, os.path.abspath(sys.argv[0])] + sys.argv[1:] + ['--seed', str(args.seed), '--workdir', args.workdir]])
+    jobs = [Job(cmd_str + ' --sim-iproc ' + str(iproc), str(iproc), outfname=args.workdir + '/recombinator-' + str(iproc) + '/' + os.path.basename(args.outfname), workdir=args.workdir + '/recombinator-' + str(iproc)) for iproc in range(args.n_procs)]
+    get_executor(args, args.n_procs).run(jobs)
     utils.merge_csvs(args.outfname, [args.workdir + '/recombinator-' + str(iproc) + '/' + os.path.basename(args.outfname) for iproc in range(args.n_procs)], cleanup=(not args.no_clean))
 
 if args.action == 'simulate' or args.action == 'generate-trees':
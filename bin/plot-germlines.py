@@ -13,6 +13,7 @@ import itertools
 from collections import OrderedDict
 
 import utils
+import glutils
 import plotting
 
 # ----------------------------------------------------------------------------------------
@@ -21,9 +22,7 @@ xtitles = {
     'indels' : 'fraction of positions indel\'d',
     'subs' : 'substitution fraction'
 }
-glfo = {}
-glfo['seqs'] = utils.read_germlines(datadir)
-glfo['aligned-v-genes'] = utils.read_germlines(datadir, only_region='v', aligned=True)
+glfo = glutils.read_glfo(datadir)
 vgenes = glfo['aligned-v-genes']['v'].keys()
 pversions = OrderedDict()
 for vg in vgenes:
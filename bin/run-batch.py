@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+Run the commands in a batch directory written by executor.BatchExecutor, one at a time, until there are none left.
+Several of these can work on the same directory at once (e.g. one per slurm allocation): each command is claimed by renaming its file from todo/ to claimed/
+(which only one runner can do), and when it finishes we write its exit code, wall time, and cpu time to status/.
+NOTE this only uses the standard library, so it runs with whatever python the batch nodes have.
+"""
+import os
+import sys
+import time
+import json
+import errno
+import argparse
+from subprocess import Popen
+
+parser = argparse.ArgumentParser()
+parser.add_argument('batchdir')
+args = parser.parse_args()
+
+# ----------------------------------------------------------------------------------------
+def claim_next():
+    """ return the name of the next unclaimed command (in sorted order, i.e. the order they were written), or None if there aren't any """
+    for name in sorted(os.listdir(args.batchdir + '/todo')):
+        try:
+            os.rename(args.batchdir + '/todo/' + name, args.batchdir + '/claimed/' + name)
+            return name
+        except OSError as e:  # somebody else got it first
+            if e.errno != errno.ENOENT:
+                raise
+    return None
+
+# ----------------------------------------------------------------------------------------
+def run(name):
+    with open(args.batchdir + '/claimed/' + name) as cmdfile:
+        cmd_str = cmdfile.read()
+    start = time.time()
+    proc = Popen(cmd_str, shell=True)
+    while True:
+        try:
+            _, status, rusage = os.wait4(proc.pid, 0)
+            break
+        except OSError as e:
+            if e.errno != errno.EINTR:
+                raise
+    proc.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    statusfname = args.batchdir + '/status/' + name
+    with open(statusfname + '.tmp', 'w') as statusfile:  # write then rename, so whoever's waiting on us never sees a partial file
+        json.dump({'returncode' : proc.returncode, 'wall_time' : time.time() - start, 'cpu_time' : rusage.ru_utime + rusage.ru_stime, 'host' : os.uname()[1]}, statusfile)
+    os.rename(statusfname + '.tmp', statusfname)
+
+while True:
+    name = claim_next()
+    if name is None:
+        break
+    run(name)
+    sys.stdout.flush()
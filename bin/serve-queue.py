@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Serve the file queue used by the 'queue' batch system (executor.QueueExecutor), i.e. a local stand-in for whatever would pick the jobs up on a real cluster.
+Each job is a file <queue-dir>/<id>.sh holding a shell command line. We claim it by renaming it to <id>.running (so any number of servers, e.g. one per node, can share
+the queue directory), run it, and then write its exit code to <id>.done.
+"""
+import os
+import sys
+import time
+import errno
+import argparse
+sys.path.insert(1, './python')
+
+from jobscheduler import Job
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--queue-dir', required=True)
+parser.add_argument('--n-procs', type=int, default=1, help='run at most this many jobs at once')
+parser.add_argument('--interval', type=float, default=0.2, help='seconds between looking for new jobs')
+parser.add_argument('--exit-when-idle', type=float, help='exit if there\'s been nothing to do for this many seconds (otherwise we run until killed)')
+args = parser.parse_args()
+
+if not os.path.exists(args.queue_dir):
+    os.makedirs(args.queue_dir)
+
+# ----------------------------------------------------------------------------------------
+def claim_next():
+    """ return a Job for the oldest unclaimed file in the queue, or None if there aren't any """
+    fnames = [fn for fn in os.listdir(args.queue_dir) if fn.endswith('.sh')]
+    for fname in sorted(fnames, key=lambda fn: os.path.getmtime(args.queue_dir + '/' + fn) if os.path.exists(args.queue_dir + '/' + fn) else 0.):
+        jobid = fname[ : -len('.sh')]
+        try:
+            os.rename(args.queue_dir + '/' + fname, args.queue_dir + '/' + jobid + '.running')
+        except OSError as e:  # somebody else got it first
+            if e.errno != errno.ENOENT:
+                raise
+            continue
+        with open(args.queue_dir + '/' + jobid + '.running') as jobfile:
+            return Job(jobfile.read().strip(), jobid, workdir=args.queue_dir)
+    return None
+
+# ----------------------------------------------------------------------------------------
+def finish(job):
+    donefname = args.queue_dir + '/' + job.name + '.done'
+    with open(donefname + '.tmp', 'w') as donefile:
+        donefile.write('%d\n' % job.returncode)
+    os.rename(donefname + '.tmp', donefname)
+    os.remove(args.queue_dir + '/' + job.name + '.running')
+    print '  %s finished with %d in %.1fs' % (job.name, job.returncode, time.time() - job.start_time)
+    sys.stdout.flush()
+
+print 'serving %s with %d procs' % (args.queue_dir, args.n_procs)
+sys.stdout.flush()
+running = []
+last_busy = time.time()
+try:
+    while True:
+        for job in [j for j in running if j.proc.poll() is not None]:
+            job.returncode = job.proc.returncode
+            finish(job)
+            running.remove(job)
+        while len(running) < args.n_procs:
+            job = claim_next()
+            if job is None:
+                break
+            job.start()
+            running.append(job)
+        if len(running) > 0:
+            last_busy = time.time()
+        elif args.exit_when_idle is not None and time.time() - last_busy > args.exit_when_idle:
+            break
+        time.sleep(args.interval)
+except BaseException:  # the jobs are in their own process groups, so they won't see a ctrl-c
+    for job in running:
+        job.kill()
+        job.proc.wait()
+    raise
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+""" check that the batch hamming fractions in python/hamming.py match utils.hamming_fraction(), and time them against each other """
+import sys
+sys.path.insert(1, './python')
+import time
+import random
+import argparse
+import numpy
+
+import utils
+import hamming
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--n-seqs', type=int, default=500)
+parser.add_argument('--seq-length', type=int, default=350)
+parser.add_argument('--n-families', type=int, default=20, help='number of ancestral sequences from which to mutate the others')
+parser.add_argument('--mute-freq', type=float, default=0.1)
+parser.add_argument('--n-padding', type=int, default=10, help='max number of Ns to add to each end (like padding in partitiondriver)')
+parser.add_argument('--seed', type=int, default=1)
+args = parser.parse_args()
+
+random.seed(args.seed)
+ancestors = [''.join([random.choice(utils.nukes) for _ in range(args.seq_length)]) for _ in range(args.n_families)]
+seqs = []
+for iseq in range(args.n_seqs):
+    seq = [ch if random.random() > args.mute_freq else random.choice(utils.nukes) for ch in random.choice(ancestors)]
+    for ipos in range(random.randint(0, args.n_padding)) + range(args.seq_length - random.randint(0, args.n_padding), args.seq_length):
+        seq[ipos] = utils.ambiguous_bases[0]
+    seqs.append(''.join(seq))
+n_pairs = args.n_seqs * (args.n_seqs - 1) / 2
+print '%d seqs of length %d (%d pairs)' % (args.n_seqs, args.seq_length, n_pairs)
+
+start = time.time()
+loop_fracs = numpy.zeros((args.n_seqs, args.n_seqs))
+for iseq in range(args.n_seqs):
+    for jseq in range(iseq + 1, args.n_seqs):
+        loop_fracs[iseq, jseq] = loop_fracs[jseq, iseq] = utils.hamming_fraction(seqs[iseq], seqs[jseq])
+loop_time = time.time() - start
+print '  utils.hamming_fraction() all pairs   %8.3fs' % loop_time
+
+start = time.time()
+encoded_seqs = hamming.EncodedSeqs(seqs)
+encode_time = time.time() - start
+print '  encoding                             %8.3fs' % encode_time
+
+start = time.time()
+matrix_fracs = encoded_seqs.all_pairs()
+all_pairs_time = time.time() - start
+print '  EncodedSeqs.all_pairs()              %8.3fs   (%.0fx)' % (all_pairs_time, loop_time / (encode_time + all_pairs_time))
+
+start = time.time()
+one_vs_many_fracs = numpy.array([encoded_seqs.one_vs_many(iseq) for iseq in range(args.n_seqs)])
+one_vs_many_time = time.time() - start
+print '  EncodedSeqs.one_vs_many() each seq   %8.3fs   (%.0fx)' % (one_vs_many_time, loop_time / (encode_time + one_vs_many_time))
+
+for name, fracs in (('all_pairs', matrix_fracs), ('one_vs_many', one_vs_many_fracs)):
+    if not (fracs == loop_fracs).all():
+        raise Exception('%s differs from utils.hamming_fraction() by up to %f' % (name, numpy.abs(fracs - loop_fracs).max()))
+print '  all fractions identical'
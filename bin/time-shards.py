@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+""" compare step wall time and core utilization for a static n-way split of the hmm input (one bcrham run per proc) against --n-shards-per-proc (many small shards pulled by a fixed pool of procs) """
+import sys
+sys.path.insert(1, './python')
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+from jobscheduler import Job, JobScheduler
+
+parser = argparse.ArgumentParser(description='Each "bcrham run" is a sleep whose length is proportional to the sum of squared cluster sizes in its piece of the input (roughly how forward calculations scale when partitioning), so this runs fine on one core.')
+parser.add_argument('--n-clusters', type=int, default=2000)
+parser.add_argument('--n-procs', type=int, default=8)
+parser.add_argument('--n-shards-per-proc', default='4:16', help='colon-separated list of values to compare against the static split')
+parser.add_argument('--size-exponent', type=float, default=2.5, help='cluster sizes are drawn from a power law with this exponent (i.e. lots of singletons and a few big clusters)')
+parser.add_argument('--total-time', type=float, default=8., help='seconds of (simulated) work in each step, summed over all procs')
+parser.add_argument('--seed', type=int, default=1)
+args = parser.parse_args()
+
+random.seed(args.seed)
+sizes = [int(random.paretovariate(args.size_exponent - 1)) for _ in range(args.n_clusters)]
+costs = [s**2 for s in sizes]
+seconds_per_cost = args.total_time / sum(costs)
+print '%d clusters (sizes %d - %d, mean %.1f), %d procs, %.1fs of work per step' % (args.n_clusters, min(sizes), max(sizes), float(sum(sizes)) / len(sizes), args.n_procs, args.total_time)
+
+# ----------------------------------------------------------------------------------------
+def run_step(n_shards, workdir):
+    """ split the clusters modulo <n_shards> (like split_input() with random divvy), then run them with <args.n_procs> at a time """
+    shard_costs = [sum(costs[ic] for ic in range(ishard, len(costs), n_shards)) for ishard in range(n_shards)]
+    jobs = [Job('sleep %.4f' % (seconds_per_cost * shard_costs[ishard]), str(ishard), workdir=workdir) for ishard in range(n_shards)]
+    jobs = [jobs[i] for i in sorted(range(n_shards), key=lambda i: shard_costs[i], reverse=True)]  # biggest first, same as PartitionDriver.execute()
+    start = time.time()
+    JobScheduler(max_concurrent=args.n_procs).run(jobs)
+    wall_time = time.time() - start
+    busy_time = sum([job.wall_time for job in jobs])
+    return wall_time, busy_time / (wall_time * args.n_procs), max(shard_costs) * seconds_per_cost
+
+workdir = tempfile.mkdtemp()
+results = []
+for label, n_shards in [('static', args.n_procs)] + [('%d shards/proc' % int(n), args.n_procs * int(n)) for n in args.n_shards_per_proc.split(':')]:
+    print '  %s:' % label
+    wall_time, utilization, biggest = run_step(n_shards, workdir)
+    results.append((label, n_shards, wall_time, utilization, biggest))
+shutil.rmtree(workdir)
+
+print ''
+print '  %16s  %6s  %9s  %11s  %13s' % ('', 'shards', 'wall (s)', 'core util.', 'biggest (s)')
+for label, n_shards, wall_time, utilization, biggest in results:
+    print '  %16s  %6d  %9.2f  %10.0f%%  %13.2f' % (label, n_shards, wall_time, 100 * utilization, biggest)
+print '  (ideal wall time is %.2fs)' % (args.total_time / args.n_procs)
@@ -15,7 +15,7 @@ namespace ham {
 // NOTE some input is passed on the command line (global configuration), while some is passed in a csv file (stuff that depends on each (pair of) sequence(s)).
 class Args {
 public:
-  Args(int argc, const char * argv[]);
+  Args(int argc, const char * argv[], bool server_request=false);  // if <server_request>, throw on bad arguments (rather than printing the usage and exiting)
   // void Check();  // make sure everything's the same length (i.e. the input file had all the expected columns)
 
   string hmmdir() { return hmmdir_arg_.getValue(); }
@@ -24,6 +24,8 @@ public:
   string outfile() { return outfile_arg_.getValue(); }
   string annotationfile() { return annotationfile_arg_.getValue(); }
   string cachefile() { return cachefile_arg_.getValue(); }
+  string input_cachefile() { return input_cachefile_arg_.getValue(); }
+  string progress_file() { return progress_file_arg_.getValue(); }
   float hamming_fraction_bound_lo() { return hamming_fraction_bound_lo_arg_.getValue(); }
   float hamming_fraction_bound_hi() { return hamming_fraction_bound_hi_arg_.getValue(); }
   float max_logprob_drop() { return max_logprob_drop_arg_.getValue(); }
@@ -33,6 +35,7 @@ public:
   int n_best_events() { return n_best_events_arg_.getValue(); }
   int smc_particles() { return smc_particles_arg_.getValue(); }
   int naive_hamming_cluster() { return naive_hamming_cluster_arg_.getValue(); }
+  int progress_interval() { return progress_interval_arg_.getValue(); }
   bool no_chunk_cache() { return no_chunk_cache_arg_.getValue(); }
   bool partition() { return partition_arg_.getValue(); }
   bool truncate_seqs() { return truncate_seqs_arg_.getValue(); }
@@ -48,9 +51,9 @@ public:
   vector<int> debug_ints_;
   ValuesConstraint<string> algo_vals_;
   ValuesConstraint<int> debug_vals_;
-  ValueArg<string> hmmdir_arg_, datadir_arg_, infile_arg_, outfile_arg_, annotationfile_arg_, cachefile_arg_, algorithm_arg_, ambig_base_arg_;
+  ValueArg<string> hmmdir_arg_, datadir_arg_, infile_arg_, outfile_arg_, annotationfile_arg_, cachefile_arg_, input_cachefile_arg_, algorithm_arg_, ambig_base_arg_, progress_file_arg_;
   ValueArg<float> hamming_fraction_bound_lo_arg_, hamming_fraction_bound_hi_arg_, max_logprob_drop_arg_;
-  ValueArg<int> debug_arg_, n_best_events_arg_, smc_particles_arg_, naive_hamming_cluster_arg_;
+  ValueArg<int> debug_arg_, n_best_events_arg_, smc_particles_arg_, naive_hamming_cluster_arg_, progress_interval_arg_;
   SwitchArg no_chunk_cache_arg_, partition_arg_, truncate_seqs_arg_, rescale_emissions_arg_, unphysical_insertions_arg_, cache_naive_seqs_arg_, no_fwd_arg_, cache_naive_hfracs_arg_, only_cache_new_vals_arg_;
 
   // arguments read from csv input file
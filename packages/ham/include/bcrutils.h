@@ -10,6 +10,7 @@
 #include <iostream>
 #include <fstream>
 #include <cmath>
+#include <ctime>
 
 #include "model.h"
 #include "text.h"
@@ -119,10 +120,12 @@ public:
 // ----------------------------------------------------------------------------------------
 class HMMHolder {
 public:
-  HMMHolder(string hmm_dir, GermLines &gl, Track *track): hmm_dir_(hmm_dir), gl_(gl), track_(track) {}
+  HMMHolder(string hmm_dir, GermLines &gl, Track *track): hmm_dir_(hmm_dir), gl_(gl), track_(track), load_time_(0.) {}
   ~HMMHolder();
   Model *Get(string gene, bool debug);
   Track *track() { return track_; }
+  string hmm_dir() { return hmm_dir_; }
+  double load_time() { return load_time_; }  // total cpu time we've spent reading hmm files
   // Rescale, within each hmm, the emission probabilities to reflect <overall_mute_freq> instead of the mute freq which was recorded in the hmm file.
   // If <overall_mute_freq> is -INFINITY, we re-rescale them to what they were originally
   void RescaleOverallMuteFreqs(map<string, set<string> > &only_genes, double overall_mute_freq);  // WOE BETIDE THEE WHO FORGETETH TO RE-RESET THESE
@@ -134,6 +137,7 @@ private:
   GermLines &gl_;
   map<string, Model*> hmms_; // map of gene name to hmm pointer
   Track *track_;  // each of the models has a track... but they should all be the same, so just toss one here for easy access
+  double load_time_;
 };
 
 // ----------------------------------------------------------------------------------------
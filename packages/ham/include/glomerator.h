@@ -7,6 +7,7 @@
 #include <iomanip>
 #include <ctime>
 #include <algorithm>
+#include <sys/stat.h>
 
 #include "smctc.hh"
 #include "args.h"
@@ -31,10 +32,28 @@ public:
   pair<string, string> parents_;  // queries that were joined to make this
 };
 
+// ----------------------------------------------------------------------------------------
+// The values in a cache file. bcrham --server keeps one of these between runs, and since the main cache file is append-only, each run only has to read the lines that were added since the last one.
+class CacheFileInfo {
+public:
+  CacheFileInfo() : offset_(0), inode_(0) {}
+  bool Update(string fname, Track *track);  // read any lines added to <fname> since last time (starting over if it's a different file, or it was replaced or truncated); returns false if it doesn't exist
+  void Clear();
+
+  map<string, double> log_probs_;
+  map<string, double> naive_hfracs_;
+  map<string, Sequence> naive_seqs_;
+  int n_new_lines_;  // number of lines we read in the last Update()
+private:
+  string fname_;
+  streamoff offset_;  // we've read everything before this
+  ino_t inode_;
+};
+
 // ----------------------------------------------------------------------------------------
 class Glomerator {
 public:
-  Glomerator(HMMHolder &hmms, GermLines &gl, vector<vector<Sequence> > &qry_seq_list, Args *args, Track *track);
+  Glomerator(HMMHolder &hmms, GermLines &gl, vector<vector<Sequence> > &qry_seq_list, Args *args, Track *track, CacheFileInfo *cache_file_info=nullptr);
   ~Glomerator();
   void Cluster();
   double LogProbOfPartition(Partition &clusters, bool debug=false);
@@ -62,6 +81,7 @@ private:
   int CountMembers(string namestr);
   string ClusterSizeString(ClusterPath *path);
   void WriteStatus(ClusterPath *path);  // write some progress info to file
+  void WriteProgress(bool force, bool done);  // write a json line with calculation counts to the --progress-file (if it's set), if it's been long enough since the last one (or if <force>)
   double NaiveHammingFraction(string key_a, string key_b);
   double HammingFraction(Sequence seq_a, Sequence seq_b);
   void GetNaiveSeq(string key, pair<string, string> *parents=nullptr);
@@ -77,6 +97,7 @@ private:
 
   Track *track_;
   Args *args_;
+  CacheFileInfo *cache_file_info_;  // if set, we start from the cached values in here (after updating it from the cache file) rather than reading the whole file
   DPHandler vtb_dph_, fwd_dph_;
   ofstream ofs_;
 
@@ -109,6 +130,11 @@ private:
 
   time_t last_status_write_time_;  // last time that we wrote our progress to a file
   FILE *progress_file_;
+
+  int n_fwd_cached_, n_vtb_cached_;  // number of times we already had the value (either from the input cache file, or because we calculated it earlier in this run)
+  int n_clusters_;  // number of clusters in the current partition, for the progress file
+  time_t last_progress_write_time_;
+  FILE *progress_json_file_;  // nullptr unless --progress-file is set
 };
 
 }
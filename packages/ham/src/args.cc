@@ -3,7 +3,7 @@
 namespace ham {
 
 // ----------------------------------------------------------------------------------------
-Args::Args(int argc, const char * argv[]):
+Args::Args(int argc, const char * argv[], bool server_request):
   algo_strings_ {"viterbi", "forward"},
   debug_ints_ {0, 1, 2},
   algo_vals_(algo_strings_),
@@ -14,8 +14,10 @@ Args::Args(int argc, const char * argv[]):
   outfile_arg_("", "outfile", "output csv file", true, "", "string"),
   annotationfile_arg_("", "annotationfile", "if specified, write annotations for each cluster to here", false, "", "string"),
   cachefile_arg_("", "cachefile", "input (and output) cache log prob csv file", false, "", "string"),
+  input_cachefile_arg_("", "input-cachefile", "if set, read cached values from here (which is never written to, so can be shared between processes) instead of from --cachefile", false, "", "string"),
   algorithm_arg_("", "algorithm", "algorithm to run", true, "", &algo_vals_),
   ambig_base_arg_("", "ambig-base", "ambiguous base", false, "", "string"),
+  progress_file_arg_("", "progress-file", "if set, append a json line with the number of clusters and calculation counts to this file every <progress-interval> seconds (and when we start and finish)", false, "", "string"),
   hamming_fraction_bound_lo_arg_("", "hamming-fraction-bound-lo", "if hamming fraction for a pair is smaller than this, merge them without running hmm", false, 0.0, "float"),
   hamming_fraction_bound_hi_arg_("", "hamming-fraction-bound-hi", "if hamming fraction for a pair is larger than this, skip without running hmm", false, 1.0, "float"),
   max_logprob_drop_arg_("", "max-logprob-drop", "stop glomerating when the total logprob has dropped by this much", false, -1.0, "float"),
@@ -23,6 +25,7 @@ Args::Args(int argc, const char * argv[]):
   n_best_events_arg_("", "n_best_events", "number of candidate recombination events to write to file", false, 1, "int"),
   smc_particles_arg_("", "smc-particles", "number of particles (paths) to run in sequential monte carlo (do not run smc if < 2)", false, 1, "int"),
   naive_hamming_cluster_arg_("", "naive-hamming-cluster", "cluster sequences using naive hamming distance", false, 0, "int"),
+  progress_interval_arg_("", "progress-interval", "seconds between lines in <progress-file>", false, 5, "int"),
   no_chunk_cache_arg_("", "no-chunk-cache", "don't perform chunk caching?", false),
   partition_arg_("", "partition", "", false),
   truncate_seqs_arg_("", "truncate-seqs", "truncate sequences to the same length on either side of the conserved cysteine. NOTE this disables caching, so do *not* turn it on unless you really have different-length sequences", false),
@@ -41,12 +44,15 @@ Args::Args(int argc, const char * argv[]):
 {
   try {
     CmdLine cmd("bcrham -- the fantabulous HMM compiler goes to B-Cellville", ' ', "");
+    if(server_request)
+      cmd.setExceptionHandling(false);  // throw on bad arguments, rather than calling exit() (so that bcrham --server can report a bad request and keep going)
     cmd.add(hmmdir_arg_);
     cmd.add(datadir_arg_);
     cmd.add(infile_arg_);
     cmd.add(outfile_arg_);
     cmd.add(annotationfile_arg_);
     cmd.add(cachefile_arg_);
+    cmd.add(input_cachefile_arg_);
     cmd.add(hamming_fraction_bound_lo_arg_);
     cmd.add(hamming_fraction_bound_hi_arg_);
     cmd.add(max_logprob_drop_arg_);
@@ -56,6 +62,8 @@ Args::Args(int argc, const char * argv[]):
     cmd.add(n_best_events_arg_);
     cmd.add(smc_particles_arg_);
     cmd.add(naive_hamming_cluster_arg_);
+    cmd.add(progress_file_arg_);
+    cmd.add(progress_interval_arg_);
     cmd.add(no_chunk_cache_arg_);
     cmd.add(cache_naive_seqs_arg_);
     cmd.add(no_fwd_arg_);
@@ -71,6 +79,8 @@ Args::Args(int argc, const char * argv[]):
   } catch(ArgException &e) {
     cerr << "ERROR: " << e.error() << " for argument " << e.argId() << endl;
     throw;
+  } catch(ExitException &e) {  // --help or --version with exception handling off (which bcrham --server doesn't pass through to us)
+    exit(e.getExitStatus());
   }
 
   for(auto & head : str_headers_)
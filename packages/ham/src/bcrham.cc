@@ -8,6 +8,8 @@
 #include <ctime>
 #include <fstream>
 #include <cfenv>
+#include <fcntl.h>
+#include <unistd.h>
 
 #include "dphandler.h"
 #include "bcrutils.h"
@@ -66,10 +68,15 @@ vector<vector<Sequence> > GetSeqs(Args &args, Track *trk) {
 
 // ----------------------------------------------------------------------------------------
 void print_forward_scores(double numerator, vector<double> single_scores, double lratio);
+int run_bcrham(Args &args, GermLines &gl, HMMHolder &hmms, Track &track, CacheFileInfo *cache_file_info=nullptr);
+int run_server(int argc, const char * argv[]);
 
 // ----------------------------------------------------------------------------------------
 int main(int argc, const char * argv[]) {
   srand(time(NULL));
+  if(argc > 1 && string(argv[1]) == "--server")
+    return run_server(argc, argv);
+
   Args args(argc, argv);
 
   // init some infrastructure
@@ -77,25 +84,112 @@ int main(int argc, const char * argv[]) {
   Track track("NUKES", characters, "N");
   GermLines gl(args.datadir());
   HMMHolder hmms(args.hmmdir(), gl, &track);
-  // Track *track(hmms.track());
+  return run_bcrham(args, gl, hmms, track);
+}
+
+// ----------------------------------------------------------------------------------------
+// Keep the germline info and hmms in memory, and run requests read from stdin (see python/workerpool.py, which is the other end of this):
+//   bcrham --server --hmmdir <dir> --datadir <dir>
+// Each request is one line of tab-separated fields:
+//   run<TAB><workdir><TAB><arg><TAB><arg>...   run bcrham with these args (which are what you'd give it on the command line, and must use the same hmmdir and datadir),
+//                                               writing its stdout and stderr to <workdir>/out and <workdir>/err
+//   quit                                        exit (as does end of input)
+// and after each run we write one line to stdout:
+//   done<TAB><status><TAB><cpu seconds><TAB><hmm loading cpu seconds>   where status is zero on success (on failure, the error is in <workdir>/err)
+int run_server(int argc, const char * argv[]) {
+  string hmmdir, datadir;
+  for(int iarg = 2; iarg < argc - 1; ++iarg) {
+    if(string(argv[iarg]) == "--hmmdir")
+      hmmdir = argv[iarg + 1];
+    else if(string(argv[iarg]) == "--datadir")
+      datadir = argv[iarg + 1];
+  }
+  if(hmmdir == "" || datadir == "")
+    throw runtime_error("ERROR --server needs --hmmdir and --datadir\n");
+
+  vector<string> characters {"A", "C", "G", "T"};
+  Track track("NUKES", characters, "N");
+  GermLines gl(datadir);
+  HMMHolder hmms(hmmdir, gl, &track);
+  CacheFileInfo cache_file_info;  // so each run only has to read the lines that were added to the cache file since the last one
+
+  // each run's output goes to files in its workdir, so keep a copy of the original stdout and stderr for replies (and to put back after each run)
+  int saved_stdout(dup(1)), saved_stderr(dup(2));
+  FILE *replies(fdopen(dup(1), "w"));
+
+  string line;
+  while(getline(cin, line)) {
+    vector<string> fields(SplitString(line, "\t"));
+    if(fields.size() == 0 || fields[0] == "quit")
+      break;
+    if(fields[0] != "run" || fields.size() < 3)
+      throw runtime_error("ERROR bad request: " + line + "\n");
+
+    cout.flush();
+    fflush(stdout);
+    fflush(stderr);
+    int outfd(open((fields[1] + "/out").c_str(), O_WRONLY | O_CREAT | O_TRUNC, 0644)), errfd(open((fields[1] + "/err").c_str(), O_WRONLY | O_CREAT | O_TRUNC, 0644));
+    if(outfd < 0 || errfd < 0)
+      throw runtime_error("ERROR couldn't open out/err files in " + fields[1] + "\n");
+    dup2(outfd, 1);
+    dup2(errfd, 2);
+    close(outfd);
+    close(errfd);
+
+    clock_t run_start(clock());
+    double load_time_before(hmms.load_time());
+    int status(0);
+    try {
+      vector<const char*> run_argv {"bcrham"};
+      for(size_t ifield = 2; ifield < fields.size(); ++ifield) {
+        if(fields[ifield] == "-h" || fields[ifield] == "--help" || fields[ifield] == "--version")  // these would exit, rather than throw
+          throw runtime_error("ERROR " + fields[ifield] + " isn't allowed in server requests\n");
+        run_argv.push_back(fields[ifield].c_str());
+      }
+      Args args(run_argv.size(), run_argv.data(), true);
+      if(args.hmmdir() != hmmdir || args.datadir() != datadir)
+        throw runtime_error("ERROR request has different hmmdir or datadir (" + args.hmmdir() + ", " + args.datadir() + ") than server (" + hmmdir + ", " + datadir + ")\n");
+      bool separate_input_cache(args.input_cachefile() != "" && args.input_cachefile() != args.cachefile());  // if it reads and writes the same file, the file doesn't just get appended to, so read the whole thing
+      status = run_bcrham(args, gl, hmms, track, separate_input_cache ? &cache_file_info : nullptr);
+    } catch(exception &e) {
+      cerr << e.what() << endl;
+      status = 1;
+    }
+
+    cout.flush();
+    cerr.flush();
+    fflush(stdout);
+    fflush(stderr);
+    dup2(saved_stdout, 1);
+    dup2(saved_stderr, 2);
+    fprintf(replies, "done\t%d\t%.3f\t%.3f\n", status, (clock() - run_start) / (double)CLOCKS_PER_SEC, hmms.load_time() - load_time_before);
+    fflush(replies);
+  }
+
+  fclose(replies);
+  return 0;
+}
+
+// ----------------------------------------------------------------------------------------
+int run_bcrham(Args &args, GermLines &gl, HMMHolder &hmms, Track &track, CacheFileInfo *cache_file_info) {
   vector<vector<Sequence> > qry_seq_list(GetSeqs(args, &track));
   // hmms.CacheAll();
 
   if(args.cache_naive_seqs()) {
-    Glomerator glom(hmms, gl, qry_seq_list, &args, &track);
+    Glomerator glom(hmms, gl, qry_seq_list, &args, &track, cache_file_info);
     glom.CacheNaiveSeqs();
     return 0;
   }
 
   if(args.naive_hamming_cluster() > 0) {
-    Glomerator glom(hmms, gl, qry_seq_list, &args, &track);
+    Glomerator glom(hmms, gl, qry_seq_list, &args, &track, cache_file_info);
     glom.NaiveSeqGlomerate(args.naive_hamming_cluster());
     return 0;
   }
 
   if(args.partition()) {  // NOTE this is kind of hackey -- there's some code duplication between Glomerator and the loop below... but only a little, and they're doing fairly different things, so screw it for the time being
     clock_t run_start(clock());
-    Glomerator glom(hmms, gl, qry_seq_list, &args, &track);
+    Glomerator glom(hmms, gl, qry_seq_list, &args, &track, cache_file_info);
     if(args.smc_particles() == 1) {
       glom.Cluster();
     } else {
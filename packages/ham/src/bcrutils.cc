@@ -417,6 +417,7 @@ void Result::check_boundaries(KSet best, KBounds kbounds) {
 
 // ----------------------------------------------------------------------------------------
 void HMMHolder::CacheAll() {
+  clock_t load_start(clock());
   for(auto & region : gl_.regions_) {
     for(auto & gene : gl_.names_[region]) {
       string infname(hmm_dir_ + "/" + gl_.SanitizeName(gene) + ".yaml");
@@ -427,15 +428,18 @@ void HMMHolder::CacheAll() {
       }
     }
   }
+  load_time_ += (clock() - load_start) / (double)CLOCKS_PER_SEC;
 }
 
 // ----------------------------------------------------------------------------------------
 Model *HMMHolder::Get(string gene, bool debug) {
   if(hmms_.find(gene) == hmms_.end()) {   // if we don't already have it, read it from disk
+    clock_t load_start(clock());
     hmms_[gene] = new Model;
     string infname(hmm_dir_ + "/" + gl_.SanitizeName(gene) + ".yaml");
     // if (true) cout << "    read " << infname << endl;
     hmms_[gene]->Parse(infname);
+    load_time_ += (clock() - load_start) / (double)CLOCKS_PER_SEC;
   }
   return hmms_[gene];
 }
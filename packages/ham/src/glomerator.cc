@@ -3,9 +3,10 @@
 namespace ham {
 
 // ----------------------------------------------------------------------------------------
-Glomerator::Glomerator(HMMHolder &hmms, GermLines &gl, vector<vector<Sequence> > &qry_seq_list, Args *args, Track *track) :
+Glomerator::Glomerator(HMMHolder &hmms, GermLines &gl, vector<vector<Sequence> > &qry_seq_list, Args *args, Track *track, CacheFileInfo *cache_file_info) :
   track_(track),
   args_(args),
+  cache_file_info_(cache_file_info),
   vtb_dph_("viterbi", args_, gl, hmms),
   fwd_dph_("forward", args_, gl, hmms),
   i_initial_partition_(0),
@@ -13,7 +14,12 @@ Glomerator::Glomerator(HMMHolder &hmms, GermLines &gl, vector<vector<Sequence> >
   n_vtb_calculated_(0),
   n_hfrac_calculated_(0),
   n_hamming_merged_(0),
-  progress_file_(fopen((args_->outfile() + ".progress").c_str(), "w"))
+  progress_file_(fopen((args_->outfile() + ".progress").c_str(), "w")),
+  n_fwd_cached_(0),
+  n_vtb_cached_(0),
+  n_clusters_(0),
+  last_progress_write_time_(0),
+  progress_json_file_(args_->progress_file() == "" ? nullptr : fopen(args_->progress_file().c_str(), "a"))  // append, so that if we get rerun the reader doesn't lose its place
 {
   time(&last_status_write_time_);
   ReadCachedLogProbs();
@@ -71,6 +77,9 @@ Glomerator::Glomerator(HMMHolder &hmms, GermLines &gl, vector<vector<Sequence> >
   if(args_->debug())
     for(auto &part : initial_partitions_)
       PrintPartition(part, "initial");
+
+  n_clusters_ = (int)initial_partitions_[0].size();
+  WriteProgress(true, false);
 }
 
 // ----------------------------------------------------------------------------------------
@@ -90,6 +99,10 @@ Glomerator::~Glomerator() {
   // // ----------------------------------------------------------------------------------------
   fclose(progress_file_);
   remove((args_->outfile() + ".progress").c_str());
+
+  WriteProgress(true, true);
+  if(progress_json_file_ != nullptr)
+    fclose(progress_json_file_);
 }
 
 // ----------------------------------------------------------------------------------------
@@ -128,54 +141,104 @@ Partition Glomerator::GetAnInitialPartition(int &initial_path_index, double &log
 
 // ----------------------------------------------------------------------------------------
 void Glomerator::ReadCachedLogProbs() {
-  ifstream ifs(args_->cachefile());
-  if(!ifs.is_open()) {  // this means we don't have any cached results to start with, but we'll write out what we have at the end of the run to this file
+  CacheFileInfo local_info;
+  CacheFileInfo *info(cache_file_info_ != nullptr ? cache_file_info_ : &local_info);
+  if(!info->Update(args_->input_cachefile() != "" ? args_->input_cachefile() : args_->cachefile(), track_)) {  // this means we don't have any cached results to start with, but we'll write out what we have at the end of the run to this file
     cout << "        cachefile d.n.e." << endl;
     return;
   }
+  if(info == &local_info) {  // nobody else needs it, so don't bother copying
+    log_probs_.swap(info->log_probs_);
+    naive_hfracs_.swap(info->naive_hfracs_);
+    naive_seqs_.swap(info->naive_seqs_);
+  } else {
+    log_probs_ = info->log_probs_;
+    naive_hfracs_ = info->naive_hfracs_;
+    naive_seqs_ = info->naive_seqs_;
+  }
+  for(auto &kv : log_probs_)  // (the maps are sorted, so inserting at the end is constant time)
+    initial_log_probs_.insert(initial_log_probs_.end(), kv.first);
+  for(auto &kv : naive_hfracs_)
+    initial_naive_hfracs_.insert(initial_naive_hfracs_.end(), kv.first);
+  for(auto &kv : naive_seqs_)
+    initial_naive_seqs_.insert(initial_naive_seqs_.end(), kv.first);
+  cout << "        read " << log_probs_.size() << " cached logprobs and " << naive_seqs_.size() << " naive seqs";
+  if(info == cache_file_info_)
+    cout << " (" << info->n_new_lines_ << " new lines)";
+  cout << endl;
+}
+
+// ----------------------------------------------------------------------------------------
+void CacheFileInfo::Clear() {
+  log_probs_.clear();
+  naive_hfracs_.clear();
+  naive_seqs_.clear();
+  fname_ = "";
+  offset_ = 0;
+  inode_ = 0;
+}
+
+// ----------------------------------------------------------------------------------------
+bool CacheFileInfo::Update(string fname, Track *track) {
+  n_new_lines_ = 0;
+  struct stat info;
+  if(stat(fname.c_str(), &info) != 0) {
+    Clear();
+    return false;
+  }
+  if(fname != fname_ || info.st_ino != inode_ || info.st_size < offset_) {  // different file, or it was rewritten, so start over
+    Clear();
+    fname_ = fname;
+    inode_ = info.st_ino;
+  }
+  if(info.st_size == offset_)
+    return true;
+
+  ifstream ifs(fname);
+  if(!ifs.is_open()) {
+    Clear();
+    return false;
+  }
+  ifs.seekg(offset_);
   string line;
-  // check the header is right (no cached info)
-  if(!getline(ifs, line)) {
-    cout << "        empty cachefile" << endl;
-    return;  // return for zero length file
-  }
-  line.erase(remove(line.begin(), line.end(), '\r'), line.end());
-  vector<string> headstrs(SplitString(line, ","));
-  assert(headstrs[0].find("unique_ids") == 0);  // each set of unique_ids can appear many times, once for each truncation
-  assert(headstrs[1].find("logprob") == 0);
-  assert(headstrs[2].find("naive_seq") == 0);
-  assert(headstrs[3].find("naive_hfrac") == 0);
-  assert(headstrs[4].find("cyst_position") == 0);
-
-  // NOTE there can be two lines with the same key (say if in one run we calculated the naive seq, and in a later run calculated the log prob)
   while(getline(ifs, line)) {
+    if(ifs.eof())  // no newline at the end, i.e. somebody's still writing it, so leave it for next time
+      break;
+    bool is_header(offset_ == 0);
+    offset_ += line.size() + 1;
     line.erase(remove(line.begin(), line.end(), '\r'), line.end());
+    if(is_header) {  // check the header is right
+      vector<string> headstrs(SplitString(line, ","));
+      assert(headstrs[0].find("unique_ids") == 0);  // each set of unique_ids can appear many times, once for each truncation
+      assert(headstrs[1].find("logprob") == 0);
+      assert(headstrs[2].find("naive_seq") == 0);
+      assert(headstrs[3].find("naive_hfrac") == 0);
+      assert(headstrs[4].find("cyst_position") == 0);
+      continue;
+    }
+
+    // NOTE there can be two lines with the same key (say if in one run we calculated the naive seq, and in a later run calculated the log prob)
     vector<string> column_list = SplitString(line, ",");
     assert(column_list.size() == 6);
     string query(column_list[0]);
 
     string logprob_str(column_list[1]);
-    if(logprob_str.size() > 0) {
+    if(logprob_str.size() > 0)
       log_probs_[query] = stof(logprob_str);
-      initial_log_probs_.insert(query);
-    }
 
     string naive_seq(column_list[2]);
 
     string naive_hfrac_str(column_list[3]);
-    if(naive_hfrac_str.size() > 0) {
+    if(naive_hfrac_str.size() > 0)
       naive_hfracs_[query] = stof(naive_hfrac_str);
-      initial_naive_hfracs_.insert(query);
-    }
 
     int cyst_position(atoi(column_list[4].c_str()));
 
-    if(naive_seq.size() > 0) {
-      naive_seqs_[query] = Sequence(track_, query, naive_seq, cyst_position);
-      initial_naive_seqs_.insert(query);
-    }
+    if(naive_seq.size() > 0)
+      naive_seqs_[query] = Sequence(track, query, naive_seq, cyst_position);
+    ++n_new_lines_;
   }
-  cout << "        read " << log_probs_.size() << " cached logprobs and " << naive_seqs_.size() << " naive seqs" << endl;
+  return true;
 }
 
 // ----------------------------------------------------------------------------------------
@@ -250,6 +313,9 @@ string Glomerator::ClusterSizeString(ClusterPath *path) {
 
 // ----------------------------------------------------------------------------------------
 void Glomerator::WriteStatus(ClusterPath *path) {
+  n_clusters_ = (int)path->CurrentPartition().size();
+  WriteProgress(false, false);
+
   time_t current_time;
   time(&current_time);
   if(difftime(current_time, last_status_write_time_) > 300) {  // write something every five minutes
@@ -264,6 +330,21 @@ void Glomerator::WriteStatus(ClusterPath *path) {
   }
 }
 
+// ----------------------------------------------------------------------------------------
+void Glomerator::WriteProgress(bool force, bool done) {
+  if(progress_json_file_ == nullptr)
+    return;
+  time_t current_time;
+  time(&current_time);
+  if(!force && difftime(current_time, last_progress_write_time_) < args_->progress_interval())
+    return;
+  // NOTE each line is written with one fprintf and then flushed, so a reader only ever sees partial lines at the very end of the file
+  fprintf(progress_json_file_, "{\"time\": %ld, \"clusters\": %d, \"fwd\": %d, \"vtb\": %d, \"fwd_cached\": %d, \"vtb_cached\": %d, \"hamming_merged\": %d, \"done\": %s}\n",
+          (long)current_time, n_clusters_, n_fwd_calculated_, n_vtb_calculated_, n_fwd_cached_, n_vtb_cached_, n_hamming_merged_, done ? "true" : "false");
+  fflush(progress_json_file_);
+  last_progress_write_time_ = current_time;
+}
+
 // ----------------------------------------------------------------------------------------
 void Glomerator::WriteCachedLogProbs() {
   ofstream log_prob_ofs(args_->cachefile());
@@ -396,6 +477,7 @@ string Glomerator::ParentalString(pair<string, string> *parents) {
 void Glomerator::GetNaiveSeq(string queries, pair<string, string> *parents) {
   // <queries> is colon-separated list of query names
   if(naive_seqs_.count(queries)) {  // already did it (note that it's ok to cache naive seqs even when we're truncating, since each sequence, when part of a given group of sequence, always has the same length [it's different for forward because each key is compared in the likelihood ratio to many other keys, and each time its sequences can potentially have a different length]. In other words the difference is because we only calculate the naive sequence for sets of sequences that we've already merged.)
+    ++n_vtb_cached_;
     return;
   }
 
@@ -423,6 +505,7 @@ void Glomerator::GetNaiveSeq(string queries, pair<string, string> *parents) {
   }
 
   ++n_vtb_calculated_;
+  WriteProgress(false, false);
 
   Result result(kbinfo_[queries]);
   bool stop(false);
@@ -448,9 +531,11 @@ void Glomerator::GetNaiveSeq(string queries, pair<string, string> *parents) {
 void Glomerator::GetLogProb(string name, vector<Sequence> &seqs, KBounds &kbounds, vector<string> &only_genes, double mean_mute_freq) {
   // NOTE that when this improves the kbounds, that info doesn't get propagated to <kbinfo_>
   if(log_probs_.count(name)) {  // already did it (see note in GetNaiveSeq above)
+    ++n_fwd_cached_;
     return;
   }
   ++n_fwd_calculated_;
+  WriteProgress(false, false);  // (single calculations can take a while, so we don't want to only write between merges)
     
   Result result(kbounds);
   bool stop(false);
@@ -2,10 +2,9 @@ import sys
 import csv
 import math
 from subprocess import check_call
-from sklearn.metrics.cluster import adjusted_mutual_info_score
 
 import utils
-import plotting
+import hamming
 from opener import opener
 
 # ----------------------------------------------------------------------------------------
@@ -42,26 +41,26 @@ def vollmers(info, threshold, reco_info=None, debug=False):
             raise Exception('ERROR bad cdr3 sequence %s %d' % (cdr3_seq, info[uid]['cdr3_length']))
         return cdr3_seq
 
+    encoded_seqs = hamming.EncodedSeqs({uid : get_d_plus_insertions(uid) for uid in info})  # encode each d + insertions once, rather than every time we compare it
+
     def from_same_lineage(cluster_id, uid):
-        for clid in id_clusters[cluster_id]:  # loop over seqs already in the cluster (it only has to match one of 'em)
+        candidates = []  # seqs already in the cluster with the same cdr3 length, v gene, and j gene, and with d + insertions of the same length (it only has to match one of 'em)
+        iuid = encoded_seqs.index[uid]
+        for clid in id_clusters[cluster_id]:
             is_match = True
-            for key in ('cdr3_length', 'v_gene', 'j_gene'):  # same cdr3 length, v gene, and j gene
+            for key in ('cdr3_length', 'v_gene', 'j_gene'):
                 if info[clid][key] != info[uid][key]:
                     is_match = False
                     break
             if not is_match:
                 continue
-            cl_seq = get_d_plus_insertions(clid)
-            u_seq = get_d_plus_insertions(uid)
-            if len(cl_seq) != len(u_seq):
-                continue
-            hamming_frac = utils.hamming_fraction(cl_seq, u_seq)
-            if hamming_frac > 1. - threshold:
+            if encoded_seqs.lengths[encoded_seqs.index[clid]] != encoded_seqs.lengths[iuid]:
                 continue
-
-            return True  # if we get to here, it's a match
-
-        return False
+            candidates.append(encoded_seqs.index[clid])
+        if len(candidates) == 0:
+            return False
+        hamming_fracs = encoded_seqs.one_vs_many(iuid, candidates)
+        return (hamming_fracs <= 1. - threshold).any()
 
     def check_unclustered_seqs():
         """ loop through all unclustered sequences, adding them to the most recently created cluster """
@@ -106,6 +105,7 @@ def vollmers(info, threshold, reco_info=None, debug=False):
             for uid in uids:
                 true_cluster_list.append(reco_info[uid]['reco_id'])
                 inferred_cluster_list.append(clid)
+        from sklearn.metrics.cluster import adjusted_mutual_info_score  # slow to import, so only do it when we need it
         adj_mi = adjusted_mutual_info_score(true_cluster_list, inferred_cluster_list)
         print '       threshold  %.2f:   %d clusters (%d true)   adj_mi: %.3f' % (threshold, len(set(inferred_cluster_list)), len(set(true_cluster_list)), adj_mi)
 
@@ -2,17 +2,257 @@ import os
 import sys
 import math
 import csv
+import bisect
+import numpy
 
 import utils
 from opener import opener
+from uidmap import default_uidmap, EncodedPartition, encode_partition, encode_partition_str, decode_partition_str
+
+# ----------------------------------------------------------------------------------------
+class PartitionDelta(object):
+    """
+    The difference between a partition and the one before it in a path: a list of segments, each of which is either a run of consecutive clusters from the
+    previous partition (stored as [start, stop)), or a new cluster (stored as [-1 - inew, 0]).
+    Each new cluster is in turn a list of pieces, each of which is either the index of a whole cluster from the previous partition (if >= 0), or a single
+    integer id (stored as -1 - id), so that merging two clusters only costs a couple of entries regardless of their size.
+    """
+    __slots__ = ('segments', 'pieces', 'piece_bounds')
+
+    def __init__(self, segments, pieces, piece_bounds):
+        self.segments = segments  # int32 array of shape (n_segments, 2)
+        self.pieces = pieces  # int32 array with the pieces of all the new clusters
+        self.piece_bounds = piece_bounds  # new cluster <inew> is made of pieces[piece_bounds[inew] : piece_bounds[inew + 1]]
+
+    # ----------------------------------------------------------------------------------------
+    def apply(self, previous):
+        """ return the EncodedPartition that you get by applying this delta to the EncodedPartition <previous> """
+        previous_sizes = previous.cluster_sizes()
+        id_pieces, size_pieces = [], []
+        for start, stop in self.segments:
+            if start >= 0:
+                id_pieces.append(previous.ids[previous.bounds[start] : previous.bounds[stop]])
+                size_pieces.append(previous_sizes[start : stop])
+            else:
+                inew = -1 - start
+                new_size = 0
+                for piece in self.pieces[self.piece_bounds[inew] : self.piece_bounds[inew + 1]]:
+                    chunk = previous.cluster(piece) if piece >= 0 else numpy.array([-1 - piece], dtype=numpy.int32)
+                    id_pieces.append(chunk)
+                    new_size += len(chunk)
+                size_pieces.append(numpy.array([new_size], dtype=numpy.int32))
+        sizes = numpy.concatenate(size_pieces + [numpy.zeros(0, dtype=numpy.int32)])
+        bounds = numpy.zeros(len(sizes) + 1, dtype=numpy.int32)
+        numpy.cumsum(sizes, out=bounds[1:])
+        return EncodedPartition(numpy.concatenate(id_pieces + [numpy.zeros(0, dtype=numpy.int32)]).astype(numpy.int32), bounds)
+
+    # ----------------------------------------------------------------------------------------
+    def nbytes(self):
+        return self.segments.nbytes + self.pieces.nbytes + self.piece_bounds.nbytes
+
+# ----------------------------------------------------------------------------------------
+class PartitionHistory(object):
+    """
+    The partitions in a ClusterPath. Every <checkpoint_interval> steps we store a full EncodedPartition (a checkpoint), and in between only the PartitionDelta
+    from the previous partition, which for a glomeration step is a few runs of unchanged clusters plus the newly-merged cluster (as a list of the clusters
+    that were merged). So a path with thousands of steps takes roughly linear, rather than quadratic, memory.
+    Partitions are materialized from the nearest checkpoint when you ask for them, and we cache the last one, so going through them in order (e.g. when
+    writing) only applies one delta per partition.
+    Partitions read from a file are appended as their partition strings, which we leave alone until somebody needs the EncodedPartition (at which point we
+    intern the ids and replace the string), since interning every id in every line of a big file is slower than the rest of reading it put together, and
+    often only the best partition ends up being used (which you can decode straight from its string with peek()).
+    """
+    def __init__(self, uidmap=default_uidmap, checkpoint_interval=100):
+        self.uidmap = uidmap
+        self.checkpoint_interval = checkpoint_interval
+        self.steps = []  # for each partition, either an EncodedPartition (a checkpoint), a partition string (also a checkpoint), or a PartitionDelta
+        self.checkpoints = []  # indices in self.steps of the checkpoints
+        self.cached_index, self.cached_partition = None, None  # the last partition that we materialized
+        self.last_partition, self.last_labels = None, None  # the last partition that was appended, and the index of the cluster in it for each integer id (-1 if it isn't in it)
+
+    # ----------------------------------------------------------------------------------------
+    def __len__(self):
+        return len(self.steps)
+
+    # ----------------------------------------------------------------------------------------
+    def get_delta(self, ptn):
+        """ return the PartitionDelta from the last partition to <ptn> (or None, if it wouldn't be much smaller than just storing <ptn>) """
+        previous, labels = self.last_partition, self.last_labels
+        sizes = ptn.cluster_sizes()
+        if len(ptn) == 0 or (sizes == 0).any() or len(previous) == 0:
+            return None
+        previous_sizes = previous.cluster_sizes()
+
+        # find the clusters that are identical (including order) to one in the previous partition
+        id_labels = numpy.where(ptn.ids < len(labels), labels[numpy.minimum(ptn.ids, len(labels) - 1)], -1)  # for each id in <ptn>, its cluster index in <previous>
+        first_labels = id_labels[ptn.bounds[:-1]]  # previous cluster index of the first id in each cluster
+        same_size = (first_labels >= 0) & (previous_sizes[numpy.maximum(first_labels, 0)] == sizes)
+        id_clusters = ptn.cluster_labels()
+        expected_positions = previous.bounds[numpy.maximum(first_labels, 0)][id_clusters] + numpy.arange(ptn.n_seqs()) - ptn.bounds[id_clusters]  # where each id should be in previous.ids if its cluster is unchanged
+        matches = previous.ids[numpy.minimum(expected_positions, previous.n_seqs() - 1)] == ptn.ids
+        unchanged = same_size & numpy.logical_and.reduceat(matches, ptn.bounds[:-1])
+        n_changed = int(len(ptn) - unchanged.sum())
+        if 4 * n_changed + 1 >= (ptn.n_seqs() + len(ptn)) / 2:  # each new cluster takes at least a segment, a piece, and a piece bound, so don't bother working it out if it's not going to be worth it anyway (see below)
+            return None
+
+        # group consecutive unchanged clusters into runs, each of which is one segment (and each new cluster is a segment on its own)
+        continues_run = numpy.zeros(len(ptn), dtype=bool)
+        continues_run[1:] = unchanged[1:] & unchanged[:-1] & (first_labels[1:] == first_labels[:-1] + 1)
+        segment_starts = numpy.nonzero(~continues_run)[0]
+        segment_lengths = numpy.diff(numpy.append(segment_starts, len(ptn)))
+        is_run = unchanged[segment_starts]
+        inews = numpy.cumsum(~is_run) - 1  # index among the new clusters
+        segments = numpy.where(is_run[:, None], numpy.array([first_labels[segment_starts], first_labels[segment_starts] + segment_lengths]).T, numpy.array([-1 - inews, numpy.zeros(len(inews), dtype=int)]).T)
+
+        # split each new cluster into runs of ids from the same previous cluster: each run is either that entire cluster (in the same order), or we store the ids individually
+        isel = numpy.nonzero(~unchanged[id_clusters])[0]  # positions in ptn.ids of the ids in new clusters
+        sel_clusters, sel_labels = id_clusters[isel], id_labels[isel]
+        starts_cluster = numpy.ones(len(isel), dtype=bool)
+        starts_cluster[1:] = sel_clusters[1:] != sel_clusters[:-1]
+        starts_run = starts_cluster.copy()
+        starts_run[1:] |= sel_labels[1:] != sel_labels[:-1]
+        run_starts = numpy.nonzero(starts_run)[0]
+        run_lengths = numpy.diff(numpy.append(run_starts, len(isel)))
+        iprevs = sel_labels[run_starts]
+        offsets = numpy.arange(len(isel)) - numpy.repeat(run_starts, run_lengths)  # position of each id within its run
+        expected_positions = previous.bounds[numpy.maximum(sel_labels, 0)] + offsets
+        in_place = previous.ids[numpy.minimum(expected_positions, previous.n_seqs() - 1)] == ptn.ids[isel]
+        whole = (iprevs >= 0) & (run_lengths == previous_sizes[numpy.maximum(iprevs, 0)])
+        if len(run_starts) > 0:
+            whole &= numpy.logical_and.reduceat(in_place, run_starts)
+        id_whole = numpy.repeat(whole, run_lengths)
+        keep = ~id_whole | (offsets == 0)  # whole runs are just their first entry (which becomes the previous cluster's index)
+        pieces = numpy.where(id_whole, numpy.repeat(iprevs, run_lengths), -1 - ptn.ids[isel])[keep]
+        n_new = int((~is_run).sum())
+        piece_bounds = numpy.zeros(n_new + 1, dtype=int)
+        numpy.cumsum(numpy.bincount((numpy.cumsum(starts_cluster) - 1)[keep], minlength=n_new), out=piece_bounds[1:])  # (index among the new clusters of each piece)
+        if 2 * len(segments) + len(pieces) + len(piece_bounds) >= (ptn.n_seqs() + len(ptn)) / 2:  # not worth it
+            return None
+        return PartitionDelta(segments.astype(numpy.int32).reshape(len(segments), 2), pieces.astype(numpy.int32), piece_bounds.astype(numpy.int32))
+
+    # ----------------------------------------------------------------------------------------
+    def append(self, ptn):
+        """ add <ptn>, either an EncodedPartition or a partition string (see uidmap.encode_partition_str()) """
+        if isinstance(ptn, str):
+            self.checkpoints.append(len(self.steps))
+            self.steps.append(ptn)
+            self.last_partition, self.last_labels = None, None  # so the next one won't be a delta (it'd mean encoding this one)
+            return
+        delta = None
+        if self.last_partition is not None and len(self.steps) - self.checkpoints[-1] < self.checkpoint_interval:
+            delta = self.get_delta(ptn)
+        if delta is None:
+            self.checkpoints.append(len(self.steps))
+            self.steps.append(ptn)
+        else:
+            self.steps.append(delta)
+        self.last_partition = ptn
+        self.last_labels = numpy.full(ptn.ids.max() + 1 if ptn.n_seqs() > 0 else 0, -1, dtype=numpy.int32)
+        self.last_labels[ptn.ids] = ptn.cluster_labels()
+        self.cached_index, self.cached_partition = len(self.steps) - 1, ptn
+
+    # ----------------------------------------------------------------------------------------
+    def check_index(self, ip):
+        if ip < 0:
+            ip += len(self.steps)
+        if ip < 0 or ip >= len(self.steps):
+            raise IndexError('partition index %d out of range for path with %d partitions' % (ip, len(self.steps)))
+        return ip
+
+    # ----------------------------------------------------------------------------------------
+    def peek(self, ip):
+        """ return partition <ip> as its partition string if it hasn't been encoded yet, otherwise as an EncodedPartition """
+        ip = self.check_index(ip)
+        if isinstance(self.steps[ip], str):
+            return self.steps[ip]
+        return self[ip]
+
+    # ----------------------------------------------------------------------------------------
+    def __getitem__(self, ip):
+        ip = self.check_index(ip)
+        if ip == self.cached_index:
+            return self.cached_partition
+        icheck = self.checkpoints[bisect.bisect_right(self.checkpoints, ip) - 1]  # most recent checkpoint at or before <ip>
+        if self.cached_index is not None and icheck <= self.cached_index < ip:  # start from the cached partition if it's between the checkpoint and <ip>
+            istart, ptn = self.cached_index, self.cached_partition
+        else:
+            if isinstance(self.steps[icheck], str):
+                self.steps[icheck] = encode_partition_str(self.steps[icheck], self.uidmap)
+            istart, ptn = icheck, self.steps[icheck]
+        for istep in range(istart + 1, ip + 1):
+            ptn = self.steps[istep].apply(ptn)
+        self.cached_index, self.cached_partition = ip, ptn
+        return ptn
+
+    # ----------------------------------------------------------------------------------------
+    def __iter__(self):
+        for ip in range(len(self.steps)):
+            yield self[ip]
+
+    # ----------------------------------------------------------------------------------------
+    def pop(self, ip):
+        """ only popping the first partition is implemented (it's all we need, and it only requires making the second one into a checkpoint) """
+        if ip != 0:
+            raise Exception('can only pop the first partition from a partition history (not %d)' % ip)
+        if len(self.steps) > 1 and isinstance(self.steps[1], PartitionDelta):
+            self.steps[1] = self[1]
+            bisect.insort(self.checkpoints, 1)
+        first = self.steps.pop(0)  # the first partition is always a checkpoint
+        self.checkpoints = [ic - 1 for ic in self.checkpoints if ic > 0]
+        if self.cached_index is not None:
+            self.cached_index = None if self.cached_index == 0 else self.cached_index - 1
+            if self.cached_index is None:
+                self.cached_partition = None
+        if len(self.steps) == 0:
+            self.last_partition, self.last_labels = None, None
+        return first
+
+    # ----------------------------------------------------------------------------------------
+    def nbytes(self):
+        return sum([len(step) if isinstance(step, str) else step.nbytes() for step in self.steps])
+
+# ----------------------------------------------------------------------------------------
+class DecodedPartitions(object):
+    """
+    read-only, list-like view of a ClusterPath's partitions, which decodes each (integer-encoded) partition to a list of lists of unique ids when you ask for it
+    We keep the last one that we decoded, since callers tend to ask for the same one (e.g. self.partitions[self.i_best]) over and over.
+    Partitions that are still strings from a file are split up directly, without encoding them.
+    """
+    def __init__(self, cpath):
+        self.cpath = cpath
+        self.cached_encoded, self.cached_decoded = None, None
+
+    # ----------------------------------------------------------------------------------------
+    def __len__(self):
+        return len(self.cpath.encoded_partitions)
+
+    # ----------------------------------------------------------------------------------------
+    def __getitem__(self, ip):
+        encoded = self.cpath.encoded_partitions.peek(ip)
+        if encoded is not self.cached_encoded:  # EncodedPartitions (and strs) are immutable, so if it's the same instance it's the same partition
+            self.cached_encoded, self.cached_decoded = encoded, self.decode(encoded)
+        return self.cached_decoded
+
+    # ----------------------------------------------------------------------------------------
+    def __iter__(self):
+        for ip in range(len(self)):
+            yield self.decode(self.cpath.encoded_partitions.peek(ip))
+
+    # ----------------------------------------------------------------------------------------
+    def decode(self, encoded):
+        if isinstance(encoded, str):
+            return decode_partition_str(encoded)
+        return encoded.decode(self.cpath.uidmap)
 
 # ----------------------------------------------------------------------------------------
 class ClusterPath(object):
-    def __init__(self, initial_path_index=0):
+    def __init__(self, initial_path_index=0, uidmap=None):
         self.initial_path_index = initial_path_index  # NOTE this is set to None if it's nonsensical, e.g. if we're merging several paths with different indices
+        self.uidmap = default_uidmap if uidmap is None else uidmap  # NOTE paths that share partitions (or are merged) need to use the same map
 
         # NOTE make *damn* sure if you add another list here that you also take care of it in remove_first_partition()
-        self.partitions = []  # it would of course be damn nice to glomph these into a class at some point
+        self.encoded_partitions = PartitionHistory(self.uidmap)  # list-like, with each partition an EncodedPartition of integer ids (see uidmap.py), although internally it mostly stores the differences between them
+        self.partitions = DecodedPartitions(self)  # ...but you can still get lists of lists of string ids from self.partitions[ip] (just don't try to modify them in place)
         self.logprobs = []
         self.n_procs = []
         self.adj_mis = []
@@ -29,7 +269,7 @@ class ClusterPath(object):
         if math.isinf(self.logprobs[self.i_best]):  # if logprob is infinite, set best and best minus x to the latest one
             self.i_best_minus_x = self.i_best
             return
-        for ip in range(len(self.partitions)):  # they should be in order of increasing logprob (at least within a give number of procs)
+        for ip in range(len(self.encoded_partitions)):  # they should be in order of increasing logprob (at least within a give number of procs)
             if self.n_procs[ip] != self.n_procs[self.i_best]:  # only consider partitions with the same number of procs (e.g. if best partition is for 1 proc, we want the best-minus-x to also be for 1 proc)
                 continue
             if self.logprobs[ip] > self.logprobs[self.i_best] - self.best_minus:  # pick the first one that is above threshold
@@ -38,8 +278,11 @@ class ClusterPath(object):
 
     # ----------------------------------------------------------------------------------------
     def add_partition(self, partition, logprob, n_procs, logweight=None, adj_mi=None, ccfs=[None, None]):
+        """ <partition> is either a list of lists of unique ids, an EncodedPartition (which must come from a path with the same uid map), or a partition string from a file (which gets encoded when it's needed) """
         # NOTE you typically want to allow duplicate (in terms of log prob) partitions, since they can have different n procs
-        self.partitions.append(partition)
+        if not isinstance(partition, (EncodedPartition, str)):
+            partition = encode_partition(partition, self.uidmap)
+        self.encoded_partitions.append(partition)
         self.logprobs.append(logprob)
         self.n_procs.append(n_procs)
         self.logweights.append(logweight)
@@ -50,14 +293,14 @@ class ClusterPath(object):
         # set this as the best partition if 1) we haven't set i_best yet 2) this partition is more likely than i_best 3) i_best is set for a larger number of procs or 4) logprob is infinite (i.e. it's probably point/vsearch partis)
         # NOTE we always treat the most recent partition with infinite logprob as the best
         if self.i_best is None or logprob > self.logprobs[self.i_best] or n_procs < self.n_procs[self.i_best] or math.isinf(logprob):
-            self.i_best = len(self.partitions) - 1
+            self.i_best = len(self.encoded_partitions) - 1
         self.update_best_minus_x_partition()
 
     # ----------------------------------------------------------------------------------------
     def remove_first_partition(self):
         # NOTE after you do this, none of the 'best' shit is any good any more
         # NOTE also that this is only used for smc
-        self.partitions.pop(0)
+        self.encoded_partitions.pop(0)
         self.logprobs.pop(0)
         self.n_procs.pop(0)
         self.adj_mis.pop(0)
@@ -65,20 +308,30 @@ class ClusterPath(object):
         self.logweights.pop(0)
         assert self.n_lists == 6  # make sure we didn't add another list and forget to put it in here
 
+    # ----------------------------------------------------------------------------------------
+    def expand_duplicates(self, duplicates):
+        """ add the duplicate sequences that were collapsed before running (see utils.collapse_duplicate_seqs()) back into each cluster in each partition """
+        if len(duplicates) == 0:
+            return
+        collapsed_partitions = self.encoded_partitions
+        self.encoded_partitions = PartitionHistory(self.uidmap)
+        for ip in range(len(collapsed_partitions)):
+            self.encoded_partitions.append(encode_partition([utils.expand_duplicate_ids(cluster, duplicates) for cluster in collapsed_partitions[ip].decode(self.uidmap)], self.uidmap))
+            self.adj_mis[ip] = None  # these were calculated on the collapsed partitions, so they're no longer valid
+            self.ccfs[ip] = [None, None]
+
     # ----------------------------------------------------------------------------------------
     def readfile(self, fname):
         with opener('r')(fname) as infile:
             reader = csv.DictReader(infile)
-            lines = [line for line in reader]
-            self.readlines(lines)
+            self.readlines(reader)  # read one line at a time (each partition stays a string until something needs it encoded, see PartitionHistory)
 
     # ----------------------------------------------------------------------------------------
     def readlines(self, lines):
         for line in lines:
             if 'path_index' in line and int(line['path_index']) != self.initial_path_index:  # if <lines> contains more than one path_index, that means they represent more than one path, so you need to use glomerator, not just one ClusterPath
                 raise Exception('path index in lines %d doesn\'t match my initial path index %d' % (int(line['path_index']), self.initial_path_index))
-            partitionstr = line['partition'] if 'partition' in line else line['clusters']  # backwards compatibility -- used to be 'clusters' and there's still a few old files floating around
-            partition = [cluster_str.split(':') for cluster_str in partitionstr.split(';')]
+            partition = line['partition'] if 'partition' in line else line['clusters']  # backwards compatibility -- used to be 'clusters' and there's still a few old files floating around
             adj_mi = None
             if 'adj_mi' in line and line['adj_mi'] != '' and float(line['adj_mi']) != -1.:
                 adj_mi = float(line['adj_mi'])
@@ -90,7 +343,7 @@ class ClusterPath(object):
 
     # ----------------------------------------------------------------------------------------
     def calculate_missing_values(self, reco_info, only_ip=None):
-        for ip in range(len(self.partitions)):
+        for ip in range(len(self.encoded_partitions)):
             if only_ip is not None and ip != only_ip:
                 continue
 
@@ -98,10 +351,11 @@ class ClusterPath(object):
                 assert self.ccfs[ip][0] is not None and self.ccfs[ip][1] is not None
                 continue
 
-            true_partition = utils.get_true_partition(reco_info, ids=[uid for cluster in self.partitions[ip] for uid in cluster])
-            self.adj_mis[ip] = utils.adjusted_mutual_information(self.partitions[ip], true_partition)
+            partition = self.partitions[ip]
+            true_partition = utils.get_true_partition(reco_info, ids=[uid for cluster in partition for uid in cluster])
+            self.adj_mis[ip] = utils.adjusted_mutual_information(partition, true_partition)
             assert self.ccfs[ip] == [None, None]
-            self.ccfs[ip] = utils.correct_cluster_fractions(self.partitions[ip], reco_info)
+            self.ccfs[ip] = utils.correct_cluster_fractions(partition, reco_info)
             self.we_have_an_adj_mi = True
 
     # ----------------------------------------------------------------------------------------
@@ -198,15 +452,15 @@ class ClusterPath(object):
     def get_surrounding_partitions(self, n_partitions):
         """ return a list of partition indices centered on <self.i_best> of length <n_partitions> """
         if n_partitions is None:  # print all partitions
-            ilist = range(len(self.partitions))
+            ilist = range(len(self.encoded_partitions))
         else:  # print the specified number surrounding the maximum logprob
-            if n_partitions < 0 or n_partitions >= len(self.partitions):
-                n_partitions = len(self.partitions)
+            if n_partitions < 0 or n_partitions >= len(self.encoded_partitions):
+                n_partitions = len(self.encoded_partitions)
             ilist = [self.i_best, ]
             while len(ilist) < n_partitions:  # add partition numbers before and after <i_best> until we get to <n_partitions>
                 if ilist[0] > 0:  # stop adding them beforehand if we've hit the first partition
                     ilist.insert(0, ilist[0] - 1)
-                if len(ilist) < n_partitions and ilist[-1] < len(self.partitions) - 1:  # don't add them afterward if we already have enough, or if we're already at the end
+                if len(ilist) < n_partitions and ilist[-1] < len(self.encoded_partitions) - 1:  # don't add them afterward if we already have enough, or if we're already at the end
                     ilist.append(ilist[-1] + 1)
 
         return ilist
@@ -216,13 +470,14 @@ class ClusterPath(object):
         """ Return the parent clusters that were merged to form the <ipart>th partition. """
         if ipart == 0:
             raise Exception('get_parent_clusters got ipart of zero... that don\'t make no sense yo')
-        if len(self.partitions[ipart - 1]) <= len(self.partitions[ipart]):
+        if len(self.encoded_partitions[ipart - 1]) <= len(self.encoded_partitions[ipart]):
             return None  # this step isn't a merging step -- it's a synthetic rewinding step due to multiple processes
 
+        current_clusters = set(self.encoded_partitions[ipart].cluster_tuples())
         parents = []
-        for cluster in self.partitions[ipart - 1]:  # find all clusters in the previous partition that aren't in the current one
-            if cluster not in self.partitions[ipart]:
-                parents.append(cluster)
+        for cluster in self.encoded_partitions[ipart - 1].cluster_tuples():  # find all clusters in the previous partition that aren't in the current one
+            if cluster not in current_clusters:
+                parents.append(self.uidmap.get_uids(cluster))
         assert len(parents) == 2  # there should've been two -- those're the two that were merged to form the new cluster
         return parents
 
@@ -231,19 +486,18 @@ class ClusterPath(object):
         # TODO switch clusterpath.cc back to using these
         def potential_n_parents(partition):
             combifactor = 0
-            for cluster in partition:
-                n_k = len(cluster)
-                combifactor += pow(2, n_k - 1) - 1
+            for n_k in partition.cluster_sizes():
+                combifactor += pow(2, int(n_k) - 1) - 1
             if combifactor == 0:
                 combifactor = 1
             return combifactor
 
-        for ip in range(len(self.partitions)):
+        for ip in range(len(self.encoded_partitions)):
             if ip == 0:
                 last_logweight = 0.
             else:
                 last_logweight = self.logweights[ip-1]
-            this_logweight = last_logweight + math.log(1. / potential_n_parents(self.partitions[ip]))
+            this_logweight = last_logweight + math.log(1. / potential_n_parents(self.encoded_partitions[ip]))
             self.logweights[ip] = this_logweight
 
     # ----------------------------------------------------------------------------------------
@@ -279,11 +533,7 @@ class ClusterPath(object):
         # ----------------------------------------------------------------------------------------
         for ipart in self.get_surrounding_partitions(n_partitions=n_to_write):
             part = self.partitions[ipart]
-            cluster_str = ''
-            for ic in range(len(part)):
-                if ic > 0:
-                    cluster_str += ';'
-                cluster_str += ':'.join(part[ic])
+            cluster_str = ';'.join([':'.join(cluster) for cluster in part])
 
             row = {'logprob' : self.logprobs[ipart],
                    'n_clusters' : len(part),
@@ -304,3 +554,8 @@ class ClusterPath(object):
                 row['logweight'] = self.logweights[ipart]
 
             writer.writerow(row)
+
+    # ----------------------------------------------------------------------------------------
+    def nbytes(self):
+        """ memory used by the partitions' integer arrays (the uid strings themselves are stored once, in the uid map) """
+        return self.encoded_partitions.nbytes()
@@ -0,0 +1,148 @@
+""" Merge csv files that share a header, either by concatenating them or by sorting and removing duplicate lines, without forking any shell pipelines and in bounded memory """
+import os
+import time
+import heapq
+import tempfile
+
+buffer_size = 1 << 20  # bytes of output buffering
+max_bytes_in_memory = 2.5e7  # when dereplicating, sort runs of at most about this many bytes of lines in memory, and spill them to temporary files
+
+# ----------------------------------------------------------------------------------------
+def open_csv(fname, mode):
+    """ open <fname>, with compression based on its extension (like opener.opener(), but without importing Bio) """
+    if fname.endswith('.gz'):
+        import gzip
+        return gzip.open(fname, mode)
+    elif fname.endswith('.bz2'):
+        import bz2
+        return bz2.BZ2File(fname, mode)
+    else:
+        return open(fname, mode, buffer_size if 'r' not in mode else -1)
+
+# ----------------------------------------------------------------------------------------
+def read_header(fname, strip=True):
+    """ return the header line of <fname> (without the line ending, if <strip>), or None if it doesn't exist or is empty """
+    if not os.path.exists(fname) or os.path.getsize(fname) == 0:
+        return None
+    with open_csv(fname, 'r') as infile:
+        line = infile.readline()
+    return line.rstrip('\r\n') if strip else line
+
+# ----------------------------------------------------------------------------------------
+def check_first_line(fname, first_line, header):
+    if first_line.rstrip('\r\n') != header:  # this is an exact string comparison, so (unlike grep) it doesn't care if the header has regex characters in it
+        raise Exception('header in %s doesn\'t match the other files:\n    %s\n    %s' % (fname, first_line.rstrip('\r\n'), header))
+
+# ----------------------------------------------------------------------------------------
+def iterlines(fnames, header):
+    """ yield the non-header lines from each of <fnames> (skipping ones that don't exist), making sure each ends with a newline """
+    for fname in fnames:
+        if not os.path.exists(fname) or os.path.getsize(fname) == 0:
+            continue
+        with open_csv(fname, 'r') as infile:
+            check_first_line(fname, infile.readline(), header)
+            for line in infile:
+                if line.strip() == '':
+                    continue
+                if line[-1] != '\n':  # last line of a file without a trailing newline
+                    line += '\n'
+                yield line
+
+# ----------------------------------------------------------------------------------------
+def copy_body(fname, header, outfile):
+    """ append everything but the header line of <fname> to <outfile> in big chunks (without splitting it into lines), and return the number of lines """
+    n_lines = 0
+    last_char = '\n'
+    with open_csv(fname, 'r') as infile:
+        check_first_line(fname, infile.readline(), header)
+        while True:
+            chunk = infile.read(buffer_size)
+            if chunk == '':
+                break
+            outfile.write(chunk)
+            n_lines += chunk.count('\n')
+            last_char = chunk[-1]
+    if last_char != '\n':  # no trailing newline
+        outfile.write('\n')
+        n_lines += 1
+    return n_lines
+
+# ----------------------------------------------------------------------------------------
+def sorted_runs(lines, workdir):
+    """ sort <lines> in chunks of about <max_bytes_in_memory>, and return a list of iterators over the sorted chunks (all but the last of which are in temporary files) """
+    runs = []
+    chunk, chunk_bytes = [], 0
+    for line in lines:
+        chunk.append(line)
+        chunk_bytes += len(line)
+        if chunk_bytes >= max_bytes_in_memory:
+            chunk.sort()
+            runfile = tempfile.TemporaryFile(dir=workdir)  # deleted as soon as it's closed
+            runfile.writelines(chunk)
+            runfile.seek(0)
+            runs.append(runfile)
+            chunk, chunk_bytes = [], 0
+    chunk.sort()
+    runs.append(iter(chunk))
+    return runs
+
+# ----------------------------------------------------------------------------------------
+def uniq(sorted_lines):
+    """ skip adjacent duplicates (like uniq) """
+    previous = None
+    for line in sorted_lines:
+        if line != previous:
+            yield line
+        previous = line
+
+# ----------------------------------------------------------------------------------------
+def merge_csvs(infnames, outfname, dereplicate=False, remove_infiles=False, debug=False):
+    """
+    Merge the csv files <infnames> (some of which may not exist) into <outfname>, and return the number of (non-header) lines written.
+    If <outfname> is among <infnames> and exists, the others are appended to it, otherwise it's overwritten.
+    If <dereplicate>, the lines are instead sorted and duplicates removed (with an external merge sort, so memory use doesn't depend on the file sizes), and the
+    result written to a temporary file which is then renamed to <outfname>.
+    """
+    start = time.time()
+    header_line = None
+    for fname in infnames:
+        header_line = read_header(fname, strip=False)
+        if header_line is not None:  # just need one of them to get the header (some may be zero length)
+            break
+    if header_line is None:
+        raise Exception('no non-empty files among %s' % ' '.join(infnames))
+    header = header_line.rstrip('\r\n')
+    if header_line[-1] != '\n':  # otherwise we keep its line ending (csv.DictWriter uses \r\n)
+        header_line += '\n'
+
+    n_lines = 0
+    if dereplicate:
+        tmpfname = outfname + '.tmp'
+        runs = sorted_runs(iterlines(infnames, header), os.path.dirname(os.path.abspath(outfname)))
+        with open_csv(tmpfname, 'w') as outfile:
+            outfile.write(header_line)
+            for line in uniq(heapq.merge(*runs)):
+                outfile.write(line)
+                n_lines += 1
+        for run in runs:
+            if hasattr(run, 'close'):
+                run.close()
+        os.rename(tmpfname, outfname)
+    else:
+        append = outfname in infnames and read_header(outfname) is not None
+        if append:
+            infnames = [fn for fn in infnames if fn != outfname]
+        with open_csv(outfname, 'a' if append else 'w') as outfile:
+            if not append:
+                outfile.write(header_line)
+            for fname in infnames:
+                if read_header(fname) is not None:
+                    n_lines += copy_body(fname, header, outfile)
+
+    if remove_infiles:
+        for fname in infnames:
+            if fname != outfname and os.path.exists(fname):
+                os.remove(fname)
+    if debug:
+        print '    merged %d lines from %d files into %s in %.3fs' % (n_lines, len(infnames), outfname, time.time() - start)
+    return n_lines
@@ -0,0 +1,229 @@
+""" Run jobscheduler.Job's with a choice of batch system: locally, with slurm, or through a file queue (served locally by bin/serve-queue.py, or by whatever you like on a cluster) """
+import os
+import sys
+import abc
+import time
+import json
+import shutil
+import tempfile
+
+import utils
+from jobscheduler import Job, JobScheduler, get_max_concurrent
+
+batch_systems = ['local', 'slurm', 'queue']
+
+# ----------------------------------------------------------------------------------------
+def get_executor(args, n_procs, workdir=None):
+    """ return an executor for the batch system in <args> (if it isn't set, use slurm if --slurm was set, or if we have more procs than cores and slurm is installed) """
+    batch_system = args.batch_system
+    if batch_system is None:
+        batch_system = 'slurm' if args.slurm or utils.auto_slurm(n_procs) else 'local'
+    if workdir is None:
+        workdir = args.workdir
+    if batch_system == 'local':
+        return LocalExecutor(debug=args.debug)
+    elif batch_system == 'slurm':
+        return SlurmExecutor(workdir, jobs_per_batch=args.jobs_per_batch, cleanup=(not args.no_clean), debug=args.debug)
+    elif batch_system == 'queue':
+        if args.queue_dir is None:
+            raise Exception('have to set --queue-dir for --batch-system queue')
+        return QueueExecutor(workdir, args.queue_dir, claim_timeout=args.queue_timeout, jobs_per_batch=args.jobs_per_batch, cleanup=(not args.no_clean), debug=args.debug)
+    else:
+        raise Exception('unknown batch system %s' % batch_system)
+
+# ----------------------------------------------------------------------------------------
+class LocalExecutor(object):
+    """ run each job as a separate subprocess on this machine, with no more running at once than we have cores """
+    name = 'local'
+    def __init__(self, debug=False):
+        self.debug = debug
+
+    # ----------------------------------------------------------------------------------------
+    def run(self, jobs, finish_fcn=None, n_concurrent=None):
+        max_concurrent = get_max_concurrent(False)
+        if n_concurrent is not None:
+            max_concurrent = min(n_concurrent, max_concurrent)
+        JobScheduler(max_concurrent=max_concurrent, debug=self.debug).run(jobs, finish_fcn=finish_fcn)
+
+# ----------------------------------------------------------------------------------------
+class BatchExecutor(object):
+    """
+    Base class for batch systems where each submission has a lot of overhead (e.g. queueing latency for srun), so rather than submitting each job separately we write
+    all their command lines to a batch directory, and submit a few bin/run-batch.py runners, each of which keeps pulling the next job from the directory until there
+    aren't any left. So the small jobs get packed together into a few submissions, and (since the runners pull jobs as they go, in the order we wrote them) a big job
+    doesn't hold up all the small ones that happened to be assigned to the same submission.
+    We submit one runner for every <jobs_per_batch> jobs, or <n_concurrent> runners if that's fewer.
+    Jobs that fail (or that never finished because their runner died) are rerun in a new batch, up to <max_tries> times.
+    NOTE the batch directory is under <workdir>, so it has to be visible on the batch nodes.
+    Subclasses say how to launch the runners by overriding run_runners().
+    """
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, workdir, jobs_per_batch=1, max_tries=6, cleanup=True, debug=False):
+        self.workdir = workdir
+        self.jobs_per_batch = jobs_per_batch
+        self.max_tries = max_tries
+        self.cleanup = cleanup
+        self.debug = debug
+        self.runner_cmd = sys.executable + ' ' + os.path.dirname(os.path.dirname(os.path.realpath(__file__))) + '/bin/run-batch.py'
+
+    # ----------------------------------------------------------------------------------------
+    def write_batch(self, jobs):
+        """ write <jobs> to a new batch directory, and return the directory and the file name for each job """
+        if not os.path.exists(self.workdir):
+            os.makedirs(self.workdir)
+        batchdir = tempfile.mkdtemp(dir=self.workdir, prefix='batch-')
+        for subdir in ['todo', 'claimed', 'status']:
+            os.makedirs(batchdir + '/' + subdir)
+        names = {}
+        for ijob in range(len(jobs)):
+            names[jobs[ijob]] = '%06d' % ijob
+            with open(batchdir + '/todo/' + names[jobs[ijob]], 'w') as cmdfile:
+                cmdfile.write(jobs[ijob].cmd_str)
+        return batchdir, names
+
+    # ----------------------------------------------------------------------------------------
+    def run(self, jobs, finish_fcn=None, n_concurrent=None):
+        start = time.time()
+        n_submitted = 0
+        waiting = list(jobs)
+        while len(waiting) > 0:
+            batchdir, names = self.write_batch(waiting)
+            n_runners = (len(waiting) + self.jobs_per_batch - 1) / self.jobs_per_batch
+            if n_concurrent is not None:
+                n_runners = min(n_runners, n_concurrent)
+            self.run_runners(batchdir, n_runners)
+            n_submitted += n_runners
+
+            failed = []
+            for job in waiting:
+                job.n_tries += 1
+                statusfname = batchdir + '/status/' + names[job]
+                if os.path.exists(statusfname):
+                    with open(statusfname) as statusfile:
+                        status = json.load(statusfile)
+                    job.returncode = status['returncode']
+                    job.wall_time += status['wall_time']
+                    job.cpu_time += status['cpu_time']
+                else:  # its runner died before it finished (or never got to it)
+                    job.returncode = -1
+                job.succeeded = job.returncode == 0 and (job.outfname is None or os.path.exists(job.outfname))
+                if finish_fcn is not None:
+                    finish_fcn(job)
+                if job.succeeded:
+                    continue
+                if job.n_tries >= self.max_tries:
+                    raise Exception('exceeded max number of tries for command\n    %s\nlook for output in %s' % (job.cmd_str, job.workdir))
+                print '    rerunning proc %s (exited with %d' % (job.name, job.returncode),
+                if job.outfname is not None and not os.path.exists(job.outfname):
+                    print ', output %s d.n.e.' % job.outfname,
+                print ')'
+                failed.append(job)
+            if self.cleanup:
+                shutil.rmtree(batchdir)
+            waiting = failed
+            sys.stdout.flush()
+
+        self.report(jobs, n_submitted, time.time() - start)
+
+    # ----------------------------------------------------------------------------------------
+    def get_runner_cmd_str(self, batchdir, irun):
+        """ command to run the <irun>th runner on <batchdir>, with its stdout and stderr (including that of any jobs that don't redirect their own) going to its own subdir """
+        runnerdir = batchdir + '/runner-' + str(irun)
+        os.makedirs(runnerdir)
+        return self.runner_cmd + ' ' + batchdir + ' 1>' + runnerdir + '/out' + ' 2>' + runnerdir + '/err'
+
+    # ----------------------------------------------------------------------------------------
+    @abc.abstractmethod
+    def run_runners(self, batchdir, n_runners):
+        """ run <n_runners> runners on <batchdir>, and return when they've all exited """
+
+    # ----------------------------------------------------------------------------------------
+    def report(self, jobs, n_submitted, wall_time):
+        if len(jobs) == 0:
+            return
+        print '      %s: %d procs in %d submissions, wall time %.1f (%.1f summed over procs), total cpu %.1f, %d reruns' % (self.name, len(jobs), n_submitted, wall_time, sum([job.wall_time for job in jobs]),
+                                                                                                                 sum([job.cpu_time for job in jobs]), sum([job.n_tries - 1 for job in jobs]))
+
+# ----------------------------------------------------------------------------------------
+class SlurmExecutor(BatchExecutor):
+    """ submit each runner with srun (all at once, since the cores are slurm's problem) """
+    name = 'slurm'
+
+    # ----------------------------------------------------------------------------------------
+    def run_runners(self, batchdir, n_runners):
+        runners = [Job('srun ' + self.get_runner_cmd_str(batchdir, irun), 'runner-%d' % irun, workdir=batchdir + '/runner-' + str(irun)) for irun in range(n_runners)]
+
+        # ----------------------------------------------------------------------------------------
+        def finish_runner(job):
+            utils.process_out_err('', '', extra_str=job.name, subworkdir=job.workdir)
+
+        JobScheduler(max_concurrent=None, debug=self.debug).run(runners, finish_fcn=finish_runner)  # if srun fails, the rerun runner just picks up whatever's left (and jobs that were running when it died get rerun in the next batch)
+
+# ----------------------------------------------------------------------------------------
+class QueueExecutor(BatchExecutor):
+    """
+    Put each runner in <queue_dir> as <id>.sh (a one-line shell command), and wait for whoever's serving the queue (e.g. bin/serve-queue.py) to write <id>.done
+    with its exit code. Any number of servers can share the queue directory, as long as they can all see it and our workdir.
+    If none of our runners has been claimed after <claim_timeout> seconds, we give up. If we started the server ourselves, pass its Popen as <server> so we fail as soon as it exits.
+    """
+    name = 'queue'
+    def __init__(self, workdir, queue_dir, poll_interval=0.2, claim_timeout=600., server=None, jobs_per_batch=1, max_tries=6, cleanup=True, debug=False):
+        BatchExecutor.__init__(self, workdir, jobs_per_batch=jobs_per_batch, max_tries=max_tries, cleanup=cleanup, debug=debug)
+        self.queue_dir = queue_dir
+        self.poll_interval = poll_interval
+        self.claim_timeout = claim_timeout
+        self.server = server
+
+    # ----------------------------------------------------------------------------------------
+    def run_runners(self, batchdir, n_runners):
+        if not os.path.exists(self.queue_dir):
+            os.makedirs(self.queue_dir)
+        jobids = []
+        for irun in range(n_runners):
+            jobids.append(os.path.basename(batchdir) + '-runner-%d' % irun)
+            jobfname = self.queue_dir + '/' + jobids[-1] + '.sh'
+            with open(jobfname + '.tmp', 'w') as jobfile:  # write then rename, so the server never sees a partial file
+                jobfile.write(self.get_runner_cmd_str(batchdir, irun) + '\n')
+            os.rename(jobfname + '.tmp', jobfname)
+
+        start = time.time()
+        warned = False
+        claimed = False
+        remaining = set(jobids)
+        while len(remaining) > 0:
+            for jobid in list(remaining):
+                donefname = self.queue_dir + '/' + jobid + '.done'
+                if not os.path.exists(donefname):
+                    continue
+                with open(donefname) as donefile:
+                    returncode = int(donefile.read().strip())
+                os.remove(donefname)
+                utils.process_out_err('', '', extra_str=jobid, subworkdir=batchdir + '/runner-' + str(jobids.index(jobid)))
+                if returncode != 0:  # the jobs it was running will get rerun in the next batch
+                    print '    %s queue runner %s exited with %d' % (utils.color('yellow', 'warning'), jobid, returncode)
+                remaining.remove(jobid)
+            if len(remaining) == 0:
+                break
+            if self.server is not None and self.server.poll() is not None:
+                self.withdraw(remaining)
+                raise Exception('queue server exited with %d with %d runners still to finish in %s' % (self.server.returncode, len(remaining), self.queue_dir))
+            if not claimed:
+                claimed = len(remaining) < n_runners or not all(os.path.exists(self.queue_dir + '/' + jobid + '.sh') for jobid in remaining)
+            if not claimed:
+                if self.claim_timeout is not None and time.time() - start > self.claim_timeout:
+                    self.withdraw(remaining)
+                    raise Exception('nobody claimed any of the %d runners in the queue %s within %.0fs (is anybody serving it, e.g. with ./bin/serve-queue.py --queue-dir %s?)' % (n_runners, self.queue_dir, self.claim_timeout, self.queue_dir))
+                if not warned and time.time() - start > 30.:
+                    print '    waiting for somebody to serve the queue in %s (e.g. with ./bin/serve-queue.py --queue-dir %s)' % (self.queue_dir, self.queue_dir)
+                    sys.stdout.flush()
+                    warned = True
+            time.sleep(self.poll_interval)
+
+    # ----------------------------------------------------------------------------------------
+    def withdraw(self, jobids):
+        """ remove any of <jobids> that haven't been claimed yet from the queue, so nobody runs them after we've given up """
+        for jobid in jobids:
+            jobfname = self.queue_dir + '/' + jobid + '.sh'
+            if os.path.exists(jobfname):
+                os.remove(jobfname)
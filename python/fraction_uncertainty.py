@@ -1,5 +1,27 @@
-import cached_uncertainties
-from scipy.stats import beta
+import os
+import numpy
+
+# table of cached (lo, hi) uncertainties, indexed as [total, obs] (nan where we didn't cache anything). Memory-mapped, so it's only paged in as needed, and shared between processes
+cachefname = os.path.dirname(os.path.realpath(__file__)) + '/../data/cached-uncertainties.npy'
+max_cached_total, max_cached_obs = 1000, 100  # the table covers 0 <= obs < min(total, 100) for 0 < total < 1000
+_cached_errs = None
+
+# ----------------------------------------------------------------------------------------
+def get_cached_errs():
+    global _cached_errs
+    if _cached_errs is None:
+        _cached_errs = numpy.load(cachefname, mmap_mode='r')
+    return _cached_errs
+
+# ----------------------------------------------------------------------------------------
+def write_cache_table(outfname=cachefname):
+    """ recalculate the table of cached uncertainties """
+    table = numpy.full((max_cached_total, max_cached_obs, 2), numpy.nan)
+    totals, obs = zip(*[(total, ob) for total in range(1, max_cached_total) for ob in range(min(total, max_cached_obs))])
+    lo, hi, _ = err_many(obs, totals, use_cache=False)
+    table[totals, obs, 0] = numpy.round(lo, 6)
+    table[totals, obs, 1] = numpy.round(hi, 6)
+    numpy.save(outfname, table)
 
 # ----------------------------------------------------------------------------------------
 def err(obs, total, use_beta=True, use_cache=True, for_paper=False):
@@ -8,31 +30,71 @@ def err(obs, total, use_beta=True, use_cache=True, for_paper=False):
     if total == 0.0:
         return (0.0, 0.0, False)
 
-    key = str(obs) + '/' + str(total)
-    if use_cache and key in cached_uncertainties.errs:
-        return cached_uncertainties.errs[key] + (True, )
-
-    frac = float(obs) / total
-    if use_beta or frac == 0.0 or frac == 1.0:  # still need to use beta for 0 and 1 'cause the sqrt thing below gives garbage for those cases
-        if for_paper:  # total volume of confidence interval
-            vol = 0.95  # use 95% for paper
-            cpr = 0.5  # constant from prior (jeffreys for paper)
-        else:
-            vol = 2./3  # otherwise +/- 1 sigma
-            cpr = 1.  # constant prior
-        lo = beta.ppf((1. - vol)/2, cpr + obs, cpr + total - obs)
-        hi = beta.ppf((1. + vol)/2, cpr + obs, cpr + total - obs)
-        if frac < lo:  # if k/n very small (probably zero), take a one-sided c.i. with 2/3 (0.95) the mass
-            lo = 0.
-            hi = beta.ppf(vol, cpr + obs, cpr + total - obs)
-        if frac > hi:  # same deal if k/n very large (probably one)
-            lo = beta.ppf(1. - vol, cpr + obs, cpr + total - obs)
-            hi = 1.
-    else:  # square root shenaniganery
-        err = (1./(total*total)) * (math.sqrt(obs)*total - obs*math.sqrt(total))
-        lo = frac - err
-        hi = frac + err
-
-    assert lo < frac or frac == 0.0
-    assert frac < hi or frac == 1.0
-    return (lo, hi) + (False, )
+    if use_cache and total < max_cached_total and obs < max_cached_obs and int(obs) == obs and int(total) == total:
+        lo, hi = get_cached_errs()[int(total), int(obs)]
+        if not numpy.isnan(lo):
+            return (float(lo), float(hi), True)
+
+    lo, hi, _ = err_many([obs], [total], use_beta=use_beta, use_cache=False, for_paper=for_paper)
+    return (float(lo[0]), float(hi[0]), False)
+
+# ----------------------------------------------------------------------------------------
+def err_many(obs, totals, use_beta=True, use_cache=True, for_paper=False):
+    """
+    Vectorized version of err(): return arrays (lo, hi, cached) with the uncertainties on each obs[i] / totals[i].
+    Anything that isn't in the cache gets its beta quantiles calculated in one bulk call.
+    """
+    obs = numpy.asarray(obs, dtype=float)
+    totals = numpy.asarray(totals, dtype=float)
+    assert obs.shape == totals.shape
+    assert (obs <= totals).all()
+    lo = numpy.zeros(obs.shape)
+    hi = numpy.zeros(obs.shape)
+    cached = numpy.zeros(obs.shape, dtype=bool)
+
+    todo = totals != 0.
+    if use_cache:
+        incache = todo & (totals < max_cached_total) & (obs < max_cached_obs) & (obs == numpy.floor(obs)) & (totals == numpy.floor(totals))
+        icache = numpy.nonzero(incache)
+        if len(icache[0]) > 0:
+            vals = get_cached_errs()[totals[icache].astype(int), obs[icache].astype(int)]
+            found = ~numpy.isnan(vals[:, 0])
+            ifound = tuple(indices[found] for indices in icache)
+            lo[ifound] = vals[found, 0]
+            hi[ifound] = vals[found, 1]
+            cached[ifound] = True
+            todo &= ~cached
+
+    if not todo.any():
+        return lo, hi, cached
+
+    from scipy.stats import beta  # scipy is slow to import, and we don't need it if everything was cached
+    ob, total = obs[todo], totals[todo]
+    frac = ob / total
+    if for_paper:  # total volume of confidence interval
+        vol = 0.95  # use 95% for paper
+        cpr = 0.5  # constant from prior (jeffreys for paper)
+    else:
+        vol = 2./3  # otherwise +/- 1 sigma
+        cpr = 1.  # constant prior
+    tlo = beta.ppf((1. - vol)/2, cpr + ob, cpr + total - ob)
+    thi = beta.ppf((1. + vol)/2, cpr + ob, cpr + total - ob)
+    small = frac < tlo  # if k/n very small (probably zero), take a one-sided c.i. with 2/3 (0.95) the mass
+    if small.any():
+        tlo[small] = 0.
+        thi[small] = beta.ppf(vol, cpr + ob[small], cpr + total[small] - ob[small])
+    large = frac > thi  # same deal if k/n very large (probably one)
+    if large.any():
+        tlo[large] = beta.ppf(1. - vol, cpr + ob[large], cpr + total[large] - ob[large])
+        thi[large] = 1.
+    if not use_beta:  # square root shenaniganery (but still need to use beta for 0 and 1 'cause the sqrt thing gives garbage for those cases)
+        sqrtable = (frac != 0.) & (frac != 1.)
+        sqerr = (1. / (total*total)) * (numpy.sqrt(ob)*total - ob*numpy.sqrt(total))
+        tlo = numpy.where(sqrtable, frac - sqerr, tlo)
+        thi = numpy.where(sqrtable, frac + sqerr, thi)
+
+    assert ((tlo < frac) | (frac == 0.)).all()
+    assert ((frac < thi) | (frac == 1.)).all()
+    lo[todo] = tlo
+    hi[todo] = thi
+    return lo, hi, cached
@@ -1,13 +1,17 @@
-import itertools
 import os
 import sys
 import math
 import csv
 import time
+import heapq
+import numpy
 
 import utils
+import hamming
+from hammingindex import HammingIndex
 from opener import opener
 from clusterpath import ClusterPath
+from uidmap import concatenate_partitions
 
 # ----------------------------------------------------------------------------------------
 class Glomerator(object):
@@ -15,45 +19,38 @@ class Glomerator(object):
     def __init__(self, reco_info=None):
         self.reco_info = reco_info
         self.paths = None
+        self.divvy_costs = None
 
     # ----------------------------------------------------------------------------------------
     def naive_seq_glomerate(self, naive_seqs, n_clusters, debug=False):
-        """ Perform hierarchical agglomeration (with naive hamming distance as the distance), stopping at <n_clusters> """
+        """ Perform hierarchical agglomeration (with naive hamming distance as the distance), stopping at <n_clusters>. <naive_seqs> is either a dict of sequences or a hamming.EncodedSeqs """
         start = time.time()
-        clusters = [[names,] for names in naive_seqs.keys()]
+        encoded_seqs = naive_seqs if isinstance(naive_seqs, hamming.EncodedSeqs) else hamming.EncodedSeqs(naive_seqs)
+        clusters = [[names,] for names in encoded_seqs.names]
 
         seqs_per_cluster = float(len(clusters)) / n_clusters
         max_per_cluster = int(math.ceil(seqs_per_cluster))
         if debug:
             print '  max %d per cluster' % max_per_cluster
 
-        distances = {}  # cache the calculated fractional hamming distances
+        # NOTE row/column i of <glomerate.distances> corresponds to clusters[i], and holds the smallest hamming distance between any two sequences in the two clusters
 
         # ----------------------------------------------------------------------------------------
         def get_clusters_to_merge():
-            smallest_min_distance, clusters_to_merge = None, None
-            n_skipped = 0
-            for clust_a, clust_b in itertools.combinations(clusters, 2):  # find the two clusters which contain the pair of sequences which are closest in hamming fraction (skipping cluster pairs that would make a cluster that's too big)
-                if len(clust_a) + len(clust_b) > max_per_cluster and not glomerate.merge_whatever_you_got:  # merged cluster would be too big, so look for smaller (albeit further-apart) things to merge
-                    n_skipped += 1
-                    continue
-                min_distance = None  # find the smallest hamming distance between any two sequences in the two clusters
-                for query_a in clust_a:
-                    for query_b in clust_b:
-                        joint_key = query_a + ';' + query_b  #';'.join([query_a, query_b])
-                        if joint_key not in distances:
-                            distances[joint_key] = utils.hamming_fraction(naive_seqs[query_a], naive_seqs[query_b])
-                            distances[query_b + ';' + query_a] = distances[joint_key]  # also add with key in reverse order, in case we run into the pair that way later on
-                        if min_distance is None or distances[joint_key] < min_distance:
-                            min_distance = distances[joint_key]
-                if smallest_min_distance is None or min_distance < smallest_min_distance:
-                    smallest_min_distance = min_distance
-                    clusters_to_merge = (clust_a, clust_b)
-
-            if debug and n_skipped > 0:
-                print '      skipped: %d ' % n_skipped
-
-            return clusters_to_merge
+            """ find the two clusters which contain the pair of sequences which are closest in hamming fraction (skipping cluster pairs that would make a cluster that's too big) """
+            n_current = len(clusters)
+            allowed = numpy.triu(numpy.ones((n_current, n_current), dtype=bool), k=1)  # upper triangle, i.e. each pair once
+            if not glomerate.merge_whatever_you_got:  # merged cluster would be too big, so look for smaller (albeit further-apart) things to merge
+                sizes = numpy.array([len(cl) for cl in clusters])
+                too_big = (sizes[:, None] + sizes[None, :]) > max_per_cluster
+                n_skipped = (allowed & too_big).sum()
+                allowed &= ~too_big
+                if debug and n_skipped > 0:
+                    print '      skipped: %d ' % n_skipped
+            if not allowed.any():
+                return None
+            iclust, jclust = divmod(numpy.argmin(numpy.where(allowed, glomerate.distances, numpy.inf)), n_current)  # argmin takes the first of any ties in row-major order, i.e. the same pair as the first one we'd find with itertools.combinations()
+            return iclust, jclust
 
         # ----------------------------------------------------------------------------------------
         def glomerate():
@@ -65,11 +62,19 @@ class Glomerator(object):
                     print '    didn\'t find shiznitz'
                 glomerate.merge_whatever_you_got = True  # next time through, merge whatever's best regardless of size
             else:
+                iclust, jclust = clusters_to_merge
                 if debug:
-                    print '    merging', len(clusters_to_merge[0]), len(clusters_to_merge[1])
-                clusters.append(clusters_to_merge[0] + clusters_to_merge[1])
-                clusters.remove(clusters_to_merge[0])
-                clusters.remove(clusters_to_merge[1])
+                    print '    merging', len(clusters[iclust]), len(clusters[jclust])
+                new_distances = numpy.minimum(glomerate.distances[iclust], glomerate.distances[jclust])  # single linkage, i.e. distance to the merged cluster is the smaller of the two
+                keep = [ic for ic in range(len(clusters)) if ic != iclust and ic != jclust]
+                clusters.append(clusters[iclust] + clusters[jclust])
+                for ic in sorted(clusters_to_merge, reverse=True):
+                    del clusters[ic]
+                distances = numpy.zeros((len(keep) + 1, len(keep) + 1))  # the merged cluster goes on the end, same as in <clusters>
+                distances[:-1, :-1] = glomerate.distances[numpy.ix_(keep, keep)]
+                distances[-1, :-1] = new_distances[keep]
+                distances[:-1, -1] = new_distances[keep]
+                glomerate.distances = distances
 
         # ----------------------------------------------------------------------------------------
         def homogenize():
@@ -91,6 +96,7 @@ class Glomerator(object):
         # ----------------------------------------------------------------------------------------
         # da bizniz
         glomerate.merge_whatever_you_got = False  # merge the best pair, even if together they'll be to big
+        glomerate.distances = encoded_seqs.all_pairs()
 
         while len(clusters) > n_clusters:
             glomerate()
@@ -111,6 +117,165 @@ class Glomerator(object):
         print '    divvy time: %.3f' % (time.time()-start)
         return clusters
 
+    # ----------------------------------------------------------------------------------------
+    def naive_seq_single_linkage(self, naive_seqs, max_fraction, n_procs=1, debug=False):
+        """
+        Cluster <naive_seqs> (a dict, or a hamming.EncodedSeqs) by single linkage, i.e. return the connected components (as lists of names) of the graph with an edge between
+        each pair within hamming fraction <max_fraction>. Positions that are ambiguous in either sequence are skipped, as everywhere else, so padding and N-masking don't count
+        as differences. Pairs are found with a hammingindex.HammingIndex (using <n_procs> processes), and sequences of different lengths always end up in different clusters.
+        """
+        from scipy.sparse import coo_matrix
+        from scipy.sparse.csgraph import connected_components
+        start = time.time()
+        encoded_seqs = naive_seqs if isinstance(naive_seqs, hamming.EncodedSeqs) else hamming.EncodedSeqs(naive_seqs)
+        names = encoded_seqs.names if encoded_seqs.names is not None else range(len(encoded_seqs))
+        clusters = []
+        n_pairs = 0
+        for length, (indices, code_matrix, _) in encoded_seqs.length_groups.items():
+            length_seqs = encoded_seqs if len(encoded_seqs.length_groups) == 1 else hamming.EncodedSeqs.from_code_matrix([names[i] for i in indices], code_matrix)
+            index = HammingIndex(length_seqs, max_fraction, debug=debug)
+            ifirst, isecond, _ = index.pairs(n_procs=n_procs, debug=debug)
+            n_pairs += len(ifirst)
+            _, labels = connected_components(coo_matrix((numpy.ones(len(ifirst), dtype=numpy.int8), (ifirst, isecond)), shape=(len(indices), len(indices))), directed=False)
+            order = numpy.argsort(labels, kind='mergesort')  # sort by label, then split where it changes
+            splits = numpy.nonzero(numpy.diff(labels[order]))[0] + 1
+            clusters += [[names[indices[i]] for i in group] for group in numpy.split(order, splits)]
+        print '    single linkage: %d clusters from %d sequences (%d pairs within %.3f) in %.2fs' % (len(clusters), len(encoded_seqs), n_pairs, max_fraction, time.time() - start)
+        return clusters
+
+    # ----------------------------------------------------------------------------------------
+    def naive_seq_divvy(self, naive_seqs, n_clusters, n_bands=6, n_positions=21, window=1, max_fraction=0.2, cost_fcn=None, seed=1, debug=False):
+        """
+        Divvy <naive_seqs> (a dict, or a hamming.EncodedSeqs, of sequences that are all the same length) into <n_clusters> groups of roughly equal size, keeping similar sequences together.
+        Unlike naive_seq_glomerate(), which looks at every pair of clusters for every merge, this only calculates distances between likely neighbors, so it handles 100k+ sequences in seconds:
+          - candidate pairs: for each of <n_bands> random sets of <n_positions> positions (i.e. locality sensitive hashing for hamming distance, by sampling positions), sort the
+            sequences by their bases at those positions, and pair each sequence with the next <window> sequences in that order (ignoring pairs further apart than <max_fraction>)
+          - single-linkage agglomeration over the candidate pairs in order of increasing hamming fraction, skipping merges that would make a cluster bigger than
+            an equal share of the sequences, until we're down to <n_clusters>
+          - then pack the clusters into <n_clusters> groups, biggest first into whichever group is currently smallest (splitting a cluster only if it doesn't fit)
+        By default the groups get equal numbers of sequences. If <cost_fcn> is set, it's called with the list of clusters (each a list of indices into <naive_seqs>) and
+        should return the expected cost of each one, and we instead pack so the groups' costs are equal. Either way, the predicted cost of each group ends up in self.divvy_costs.
+        """
+        start = time.time()
+        encoded_seqs = naive_seqs if isinstance(naive_seqs, hamming.EncodedSeqs) else hamming.EncodedSeqs(naive_seqs)
+        if len(encoded_seqs.length_groups) > 1:
+            raise Exception('naive seqs for divvying have different lengths: %s' % ' '.join([str(l) for l in sorted(encoded_seqs.length_groups)]))
+        n_seqs = len(encoded_seqs)
+        if n_seqs == 0:
+            return []
+        _, code_matrix, valid_matrix = encoded_seqs.length_groups.values()[0]
+        max_per_cluster = int(math.ceil(float(n_seqs) / n_clusters))
+
+        # candidate pairs (after sorting, each sequence's candidates are the next few rows, so we can compare contiguous slices rather than gathering each pair)
+        random_state = numpy.random.RandomState(seed)
+        columns = numpy.nonzero(valid_matrix.mean(axis=0) > 0.5)[0]  # don't sample positions that are mostly padding
+        if len(columns) == 0:
+            columns = numpy.arange(code_matrix.shape[1])
+        chunk_size = max(1, 2**24 / max(1, code_matrix.shape[1]))  # rows at a time, so the temporary arrays are a few tens of MB
+        ifirst, isecond, fractions = [], [], []
+        for _ in range(n_bands):
+            positions = random_state.choice(columns, min(n_positions, 21, len(columns)), replace=False)  # 21 * 3 bits fit in an int64
+            keys = encoded_seqs.position_keys(positions)
+            order = numpy.argsort(keys, kind='mergesort')
+            sorted_codes, sorted_valid = code_matrix[order], valid_matrix[order]
+            for offset in range(1, min(window, n_seqs - 1) + 1):
+                for istart in range(0, n_seqs - offset, chunk_size):
+                    istop = min(n_seqs - offset, istart + chunk_size)
+                    both_valid = sorted_valid[istart : istop] & sorted_valid[istart + offset : istop + offset]
+                    n_valid = numpy.add.reduce(both_valid.view(numpy.uint8), axis=1, dtype=numpy.int32)  # (a lot faster than sum() on bools)
+                    n_different = numpy.add.reduce(((sorted_codes[istart : istop] != sorted_codes[istart + offset : istop + offset]) & both_valid).view(numpy.uint8), axis=1, dtype=numpy.int32)
+                    chunk_fractions = numpy.where(n_valid > 0, n_different / numpy.maximum(n_valid, 1).astype(float), 0.)
+                    close = chunk_fractions <= max_fraction
+                    ifirst.append(order[istart : istop][close])
+                    isecond.append(order[istart + offset : istop + offset][close])
+                    fractions.append(chunk_fractions[close])
+        if len(ifirst) > 0:
+            ifirst, isecond, fractions = numpy.concatenate(ifirst), numpy.concatenate(isecond), numpy.concatenate(fractions)
+            _, iunique = numpy.unique(numpy.minimum(ifirst, isecond) * n_seqs + numpy.maximum(ifirst, isecond), return_index=True)  # lots of pairs turn up in more than one band
+            ifirst, isecond, fractions = ifirst[iunique], isecond[iunique], fractions[iunique]
+        else:
+            ifirst, isecond, fractions = numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int), numpy.zeros(0)
+
+        # agglomerate (union-find)
+        parents = range(n_seqs)
+        sizes = [1 for _ in range(n_seqs)]
+        n_current = n_seqs
+        def find(i):
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+        isort = numpy.argsort(fractions, kind='mergesort')
+        for iseq, jseq in zip(ifirst[isort].tolist(), isecond[isort].tolist()):
+            if n_current <= n_clusters:
+                break
+            iroot, jroot = find(iseq), find(jseq)
+            if iroot == jroot or sizes[iroot] + sizes[jroot] > max_per_cluster:
+                continue
+            if sizes[iroot] < sizes[jroot]:
+                iroot, jroot = jroot, iroot
+            parents[jroot] = iroot
+            sizes[iroot] += sizes[jroot]
+            n_current -= 1
+
+        members = {}
+        for iseq in range(n_seqs):
+            members.setdefault(find(iseq), []).append(iseq)
+
+        # pack into <n_clusters> groups
+        clusters = members.values()
+        costs = [float(len(cl)) for cl in clusters] if cost_fcn is None else [float(c) for c in cost_fcn(clusters)]
+        # ----------------------------------------------------------------------------------------
+        def pack(capacity):
+            groups = [[] for _ in range(n_clusters)]
+            group_costs = [0. for _ in range(n_clusters)]
+            heap = [(0., igroup) for igroup in range(n_clusters)]  # (cost, index) for each group
+            for icl in sorted(range(len(clusters)), key=lambda i: costs[i], reverse=True):
+                cluster, cost = clusters[icl], costs[icl]
+                while len(cluster) > 0:  # if it doesn't fit in the smallest group, put what does fit there, and the rest in the next smallest
+                    group_cost, igroup = heapq.heappop(heap)
+                    if group_cost + cost <= capacity or cost <= 0. or len(cluster) == 1:
+                        n_to_add, added_cost = len(cluster), cost
+                    elif cost_fcn is None:
+                        n_to_add = max(1, min(len(cluster), int(capacity - group_cost)))
+                        added_cost = float(n_to_add)
+                    else:  # if costs are mostly from pairs within the cluster, a fraction f of its members costs about f^2 as much, so start from that guess, then re-estimate and shrink it until it fits
+                        room = max(0., capacity - group_cost)
+                        n_to_add = max(1, min(len(cluster) - 1, int(len(cluster) * math.sqrt(room / cost))))
+                        for _ in range(5):
+                            added_cost, rest_cost = [float(c) for c in cost_fcn([cluster[ : n_to_add], cluster[n_to_add : ]])]  # (re-estimate both pieces, since splitting also removes the pairs between them)
+                            if added_cost <= room or n_to_add == 1:
+                                break
+                            n_to_add = max(1, int(n_to_add * room / added_cost))  # cost is convex in the number of members, so this'll fit
+                        cost = rest_cost + added_cost  # so that subtracting it below leaves the cost of the rest
+                    groups[igroup].extend(cluster[ : n_to_add])
+                    group_costs[igroup] += added_cost
+                    cluster, cost = cluster[n_to_add : ], cost - added_cost
+                    heapq.heappush(heap, (group_cost + added_cost, igroup))
+            return groups, group_costs
+
+        if cost_fcn is None:
+            groups, self.divvy_costs = pack(max_per_cluster)
+        else:  # allow a little slack, so we don't split clusters just to even out the last few percent. But splitting clusters also makes the total cost smaller, so if it's a lot smaller we have to repack with the smaller capacity
+            capacity = 1.05 * sum(costs) / n_clusters
+            for _ in range(3):
+                groups, self.divvy_costs = pack(capacity)
+                new_capacity = 1.05 * sum(self.divvy_costs) / n_clusters
+                if new_capacity > capacity / 1.05:
+                    break
+                capacity = new_capacity
+        names = encoded_seqs.names if encoded_seqs.names is not None else range(n_seqs)
+        igroups = sorted([ig for ig in range(n_clusters) if len(groups[ig]) > 0], key=lambda ig: len(groups[ig]))
+        clusters = [[names[i] for i in groups[ig]] for ig in igroups]
+        self.divvy_costs = [self.divvy_costs[ig] for ig in igroups]  # predicted cost for each of the returned clusters
+
+        if debug:
+            print '    %d candidate pairs closer than %.2f, %d clusters before packing' % (len(fractions), max_fraction, len(members))
+            print '    sizes ', ' '.join([str(len(cl)) for cl in clusters])
+            print '    costs ', ' '.join(['%.0f' % c for c in self.divvy_costs])
+        print '    divvy time: %.3f' % (time.time()-start)
+        return clusters
+
     # ----------------------------------------------------------------------------------------
     def print_true_partition(self):
         print '  true partition'
@@ -123,7 +288,6 @@ class Glomerator(object):
     # ----------------------------------------------------------------------------------------
     def read_file_info(self, infname, n_paths):
         paths = [None for _ in range(n_paths)]
-        lines_list = [[] for _ in range(n_paths)]
         with opener('r')(infname) as csvfile:
             reader = csv.DictReader(csvfile)
             for line in reader:
@@ -135,17 +299,13 @@ class Glomerator(object):
                     paths[path_index] = ClusterPath(int(line['initial_path_index']))  # NOTE I may have screwed up the initial_path_index/path_index distinction here... it's been too long since I wrote the smc stuff and I'm not sure
                 else:
                     assert paths[path_index].initial_path_index == int(line['initial_path_index'])
-                lines_list[path_index].append(line)
-
-        for path_index in range(n_paths):
-            paths[path_index].readlines(lines_list[path_index])
+                paths[path_index].readlines([line])  # add each line as we read it, rather than keeping all the lines around
+                if len(paths[path_index].encoded_partitions[-1]) == 0:
+                    raise Exception('zero length partition read from %s' % infname)
 
         for cp in paths:
             if cp is None:
                 raise Exception('None type path read from %s' % infname)
-            for ptn in cp.partitions:
-                if len(ptn) == 0:
-                    raise Exception('zero length partition read from %s' % infname)
 
         return paths
 
@@ -172,12 +332,12 @@ class Glomerator(object):
                     current_path = fileinfos[ifile][ipath]
                     # first_new_logprob = current_path.logprobs[0]
                     extended_path = ClusterPath(None)
-                    for ip in range(len(previous_path.partitions)):
+                    for ip in range(len(previous_path.encoded_partitions)):
                         # if previous_path.logprobs[ip] >= first_new_logprob:  # skip the merges past which we rewound
                         #     continue
-                        extended_path.add_partition(list(previous_path.partitions[ip]), previous_path.logprobs[ip], previous_path.n_procs[ip], logweight=previous_path.logweights[ip], adj_mi=previous_path.adj_mis[ip])
-                    for ip in range(len(current_path.partitions)):
-                        extended_path.add_partition(list(current_path.partitions[ip]), current_path.logprobs[ip], current_path.n_procs[ip], logweight=current_path.logweights[ip], adj_mi=current_path.adj_mis[ip])
+                        extended_path.add_partition(previous_path.encoded_partitions[ip], previous_path.logprobs[ip], previous_path.n_procs[ip], logweight=previous_path.logweights[ip], adj_mi=previous_path.adj_mis[ip])
+                    for ip in range(len(current_path.encoded_partitions)):
+                        extended_path.add_partition(current_path.encoded_partitions[ip], current_path.logprobs[ip], current_path.n_procs[ip], logweight=current_path.logweights[ip], adj_mi=current_path.adj_mis[ip])
                     fileinfos[ifile][ipath] = extended_path
                     fileinfos[ifile][ipath].set_synthetic_logweight_history(self.reco_info)  # need to multiply the combinatorical factors in the later partitions by the factors from the earlier partitions
                     if debug:
@@ -197,13 +357,13 @@ class Glomerator(object):
             def last_one():
                 last = True
                 for ifile in range(len(fileinfos)):  # we're finished when all the files are out of glomeration steps (i.e. they all only have one [the last] line left)
-                    last &= len(fileinfos[ifile][ipath].partitions) == 1
+                    last &= len(fileinfos[ifile][ipath].encoded_partitions) == 1
                 return last
 
             def remove_one_of_the_first_partitions():
                 maxdelta, ibestfile = None, None
                 for ifile in range(len(fileinfos)):
-                    if len(fileinfos[ifile][ipath].partitions) == 1:  # if this is the last line (i.e. there aren't any more glomeration steps in this file), leave it alone
+                    if len(fileinfos[ifile][ipath].encoded_partitions) == 1:  # if this is the last line (i.e. there aren't any more glomeration steps in this file), leave it alone
                         continue
                     thisdelta = fileinfos[ifile][ipath].logprobs[1] - fileinfos[ifile][ipath].logprobs[0]  # logprob difference between the next partition and this one
                     if maxdelta is None or thisdelta > maxdelta:
@@ -213,12 +373,10 @@ class Glomerator(object):
                 fileinfos[ibestfile][ipath].remove_first_partition()
 
             def add_next_global_partition():
-                global_partition = []
                 global_logprob = 0.
                 for ifile in range(len(fileinfos)):  # combine the first line in each file to make a global partition
-                    for cluster in fileinfos[ifile][ipath].partitions[0]:
-                        global_partition.append(list(cluster))
                     global_logprob += fileinfos[ifile][ipath].logprobs[0]
+                global_partition = concatenate_partitions([fileinfos[ifile][ipath].encoded_partitions[0] for ifile in range(len(fileinfos))])
                 self.paths[ipath].add_partition(global_partition, global_logprob, n_procs=len(fileinfos), logweight=0.)  # don't know the logweight yet (or maybe at all!)
 
             while not last_one():
@@ -233,7 +391,7 @@ class Glomerator(object):
                 print '  merged path:'
                 self.paths[ipath].print_partitions(self.reco_info)
             else:
-                print '  merged path %d with %d glomeration steps and %d final clusters' % (ipath, len(self.paths[ipath].partitions), len(self.paths[ipath].partitions[-1]))
+                print '  merged path %d with %d glomeration steps and %d final clusters' % (ipath, len(self.paths[ipath].encoded_partitions), len(self.paths[ipath].encoded_partitions[-1]))
 
         if smc_particles == 1:  # XX: ...whereas if we're *not* doing smc, we have to add the previous histories *afterward*, since the previous histories are all in one piece
             if previous_info is None:
@@ -252,12 +410,12 @@ class Glomerator(object):
                 current_path = self.paths[0]
                 # first_new_logprob = UPDATEME current_path.logprobs[0]
                 extended_path = ClusterPath(None)
-                for ip in range(len(previous_path.partitions)):
+                for ip in range(len(previous_path.encoded_partitions)):
                     # if previous_path.logprobs[ip] >= first_new_logprob:  # skip the merges past which we rewound
                     #     continue
-                    extended_path.add_partition(list(previous_path.partitions[ip]), previous_path.logprobs[ip], previous_path.n_procs[ip], logweight=previous_path.logweights[ip], adj_mi=previous_path.adj_mis[ip])
-                for ip in range(len(current_path.partitions)):
-                    extended_path.add_partition(list(current_path.partitions[ip]), current_path.logprobs[ip], current_path.n_procs[ip], logweight=current_path.logweights[ip], adj_mi=current_path.adj_mis[ip])
+                    extended_path.add_partition(previous_path.encoded_partitions[ip], previous_path.logprobs[ip], previous_path.n_procs[ip], logweight=previous_path.logweights[ip], adj_mi=previous_path.adj_mis[ip])
+                for ip in range(len(current_path.encoded_partitions)):
+                    extended_path.add_partition(current_path.encoded_partitions[ip], current_path.logprobs[ip], current_path.n_procs[ip], logweight=current_path.logweights[ip], adj_mi=current_path.adj_mis[ip])
                 self.paths[0] = extended_path
                 # self.paths[0].set_synthetic_logweight_history(self.reco_info)  # need to multiply the combinatorical factors in the later partitions by the factors from the earlier partitions
                 if debug:
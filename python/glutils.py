@@ -0,0 +1,175 @@
+""" Read, validate, cache, subset, and write germline set info (the germline fasta files, v-meta.json, and j_tryp.csv in a datadir) """
+import os
+import csv
+import json
+import copy
+import hashlib
+import cPickle as pickle
+
+import utils
+from opener import opener
+
+bundle_version = 1  # increment this if you change what goes in the bundle
+bundle_basename = 'glfo-bundle.pickle'
+source_basenames = ['igh' + region + '.fasta' for region in utils.regions] + ['ighv-aligned.fasta', 'v-meta.json', 'j_tryp.csv']
+allowed_nukes = set(utils.nukes + ['N'])
+
+# ----------------------------------------------------------------------------------------
+def get_file_hash(fname):
+    with open(fname) as infile:
+        return hashlib.sha1(infile.read()).hexdigest()
+
+# ----------------------------------------------------------------------------------------
+def get_source_info(datadir, old_info=None):
+    """ return {basename : (mtime, size, hash)} for the source files in <datadir>, only re-hashing files whose mtime or size differs from <old_info> """
+    info = {}
+    for basename in source_basenames:
+        fname = datadir + '/' + basename
+        if not os.path.exists(fname):
+            raise Exception('germline file %s d.n.e.' % fname)
+        mtime, size = os.path.getmtime(fname), os.path.getsize(fname)
+        if old_info is not None and basename in old_info and old_info[basename][:2] == (mtime, size):
+            info[basename] = old_info[basename]
+        else:
+            info[basename] = (mtime, size, get_file_hash(fname))
+    return info
+
+# ----------------------------------------------------------------------------------------
+def read_tryp_positions(datadir):
+    tryp_positions = {}
+    with opener('r')(datadir + '/j_tryp.csv') as csv_file:  # get location of <end> tryptophan in each j region
+        reader = csv.DictReader(csv_file)
+        for line in reader:
+            tryp_positions[line['gene']] = int(line['tryp_start'])
+    return tryp_positions
+
+# ----------------------------------------------------------------------------------------
+def read_glfo_from_source(datadir):
+    glfo = {}
+    glfo['seqs'] = utils.read_germlines(datadir)
+    glfo['aligned-v-genes'] = utils.read_germlines(datadir, only_region='v', aligned=True)
+    glfo['cyst-positions'] = utils.read_cyst_positions(datadir)
+    glfo['tryp-positions'] = read_tryp_positions(datadir)
+    validate(glfo, datadir)
+    return glfo
+
+# ----------------------------------------------------------------------------------------
+def validate(glfo, datadir):
+    for region in utils.regions:
+        if len(glfo['seqs'][region]) == 0:
+            raise Exception('no %s genes in %s' % (region, datadir))
+        for gene, seq in glfo['seqs'][region].items():
+            if utils.get_region(gene) != region:
+                raise Exception('%s gene %s in %s has the wrong region' % (region, gene, datadir))
+            if len(set(seq) - allowed_nukes) > 0:
+                raise Exception('unexpected characters %s in %s in %s' % (' '.join(set(seq) - allowed_nukes), gene, datadir))
+    for gene in glfo['seqs']['v']:
+        if gene not in glfo['aligned-v-genes']['v']:
+            raise Exception('%s missing from aligned v genes in %s' % (gene, datadir))
+        if gene not in glfo['cyst-positions']:
+            raise Exception('%s missing from v-meta.json in %s' % (gene, datadir))
+    for gene in glfo['seqs']['j']:
+        if gene not in glfo['tryp-positions']:
+            raise Exception('%s missing from j_tryp.csv in %s' % (gene, datadir))
+
+# ----------------------------------------------------------------------------------------
+def read_glfo(datadir, only_genes=None, debug=False):
+    """
+    Return germline info for <datadir>, i.e. a dict with keys 'seqs', 'aligned-v-genes', 'cyst-positions', and 'tryp-positions'.
+    The first time we see a datadir, we parse and validate the source files and write them to a binary bundle in <datadir>, which subsequent calls
+    read instead (the bundle is rebuilt if the hash of any of the source files changes).
+    If <only_genes> is set, the returned info is restricted to those genes.
+    """
+    bundlefname = datadir + '/' + bundle_basename
+    glfo, old_source_info = None, None
+    if os.path.exists(bundlefname):
+        try:
+            with open(bundlefname, 'rb') as bundlefile:
+                bundle = pickle.load(bundlefile)
+            if bundle['version'] == bundle_version:
+                old_source_info = bundle['source-info']
+                glfo = bundle['glfo']
+        except Exception as e:  # a half-written bundle, or one from an incompatible version
+            if debug:
+                print '    couldn\'t read germline bundle %s (%s)' % (bundlefname, e)
+
+    source_info = get_source_info(datadir, old_info=old_source_info)
+    if glfo is None or any(source_info[basename][2] != old_source_info.get(basename, (None, None, None))[2] for basename in source_basenames):  # no bundle, or the contents of a source file changed
+        if debug:
+            print '    rebuilding germline bundle in %s' % datadir
+        glfo = read_glfo_from_source(datadir)
+        write_bundle(bundlefname, glfo, source_info)
+    elif source_info != old_source_info:  # only mtimes changed, so update them to avoid re-hashing next time
+        write_bundle(bundlefname, glfo, source_info)
+    if not os.path.exists(datadir + '/v-meta.csv'):  # bcrham reads the csv version
+        utils.read_cyst_positions(datadir)
+
+    if only_genes is not None:
+        restrict_to_genes(glfo, only_genes)
+    return glfo
+
+# ----------------------------------------------------------------------------------------
+def write_bundle(bundlefname, glfo, source_info):
+    """ write to a temporary file and then move it into place, so that other processes never see a half-written bundle """
+    tmpfname = bundlefname + '.' + str(os.getpid())
+    try:
+        with open(tmpfname, 'wb') as bundlefile:
+            pickle.dump({'version' : bundle_version, 'source-info' : source_info, 'glfo' : glfo}, bundlefile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpfname, bundlefname)
+    except (IOError, OSError):  # can't write to datadir -- fine, we just won't have a bundle next time
+        if os.path.exists(tmpfname):
+            os.remove(tmpfname)
+
+# ----------------------------------------------------------------------------------------
+def restrict_to_genes(glfo, only_genes):
+    """ remove (in place) all genes not in <only_genes> """
+    only_genes = set(only_genes)
+    for region in utils.regions:
+        for gene in glfo['seqs'][region].keys():
+            if gene not in only_genes:
+                del glfo['seqs'][region][gene]
+    for gene in glfo['aligned-v-genes']['v'].keys():
+        if gene not in only_genes:
+            del glfo['aligned-v-genes']['v'][gene]
+    missing_genes = only_genes - set([g for region in utils.regions for g in glfo['seqs'][region]])
+    if len(missing_genes) > 0:
+        raise Exception('genes %s from --only-genes not found in germline set' % ' '.join(missing_genes))
+    # NOTE leaves the cyst and tryp positions for all genes, since they're small and nobody iterates over them
+
+# ----------------------------------------------------------------------------------------
+def get_restricted_glfo(glfo, only_genes):
+    """ return a copy of <glfo> that only includes <only_genes> """
+    restricted_glfo = copy.deepcopy(glfo)
+    restrict_to_genes(restricted_glfo, only_genes)
+    return restricted_glfo
+
+# ----------------------------------------------------------------------------------------
+def write_glfo(outdir, glfo):
+    """ write <glfo> to the same files that it's read from (e.g. for vdjalign and bcrham) """
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    def write_fasta(fname, genes):
+        with open(fname, 'w') as outfile:
+            for gene, seq in genes.items():
+                outfile.write('>' + gene + '\n')
+                outfile.write(seq + '\n')
+
+    for region in utils.regions:
+        write_fasta(outdir + '/igh' + region + '.fasta', glfo['seqs'][region])
+    write_fasta(outdir + '/ighv-aligned.fasta', glfo['aligned-v-genes']['v'])
+
+    with open(outdir + '/v-meta.json', 'w') as jsonfile:
+        json.dump(glfo['cyst-positions'], jsonfile)
+    with open(outdir + '/v-meta.csv', 'w') as csvfile:
+        writer = csv.DictWriter(csvfile, ('gene', 'cyst_start'))
+        writer.writeheader()
+        for gene in glfo['cyst-positions']:
+            writer.writerow({'gene' : gene, 'cyst_start' : glfo['cyst-positions'][gene]['cysteine-position']})
+    with open(outdir + '/j_tryp.csv', 'w') as csvfile:
+        writer = csv.DictWriter(csvfile, ('gene', 'tryp_start'))
+        writer.writeheader()
+        for gene in glfo['tryp-positions']:
+            writer.writerow({'gene' : gene, 'tryp_start' : glfo['tryp-positions'][gene]})
+
+    return [outdir + '/' + basename for basename in source_basenames + ['v-meta.csv']]  # return the written files so they can be deleted if desired
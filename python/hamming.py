@@ -0,0 +1,191 @@
+""" Batch hamming fractions: encode sequences once as uint8 arrays (with a mask of ambiguous positions), then calculate one-vs-many or all-pairs distances with numpy """
+import numpy
+
+import utils
+
+# ----------------------------------------------------------------------------------------
+def get_allowed_codes(extra_bases=None):
+    alphabet = utils.nukes + utils.ambiguous_bases
+    if extra_bases is not None:
+        alphabet = alphabet + list(extra_bases)
+    allowed = numpy.zeros(256, dtype=bool)
+    allowed[[ord(ch) for ch in alphabet]] = True
+    return allowed
+
+ambiguous_codes = numpy.zeros(256, dtype=bool)
+ambiguous_codes[[ord(ch) for ch in utils.ambiguous_bases]] = True
+
+base_index = numpy.full(256, 4, dtype=numpy.int64)  # three bits for each base in position_keys() (with everything ambiguous sorting after ACGT)
+base_index[[ord(b) for b in utils.nukes]] = numpy.arange(len(utils.nukes))
+
+# ----------------------------------------------------------------------------------------
+def encode(seq, allowed_codes):
+    """ return (array of character codes, mask that's False at ambiguous positions) for <seq> """
+    codes = numpy.frombuffer(seq, dtype=numpy.uint8)
+    if not allowed_codes[codes].all():
+        bad_chars = set([ch for ch in seq if not allowed_codes[ord(ch)]])
+        raise Exception('unexpected character(s) %s in hamming fraction input:\n  %s' % (' '.join(bad_chars), seq))
+    return codes, ~ambiguous_codes[codes]
+
+# ----------------------------------------------------------------------------------------
+class EncodedSeqs(object):
+    """
+    A set of sequences encoded for fast hamming fractions, which match utils.hamming_fraction(): positions that are ambiguous in either sequence are
+    skipped, and the fraction is zero if there are no unambiguous positions.
+    Pass a list of sequences (and refer to them by index), or a dict (and use self.index to get the index for each name).
+    """
+    def __init__(self, seqs, extra_bases=None):
+        if hasattr(seqs, 'keys'):
+            self.names = list(seqs.keys())
+            seqs = [seqs[name] for name in self.names]
+        else:
+            self.names = None
+        self.index = None if self.names is None else {name : i for i, name in enumerate(self.names)}
+        self.seqs = [str(seq) for seq in seqs]
+        self.lengths = numpy.array([len(seq) for seq in self.seqs], dtype=int)
+
+        allowed_codes = get_allowed_codes(extra_bases)
+        self.codes, self.valid = [], []
+        for seq in self.seqs:
+            codes, valid = encode(seq, allowed_codes)
+            self.codes.append(codes)
+            self.valid.append(valid)
+
+        # stack the sequences of each length into a matrix, so we can do one-vs-many with fancy indexing
+        self.length_groups = {}  # length : (indices into self.seqs, code matrix, valid matrix)
+        self.row_in_group = numpy.zeros(len(self.seqs), dtype=int)
+        for length in set(self.lengths):
+            indices = numpy.nonzero(self.lengths == length)[0]
+            self.row_in_group[indices] = numpy.arange(len(indices))
+            code_matrix = numpy.array([self.codes[i] for i in indices], dtype=numpy.uint8).reshape(len(indices), length)
+            valid_matrix = numpy.array([self.valid[i] for i in indices], dtype=bool).reshape(len(indices), length)
+            self.length_groups[length] = (indices, code_matrix, valid_matrix)
+
+    # ----------------------------------------------------------------------------------------
+    @classmethod
+    def from_code_matrix(cls, names, code_matrix):
+        """ build from an already-encoded (n_seqs, length) uint8 matrix (e.g. from SequenceStore.get_padded_matrix()), without going through strings """
+        encoded_seqs = cls([])
+        encoded_seqs.names = list(names)
+        encoded_seqs.index = {name : i for i, name in enumerate(encoded_seqs.names)}
+        encoded_seqs.seqs = None
+        n_seqs, length = code_matrix.shape
+        if not get_allowed_codes()[code_matrix].all():
+            raise Exception('unexpected character(s) %s in hamming fraction input' % ' '.join(set([chr(c) for c in numpy.unique(code_matrix) if not get_allowed_codes()[c]])))
+        valid_matrix = ~ambiguous_codes[code_matrix]
+        encoded_seqs.lengths = numpy.full(n_seqs, length, dtype=int)
+        encoded_seqs.codes, encoded_seqs.valid = list(code_matrix), list(valid_matrix)
+        encoded_seqs.row_in_group = numpy.arange(n_seqs)
+        encoded_seqs.length_groups = {length : (numpy.arange(n_seqs), code_matrix, valid_matrix)} if n_seqs > 0 else {}
+        return encoded_seqs
+
+    # ----------------------------------------------------------------------------------------
+    def __len__(self):
+        return len(self.lengths)
+
+    # ----------------------------------------------------------------------------------------
+    def hamming_fraction(self, i, j, return_len_excluding_ambig=False):
+        """ single-pair version, for when you really only need one """
+        fractions, lengths = self.one_vs_many(i, [j], return_len_excluding_ambig=True)
+        if return_len_excluding_ambig:
+            return float(fractions[0]), int(lengths[0])
+        return float(fractions[0])
+
+    # ----------------------------------------------------------------------------------------
+    def one_vs_many(self, i, others=None, return_len_excluding_ambig=False):
+        """ return array of hamming fractions between sequence <i> and each of the sequences in <others> (default: all of them), which all have to be the same length as <i> """
+        length = self.lengths[i]
+        indices, code_matrix, valid_matrix = self.length_groups[length]
+        if others is None:
+            if len(indices) != len(self):
+                raise Exception('sequences aren\'t all the same length, so can\'t compare %d to all of them' % i)
+            rows = self.row_in_group
+        else:
+            others = numpy.asarray(others, dtype=int)
+            if (self.lengths[others] != length).any():
+                raise Exception('sequence lengths differ from %d for %s' % (length, [j for j in others if self.lengths[j] != length]))
+            rows = self.row_in_group[others]
+
+        both_valid = valid_matrix[rows] & self.valid[i]
+        n_valid = both_valid.sum(axis=1)
+        n_different = ((code_matrix[rows] != self.codes[i]) & both_valid).sum(axis=1)
+        fractions = numpy.where(n_valid > 0, n_different / numpy.maximum(n_valid, 1).astype(float), 0.)
+        if return_len_excluding_ambig:
+            return fractions, n_valid
+        return fractions
+
+    # ----------------------------------------------------------------------------------------
+    def pair_fractions(self, first, second, chunk_size=None):
+        """ return array of hamming fractions between each pair (<first>[i], <second>[i]) of sequences (which must all be the same length) """
+        if len(self.length_groups) > 1:
+            raise Exception('pairwise hamming fractions need sequences of the same length (got %s)' % ' '.join([str(l) for l in sorted(self.length_groups)]))
+        first, second = numpy.asarray(first, dtype=int), numpy.asarray(second, dtype=int)
+        fractions = numpy.zeros(len(first))
+        if len(first) == 0:
+            return fractions
+        indices, code_matrix, valid_matrix = self.length_groups.values()[0]
+        if chunk_size is None:
+            chunk_size = max(1, 2**24 / max(1, code_matrix.shape[1]))  # keep the intermediate arrays to a few tens of MB
+        for istart in range(0, len(first), chunk_size):
+            rows_a, rows_b = self.row_in_group[first[istart : istart + chunk_size]], self.row_in_group[second[istart : istart + chunk_size]]
+            both_valid = valid_matrix[rows_a] & valid_matrix[rows_b]
+            n_valid = numpy.add.reduce(both_valid.view(numpy.uint8), axis=1, dtype=numpy.int32)  # (a lot faster than sum() on bools)
+            n_different = numpy.add.reduce(((code_matrix[rows_a] != code_matrix[rows_b]) & both_valid).view(numpy.uint8), axis=1, dtype=numpy.int32)
+            fractions[istart : istart + chunk_size] = numpy.where(n_valid > 0, n_different / numpy.maximum(n_valid, 1).astype(float), 0.)
+        return fractions
+
+    # ----------------------------------------------------------------------------------------
+    def position_keys(self, positions):
+        """ return an int64 key for each sequence (which must all be the same length) made from its bases at <positions> (at most 21 of them), i.e. sequences that match at those positions get the same key """
+        if len(self.length_groups) > 1:
+            raise Exception('position keys need sequences of the same length (got %s)' % ' '.join([str(l) for l in sorted(self.length_groups)]))
+        if len(positions) > 21:  # 21 * 3 bits fit in an int64
+            raise Exception('too many positions for int64 keys: %d' % len(positions))
+        keys = numpy.zeros(len(self), dtype=numpy.int64)
+        if len(self) == 0:
+            return keys
+        indices, code_matrix, _ = self.length_groups.values()[0]
+        for pos in positions:
+            keys[indices] = (keys[indices] << 3) | base_index[code_matrix[:, pos]]
+        return keys
+
+    # ----------------------------------------------------------------------------------------
+    def all_pairs_blocks(self, block_size=None, return_len_excluding_ambig=False):
+        """
+        Yield (istart, istop, fractions) with the hamming fractions between sequences [istart, istop) and all sequences (all of which must be the same length).
+        Uses one-hot encodings and matrix products, so the memory for each block goes as <block_size> * len(self).
+        """
+        if len(self.length_groups) > 1:
+            raise Exception('all-pairs hamming fractions need sequences of the same length (got %s)' % ' '.join([str(l) for l in sorted(self.length_groups)]))
+        if len(self) == 0:
+            return
+        indices, code_matrix, valid_matrix = self.length_groups.values()[0]
+        assert (indices == numpy.arange(len(self))).all()
+        n_seqs, length = code_matrix.shape
+        if block_size is None:
+            block_size = max(1, min(n_seqs, 2**22 / max(1, n_seqs)))  # keep each block's intermediate arrays to a few tens of MB
+
+        # one-hot encode each unambiguous character (float32 is exact for counts this size, and lets us use blas)
+        chars = numpy.unique(code_matrix[valid_matrix])
+        onehot = numpy.zeros((n_seqs, length * len(chars)), dtype=numpy.float32)
+        for ich, ch in enumerate(chars):
+            onehot[:, ich*length : (ich+1)*length] = (code_matrix == ch)  # ambiguous positions are never equal to an unambiguous <ch>
+        valid = valid_matrix.astype(numpy.float32)
+
+        for istart in range(0, n_seqs, block_size):
+            istop = min(n_seqs, istart + block_size)
+            n_valid = valid[istart : istop].dot(valid.T).astype(float)  # convert before dividing, so we get the same fractions as utils.hamming_fraction()
+            n_same = onehot[istart : istop].dot(onehot.T).astype(float)
+            fractions = numpy.where(n_valid > 0, (n_valid - n_same) / numpy.maximum(n_valid, 1.), 0.)
+            if return_len_excluding_ambig:
+                yield istart, istop, fractions, n_valid.astype(int)
+            else:
+                yield istart, istop, fractions
+
+    # ----------------------------------------------------------------------------------------
+    def all_pairs(self, block_size=None):
+        """ return the full matrix of hamming fractions between all pairs of sequences (which must all be the same length) """
+        fractions = numpy.zeros((len(self), len(self)))
+        for istart, istop, block in self.all_pairs_blocks(block_size=block_size):
+            fractions[istart : istop] = block
+        return fractions
@@ -0,0 +1,179 @@
+""" Index over same-length (e.g. padded naive) sequences for finding all pairs, or all neighbors of one sequence, within a hamming fraction, without comparing every pair """
+import csv
+import math
+import time
+import multiprocessing
+import numpy
+
+import hmmcache
+
+pool_index = None  # the index that pairs() is working on, for its pool processes (which get it by forking, so it doesn't have to be pickled)
+
+# ----------------------------------------------------------------------------------------
+def run_pool_task(args):
+    task, min_fraction = args
+    return pool_index.run_task(task, min_fraction)
+
+# ----------------------------------------------------------------------------------------
+class HammingIndex(object):
+    """
+    Multi-index hashing, i.e. the pigeonhole principle: if two sequences of length L differ at no more than d = <max_fraction> * L positions, and we split the positions
+    into d + 1 segments, at least one segment has to match exactly. So we key each sequence by its bases in each segment, take pairs that share a key in any segment as
+    candidates, and only calculate hamming fractions for those.
+    The wrinkle is that hamming fractions skip ambiguous positions (e.g. padding), and we can't key a segment with ambiguous bases, so we add two more segments for each
+    of the (at most <n_allowed_ambiguous>) segments in which each sequence of a pair can have ambiguous bases. Sequences with more than that (which shouldn't be many)
+    are compared to everything by brute force. So the results are exact (the same as hamming.EncodedSeqs.all_pairs_blocks()), it's just that the more similar the
+    sequences are, the more candidates there'll be (e.g. if they all come from a few germlines, most of the pairs from the same germline will share a segment).
+    """
+    def __init__(self, encoded_seqs, max_fraction, n_allowed_ambiguous=None, debug=False):
+        start = time.time()
+        self.encoded_seqs = encoded_seqs
+        self.max_fraction = max_fraction
+        if len(encoded_seqs.length_groups) > 1:
+            raise Exception('hamming index needs sequences of the same length (got %s)' % ' '.join([str(l) for l in sorted(encoded_seqs.length_groups)]))
+        self.n_seqs = len(encoded_seqs)
+        if self.n_seqs == 0:
+            self.segments, self.segment_keys, self.brute_force, self.is_brute, self.sorted_keys = [], numpy.zeros((0, 0), dtype=numpy.int64), numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=bool), []
+            return
+        _, self.code_matrix, self.valid_matrix = encoded_seqs.length_groups.values()[0]
+        length = self.code_matrix.shape[1]
+        max_differences = int(math.floor(max_fraction * length + 1e-9))  # (the number of valid positions is at most <length>) NOTE don't just truncate, since e.g. 0.29 * 100 is 28.999...
+
+        # choose the number of segments: if we don't say how many ambiguous segments to allow, allow as many as all but 1% of the sequences need
+        n_tries = [n_allowed_ambiguous, ] if n_allowed_ambiguous is not None else range(length)
+        for n_ambig in n_tries:
+            n_segments = min(length, max_differences + 1 + 2 * n_ambig)
+            segments = numpy.array_split(numpy.arange(length), n_segments)
+            segment_ok = numpy.array([self.valid_matrix[:, seg].all(axis=1) for seg in segments]).T  # (n_seqs, n_segments): no ambiguous bases in the segment
+            n_ambiguous_segments = n_segments - segment_ok.sum(axis=1)
+            if n_allowed_ambiguous is not None or n_segments == length or numpy.percentile(n_ambiguous_segments, 99) <= n_ambig:
+                break
+        self.segments = [seg[ : 21] for seg in segments]  # position_keys() can only do 21 positions (matching at the first 21 is all we need, it just makes a few more candidates)
+        self.n_allowed_ambiguous = n_ambig
+        self.brute_force = numpy.nonzero(n_ambiguous_segments > n_ambig)[0]
+        self.is_brute = numpy.zeros(self.n_seqs, dtype=bool)
+        self.is_brute[self.brute_force] = True
+
+        # key each sequence in each segment (-1 for segments with ambiguous bases, which never match), and sort each segment's keys so we can find the runs of identical ones
+        self.segment_keys = numpy.full((len(self.segments), self.n_seqs), -1, dtype=numpy.int64)  # (n_segments, n_seqs), so each segment's keys are contiguous
+        self.sorted_keys = []  # for each segment: (indices of sequences with a key, sorted by key; their sorted keys)
+        for iseg in range(len(self.segments)):
+            self.segment_keys[iseg] = numpy.where(segment_ok[:, iseg], encoded_seqs.position_keys(self.segments[iseg]), -1)
+            keyed = numpy.nonzero(segment_ok[:, iseg])[0]
+            order = keyed[numpy.argsort(self.segment_keys[iseg, keyed], kind='mergesort')]
+            self.sorted_keys.append((order, self.segment_keys[iseg, order]))
+        if debug:
+            print '    hamming index: %d seqs, max fraction %.3f (%d differences), %d segments of %d positions allowing %d ambiguous (%d brute force seqs) in %.2fs' % (self.n_seqs, max_fraction, max_differences, len(self.segments),
+                                                                                                                                                  len(segments[0]), n_ambig, len(self.brute_force), time.time() - start)
+
+    # ----------------------------------------------------------------------------------------
+    def neighbors(self, iseq, min_fraction=0.):
+        """ return (indices, hamming fractions) of the sequences within [<min_fraction>, self.max_fraction] of sequence <iseq> (not including itself) """
+        if iseq in self.brute_force:
+            candidates = numpy.arange(self.n_seqs)
+        else:
+            candidates = [self.brute_force, ]
+            for iseg in range(len(self.segments)):
+                key = self.segment_keys[iseg, iseq]
+                if key < 0:
+                    continue
+                order, sorted_keys = self.sorted_keys[iseg]
+                istart, istop = numpy.searchsorted(sorted_keys, key, side='left'), numpy.searchsorted(sorted_keys, key, side='right')
+                candidates.append(order[istart : istop])
+            candidates = numpy.unique(numpy.concatenate(candidates))
+        candidates = candidates[candidates != iseq]
+        fractions = self.encoded_seqs.one_vs_many(iseq, candidates)
+        close = (fractions >= min_fraction) & (fractions <= self.max_fraction)
+        return candidates[close], fractions[close]
+
+    # ----------------------------------------------------------------------------------------
+    def candidate_pairs(self, iseg):
+        """ return (first, second) indices of the pairs that share a key in segment <iseg>, but not in any earlier segment (so each candidate turns up exactly once) """
+        order, sorted_keys = self.sorted_keys[iseg]
+        if len(order) < 2:
+            return numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int)
+        run_starts = numpy.concatenate([[0], numpy.nonzero(sorted_keys[1:] != sorted_keys[:-1])[0] + 1])
+        run_sizes = numpy.diff(numpy.concatenate([run_starts, [len(order)]]))
+        # pair each position in the sorted order with every later position in its run
+        run_stops = numpy.repeat(run_starts + run_sizes, run_sizes)
+        n_later = run_stops - numpy.arange(len(order)) - 1
+        ifirst = numpy.repeat(numpy.arange(len(order)), n_later)
+        pair_starts = numpy.cumsum(n_later) - n_later  # index of each position's first pair
+        isecond = ifirst + 1 + numpy.arange(len(ifirst)) - numpy.repeat(pair_starts, n_later)
+        ifirst, isecond = order[ifirst], order[isecond]
+        for jseg in range(iseg):  # one segment at a time, throwing out matches as we go (a lot faster than gathering all the earlier keys at once)
+            first_keys = self.segment_keys[jseg][ifirst]
+            new = (first_keys != self.segment_keys[jseg][isecond]) | (first_keys < 0)
+            ifirst, isecond = ifirst[new], isecond[new]
+        return ifirst, isecond
+
+    # ----------------------------------------------------------------------------------------
+    def close_pairs(self, ifirst, isecond, min_fraction):
+        """ return (first, second, hamming fractions) for the pairs in (<ifirst>, <isecond>) within [<min_fraction>, self.max_fraction] (with first < second) """
+        fractions = self.encoded_seqs.pair_fractions(ifirst, isecond)
+        close = (fractions >= min_fraction) & (fractions <= self.max_fraction)
+        return numpy.minimum(ifirst, isecond)[close], numpy.maximum(ifirst, isecond)[close], fractions[close]
+
+    # ----------------------------------------------------------------------------------------
+    def segment_pairs(self, iseg, min_fraction):
+        """ close_pairs() for the candidates from segment <iseg> (leaving out brute force sequences), and the number of candidates """
+        ifirst, isecond = self.candidate_pairs(iseg)
+        keep = ~self.is_brute[ifirst] & ~self.is_brute[isecond]
+        return self.close_pairs(ifirst[keep], isecond[keep], min_fraction) + (int(keep.sum()), )
+
+    # ----------------------------------------------------------------------------------------
+    def brute_force_pairs(self, iseq, min_fraction):
+        """ close_pairs() for brute force sequence <iseq> against everybody that isn't an earlier brute force sequence, and the number of candidates """
+        others = numpy.arange(self.n_seqs)
+        others = others[(others != iseq) & ~(self.is_brute & (others < iseq))]
+        return self.close_pairs(numpy.full(len(others), iseq, dtype=int), others, min_fraction) + (len(others), )
+
+    # ----------------------------------------------------------------------------------------
+    def pairs(self, min_fraction=0., n_procs=1, debug=False):
+        """
+        return (first, second, hamming fractions) for every pair (with first < second) within [<min_fraction>, self.max_fraction]
+        With <n_procs> greater than 1, the segments (and brute force sequences) are split among that many forked processes (which see the index without it being pickled).
+        """
+        start = time.time()
+        tasks = [('segment', iseg) for iseg in range(len(self.segments))] + [('brute', iseq) for iseq in self.brute_force]
+        if n_procs > 1 and len(tasks) > 1:
+            global pool_index
+            pool_index = self
+            pool = multiprocessing.Pool(min(n_procs, len(tasks)))
+            try:
+                results = pool.map(run_pool_task, [(task, min_fraction) for task in tasks], chunksize=max(1, len(tasks) / (4 * n_procs)))  # (brute force tasks are small, so don't send them one at a time)
+            finally:
+                pool.close()
+                pool.join()
+                pool_index = None
+        else:
+            results = [self.run_task(task, min_fraction) for task in tasks]
+
+        if len(results) > 0:
+            ifirst, isecond, fractions = [numpy.concatenate([r[i] for r in results]) for i in range(3)]
+        else:
+            ifirst, isecond, fractions = numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int), numpy.zeros(0)
+        if debug:
+            n_candidates, n_total = sum([r[3] for r in results]), self.n_seqs * (self.n_seqs - 1) / 2
+            print '    hamming index: %d pairs within %.3f - %.3f from %d candidates (%.2f%% of all pairs) in %.2fs' % (len(fractions), min_fraction, self.max_fraction, n_candidates, 100. * n_candidates / max(1, n_total), time.time() - start)
+        return ifirst, isecond, fractions
+
+    # ----------------------------------------------------------------------------------------
+    def run_task(self, task, min_fraction):
+        kind, ival = task
+        return self.segment_pairs(ival, min_fraction) if kind == 'segment' else self.brute_force_pairs(ival, min_fraction)
+
+    # ----------------------------------------------------------------------------------------
+    def write_pairs(self, outfname, min_fraction=0.):
+        """
+        write each pair within [<min_fraction>, self.max_fraction] as a line of a bcrham cache file, with its (joined) names and naive hamming fraction. Since bcrham looks
+        up naive hamming fractions in its input cache file by joined key before calculating them, it can use this directly (or after appending it to the main cache file).
+        """
+        ifirst, isecond, fractions = self.pairs(min_fraction=min_fraction)
+        names = self.encoded_seqs.names
+        with open(outfname, 'w') as outfile:
+            writer = csv.DictWriter(outfile, hmmcache.headers)
+            writer.writeheader()
+            for ia, ib, fraction in zip(ifirst.tolist(), isecond.tolist(), fractions.tolist()):
+                writer.writerow({'unique_ids' : ':'.join(sorted([names[ia], names[ib]])), 'naive_hfrac' : fraction})  # same joining as glomerator.cc's JoinNames()
+        return len(fractions)
@@ -0,0 +1,201 @@
+""" The bcrham cache file (log probs and naive seqs for each set of unique ids), treated as an append-only log with an in-memory index from each key to its lines """
+import os
+import sys
+import csv
+import time
+import fcntl
+from subprocess import check_call
+
+import csvmerge
+
+headers = ['unique_ids', 'logprob', 'naive_seq', 'naive_hfrac', 'cyst_position', 'errors']
+
+# ----------------------------------------------------------------------------------------
+class HmmCache(object):
+    """
+    bcrham reads the whole file (with --input-cachefile, so every process can share the same one read-only), and writes only its new values to a separate file,
+    which we then tack onto the end of this one with append_file(). So the file only ever grows, and each key can have several lines (e.g. one from a run
+    that calculated its naive seq, and one from a later run that calculated its log prob), with later non-empty values taking precedence.
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        self.index = {}  # key : list of byte offsets of its lines
+        self.indexed_size = 0  # we've indexed everything up to here
+        self.n_bytes_read, self.n_bytes_written = 0, 0
+        self.update_index()
+
+    # ----------------------------------------------------------------------------------------
+    def __len__(self):
+        return len(self.index)
+
+    # ----------------------------------------------------------------------------------------
+    def __contains__(self, key):
+        return key in self.index
+
+    # ----------------------------------------------------------------------------------------
+    def keys(self):
+        return self.index.keys()
+
+    # ----------------------------------------------------------------------------------------
+    def size(self):
+        return os.path.getsize(self.fname) if os.path.exists(self.fname) else 0
+
+    # ----------------------------------------------------------------------------------------
+    def update_index(self):
+        """ index any lines that have been added since the last time we looked """
+        if self.size() < self.indexed_size:
+            raise Exception('cache file %s shrank (from %d to %d bytes) -- it should only ever be appended to' % (self.fname, self.indexed_size, self.size()))
+        if self.size() == self.indexed_size:
+            return
+        with open(self.fname) as cachefile:
+            cachefile.seek(self.indexed_size)
+            offset = self.indexed_size
+            index = self.index
+            for line in cachefile:  # (we keep track of the offset ourselves, since tell() doesn't work while iterating)
+                if offset == 0:
+                    check_header(line, self.fname)
+                elif len(line) > 1:
+                    key = line[ : line.find(',')]
+                    if key in index:
+                        index[key].append(offset)
+                    else:
+                        index[key] = [offset]
+                offset += len(line)
+            self.n_bytes_read += offset - self.indexed_size
+            self.indexed_size = offset
+
+    # ----------------------------------------------------------------------------------------
+    def get(self, key):
+        """ return a dict with the info for <key> (with empty strings for values we don't have) """
+        info = {h : '' for h in headers}
+        with open(self.fname) as cachefile:
+            for offset in self.index[key]:
+                cachefile.seek(offset)
+                line = cachefile.readline()
+                self.n_bytes_read += len(line)
+                for head, val in zip(headers, next(csv.reader([line]))):
+                    if val != '':
+                        info[head] = val
+        return info
+
+    # ----------------------------------------------------------------------------------------
+    def read_all(self, start=0):
+        """ return a dict with the info for every key in the lines from byte offset <start> on, reading the file straight through (rather than seeking around like get()) """
+        cacheinfo = {}
+        if not os.path.exists(self.fname) or start >= self.size():
+            return cacheinfo
+        with open(self.fname) as cachefile:
+            if start == 0:
+                check_header(cachefile.readline(), self.fname)
+            else:
+                cachefile.seek(start)
+            reader = csv.reader(cachefile)
+            for vals in reader:
+                if len(vals) == 0:
+                    continue
+                info = cacheinfo.setdefault(vals[0], {h : '' for h in headers})
+                for head, val in zip(headers, vals):
+                    if val != '':
+                        info[head] = val
+        self.n_bytes_read += self.size() - start
+        return cacheinfo
+
+    # ----------------------------------------------------------------------------------------
+    def append_file(self, fname, remove=True):
+        """ tack the (non-header) lines in bcrham cache file <fname> onto the end of the cache, and return the number of lines """
+        n_lines = 0
+        header = csvmerge.read_header(fname)
+        if header is not None:
+            check_header(header, fname)
+            size_before = self.size()
+            n_lines = csvmerge.merge_csvs([self.fname, fname], self.fname)
+            self.n_bytes_written += self.size() - size_before
+        if remove and os.path.exists(fname):
+            os.remove(fname)
+        self.update_index()
+        return n_lines
+
+    # ----------------------------------------------------------------------------------------
+    def append_files(self, fnames, remove=True):
+        """ append each of <fnames>, and print how long it took and how much we read and wrote """
+        start = time.time()
+        bytes_before = self.n_bytes_read + self.n_bytes_written
+        n_lines = sum([self.append_file(fname, remove=remove) for fname in fnames])
+        print '      cache: appended %d lines from %d files in %.3fs (%.1f kB i/o), now %d keys in %.1f MB' % (n_lines, len(fnames), time.time() - start, (self.n_bytes_read + self.n_bytes_written - bytes_before) / 1e3, len(self), self.size() / 1e6)
+
+# ----------------------------------------------------------------------------------------
+class FileLock(object):
+    """
+    Hold an flock on <fname> + '.lock' (shared or exclusive) for the duration of a with block. Opening with O_CREAT and then locking is atomic, unlike checking
+    if the lock file exists and then creating it. NOTE we never remove the lock file, since somebody else could be waiting on it.
+    """
+    def __init__(self, fname, exclusive=True):
+        self.lockfname = fname + '.lock'
+        self.exclusive = exclusive
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = os.open(self.lockfname, os.O_RDWR | os.O_CREAT, 0664)
+        fcntl.flock(self.fd, fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)  # blocks until we get it
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+
+# ----------------------------------------------------------------------------------------
+def merge_into_persistent(cache, persistent_fname, start=0, debug=True):
+    """
+    Append to <persistent_fname> one line for each key in <cache> (an HmmCache) for which the persistent file is missing a key or value, while holding an
+    exclusive lock. So the persistent file is only indexed and appended to, never sorted or rewritten, and several runs can merge into it at once.
+    We only look at the lines in <cache> from byte offset <start> on (e.g. if everything before that was copied from the persistent file).
+    """
+    start_time = time.time()
+    newinfo = cache.read_all(start=start)
+    lock_start = time.time()
+    with FileLock(persistent_fname, exclusive=True):
+        lock_time = time.time() - lock_start
+        persistent = HmmCache(persistent_fname)  # only reads far enough into each line to index its key, so we only parse lines for keys that we also have
+        lines = []
+        for key, info in newinfo.items():
+            merged = persistent.get(key) if key in persistent else {h : '' for h in headers}
+            if all(info[h] == '' or merged[h] != '' for h in headers):  # nothing new
+                continue
+            merged = {h : (info[h] if info[h] != '' else merged[h]) for h in headers}
+            lines.append(','.join([merged[h] for h in headers]) + '\n')
+        with open(persistent_fname, 'a') as persistentfile:
+            if persistentfile.tell() == 0:
+                persistentfile.write(','.join(headers) + '\n')
+            persistentfile.write(''.join(lines))
+            persistentfile.flush()
+            os.fsync(persistentfile.fileno())
+    if debug:
+        print '  merged %d of %d keys into %s in %.3fs (%.3fs waiting for lock, read %.1f MB)' % (len(lines), len(newinfo), persistent_fname, time.time() - start_time, lock_time, persistent.n_bytes_read / 1e6)
+    return len(lines)
+
+# ----------------------------------------------------------------------------------------
+def copy_persistent(persistent_fname, outfname):
+    """
+    Copy <persistent_fname> to <outfname> while holding a shared lock (so we don't catch somebody in the middle of appending to it).
+    On linux we let cp make a copy-on-write clone if the filesystem supports it (e.g. btrfs or xfs), so no data gets written until somebody modifies one of them,
+    which for us means only the blocks at the end that we append to.
+    Returns the number of bytes copied.
+    """
+    start = time.time()
+    with FileLock(persistent_fname, exclusive=False):
+        if sys.platform.startswith('linux'):
+            check_call(['cp', '--reflink=auto', persistent_fname, outfname])
+        else:
+            with open(persistent_fname) as infile:
+                with open(outfname, 'w') as outfile:
+                    for chunk in iter(lambda: infile.read(1 << 20), ''):
+                        outfile.write(chunk)
+    n_bytes = os.path.getsize(outfname)
+    print '  copied persistent cache %s (%.1f MB) to workdir in %.3fs' % (persistent_fname, n_bytes / 1e6, time.time() - start)
+    return n_bytes
+
+# ----------------------------------------------------------------------------------------
+def check_header(line, fname):
+    if line.strip().split(',') != headers:
+        raise Exception('unexpected header in bcrham cache file %s: %s' % (fname, line.strip()))
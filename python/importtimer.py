@@ -0,0 +1,41 @@
+""" Keep track of how long each module takes to import (for --profile-startup). Only uses the standard library, so it can be installed before anything else gets imported. """
+import sys
+import time
+import __builtin__
+
+original_import = __builtin__.__import__
+start_time = None
+times = {}  # module name : [cumulative time, self time] (i.e. self time excludes imports triggered by this import)
+child_times = []  # stack with the time spent in child imports for each import that's currently in progress
+
+# ----------------------------------------------------------------------------------------
+def timed_import(name, *args, **kwargs):
+    if name in sys.modules or name in times:  # only time the first import of each module
+        return original_import(name, *args, **kwargs)
+    child_times.append(0.)
+    start = time.time()
+    try:
+        return original_import(name, *args, **kwargs)
+    finally:
+        cumulative = time.time() - start
+        self_time = cumulative - child_times.pop()
+        if child_times:
+            child_times[-1] += cumulative
+        times[name] = [cumulative, self_time]
+
+# ----------------------------------------------------------------------------------------
+def install():
+    global start_time
+    start_time = time.time()
+    __builtin__.__import__ = timed_import
+
+# ----------------------------------------------------------------------------------------
+def report(n_max=25, min_time=0.005):
+    __builtin__.__import__ = original_import
+    print '  import times (top %d, excluding those under %.3fs):' % (n_max, min_time)
+    print '        cumulative    self'
+    for name, (cumulative, self_time) in sorted(times.items(), key=lambda item: item[1][0], reverse=True)[:n_max]:
+        if cumulative < min_time:
+            break
+        print '          %6.3f     %6.3f    %s' % (cumulative, self_time, name)
+    print '        total import time %.3f (%.3f since startup, %d modules)' % (sum([t[1] for t in times.values()]), time.time() - start_time, len(times))
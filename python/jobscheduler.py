@@ -0,0 +1,220 @@
+""" Run a set of subprocesses, blocking on their exits (rather than polling), rerunning ones that fail, and keeping track of how much wall and cpu time each one took """
+import os
+import sys
+import time
+import errno
+import fcntl
+import select
+import signal
+import multiprocessing
+from subprocess import Popen
+
+# ----------------------------------------------------------------------------------------
+def get_max_concurrent(using_slurm):
+    """ if we're running locally, don't run more processes at once than we have cores (with slurm, the cores are somebody else's problem) """
+    if using_slurm:
+        return None
+    return multiprocessing.cpu_count()
+
+# ----------------------------------------------------------------------------------------
+def decode_status(status):
+    """ convert a status from os.wait*() to a Popen-style return code (negative for the signal number if it was killed) """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+# ----------------------------------------------------------------------------------------
+class Job(object):
+    def __init__(self, cmd_str, name, outfname=None, workdir=None):
+        self.cmd_str = cmd_str  # run with the shell, so it can include redirection
+        self.name = name  # for printing
+        self.outfname = outfname  # if set, we also require that this file exists before we consider the job successful
+        self.workdir = workdir
+        self.proc = None
+        self.own_process_group = False  # if set, <proc> is the leader of its own process group (so we can kill the shell *and* what it started)
+        self.returncode = None
+        self.n_tries = 0
+        self.start_time = None
+        self.wall_time, self.cpu_time = 0., 0.  # summed over all tries
+        self.succeeded = False
+
+    # ----------------------------------------------------------------------------------------
+    def start(self):
+        self.n_tries += 1
+        self.returncode = None
+        self.start_time = time.time()
+        self.proc = Popen(self.cmd_str, shell=True, preexec_fn=os.setpgrp)  # NOTE this means it doesn't get the terminal's ctrl-c, so the scheduler has to kill it if we get interrupted
+        self.own_process_group = True
+
+    # ----------------------------------------------------------------------------------------
+    def kill(self):
+        try:
+            if self.own_process_group:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            else:
+                self.proc.kill()
+        except OSError:  # already gone
+            pass
+
+    # ----------------------------------------------------------------------------------------
+    def finish(self, status, rusage):
+        self.returncode = decode_status(status)
+        self.proc.returncode = self.returncode  # we already reaped it, so tell Popen so it doesn't try to
+        self.wall_time += time.time() - self.start_time
+        self.cpu_time += rusage.ru_utime + rusage.ru_stime
+        self.succeeded = self.returncode == 0 and (self.outfname is None or os.path.exists(self.outfname))
+
+# ----------------------------------------------------------------------------------------
+class JobScheduler(object):
+    """
+    Start <jobs>, at most <max_concurrent> at a time (all of them if None), then wait for each to exit: we sleep until a SIGCHLD arrives (so there's no polling
+    delay), then reap only our own jobs with os.wait4() (which also gives us each one's resource usage). We don't wait on any child, since that would steal the
+    exits of other children of this process (e.g. the bcrham worker pool servers, which have to be able to notice when one of them dies).
+    Failed jobs are rerun (after a delay that doubles with each try) up to <max_tries> times, after which we raise an exception.
+    <finish_fcn>, if set, is called with each job every time it exits, before we decide if it succeeded (e.g. to process its stdout/stderr files).
+    """
+    def __init__(self, max_concurrent=None, max_tries=6, retry_delay=0.1, debug=False):
+        self.max_concurrent = max_concurrent
+        self.max_tries = max_tries
+        self.retry_delay = retry_delay  # seconds before the first retry (doubles each time)
+        self.debug = debug
+        self.wakeup_fds = None  # (read, write) ends of the pipe that SIGCHLD wakes us up with, while we're running
+
+    # ----------------------------------------------------------------------------------------
+    def run(self, jobs, finish_fcn=None):
+        running = {}  # pid : job
+        self.install_sigchld_handler()
+        try:
+            self.run_jobs(jobs, running, finish_fcn)
+        except BaseException:  # including KeyboardInterrupt, since the jobs are in their own process groups and won't see it
+            self.kill(running)
+            raise
+        finally:
+            self.remove_sigchld_handler()
+        self.report(jobs)
+
+    # ----------------------------------------------------------------------------------------
+    def install_sigchld_handler(self):
+        """ have SIGCHLD write a byte to a pipe, so wait() can block on the pipe with select() (signal handlers can only be set in the main thread, so elsewhere we just poll) """
+        self.wakeup_fds, self.old_sigchld_handler = None, None
+        read_fd, write_fd = os.pipe()
+        for fd in (read_fd, write_fd):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        # ----------------------------------------------------------------------------------------
+        def handle_sigchld(signum, frame):
+            try:
+                os.write(write_fd, '.')
+            except OSError:  # pipe's full, so there's already a wakeup waiting
+                pass
+
+        try:
+            self.old_sigchld_handler = signal.signal(signal.SIGCHLD, handle_sigchld)
+        except ValueError:  # not the main thread
+            os.close(read_fd)
+            os.close(write_fd)
+            return
+        signal.siginterrupt(signal.SIGCHLD, False)  # restart system calls that it interrupts, rather than raising EINTR all over the place
+        self.wakeup_fds = (read_fd, write_fd)
+
+    # ----------------------------------------------------------------------------------------
+    def remove_sigchld_handler(self):
+        if self.wakeup_fds is None:
+            return
+        signal.signal(signal.SIGCHLD, self.old_sigchld_handler if self.old_sigchld_handler is not None else signal.SIG_DFL)
+        for fd in self.wakeup_fds:
+            os.close(fd)
+        self.wakeup_fds = None
+
+    # ----------------------------------------------------------------------------------------
+    def run_jobs(self, jobs, running, finish_fcn):
+        waiting = [(0., job) for job in jobs]  # (earliest start time, job) for each job that isn't running
+        while len(waiting) > 0 or len(running) > 0:
+            now = time.time()
+            for start_time, job in sorted(waiting, key=lambda sj: sj[0]):  # start whatever we can
+                if self.max_concurrent is not None and len(running) >= self.max_concurrent:
+                    break
+                if start_time > now:
+                    continue
+                waiting.remove((start_time, job))
+                job.start()
+                running[job.proc.pid] = job
+
+            if len(running) == 0:  # nothing running, so the only thing to do is wait for the next retry
+                time.sleep(max(0., min([st for st, _ in waiting]) - time.time()))
+                continue
+
+            delayed = [st for st, _ in waiting if self.max_concurrent is None or len(running) < self.max_concurrent]
+            timeout = None if len(delayed) == 0 else max(0., min(delayed) - time.time())  # if a retry is waiting on its delay, rather than on a free slot, don't block past when it's due
+            pid, status, rusage = self.wait(running, timeout)
+            if pid == 0:
+                continue
+
+            job = running.pop(pid)
+            job.finish(status, rusage)
+            if finish_fcn is not None:
+                finish_fcn(job)
+            if job.succeeded:
+                continue
+            if job.n_tries >= self.max_tries:
+                raise Exception('exceeded max number of tries for command\n    %s\nlook for output in %s' % (job.cmd_str, job.workdir))
+            print '    rerunning proc %s (exited with %d' % (job.name, job.returncode),
+            if job.outfname is not None and not os.path.exists(job.outfname):
+                print ', output %s d.n.e.' % job.outfname,
+            print ')'
+            waiting.append((time.time() + self.retry_delay * 2**(job.n_tries - 1), job))
+            sys.stdout.flush()
+
+    # ----------------------------------------------------------------------------------------
+    def wait(self, running, timeout=None):
+        """ return (pid, status, rusage) for one of the <running> jobs that has exited, blocking for up to <timeout> seconds (forever if None) until one does, or (0, 0, None) if none did """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            for pid in running:
+                try:
+                    wpid, status, rusage = os.wait4(pid, os.WNOHANG)
+                except OSError as e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+                if wpid == pid:
+                    return wpid, status, rusage
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0.:
+                return 0, 0, None
+            if self.wakeup_fds is None:  # no signal handler, so poll
+                time.sleep(0.01 if remaining is None else min(0.01, remaining))
+                continue
+            try:
+                ready, _, _ = select.select([self.wakeup_fds[0]], [], [], remaining)  # a SIGCHLD after we checked the jobs above still writes to the pipe, so we can't miss it
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                continue
+            if len(ready) > 0:
+                try:
+                    while os.read(self.wakeup_fds[0], 4096):
+                        pass
+                except OSError as e:
+                    if e.errno != errno.EAGAIN:
+                        raise
+
+    # ----------------------------------------------------------------------------------------
+    def kill(self, running):
+        for job in running.values():
+            job.kill()
+            try:
+                job.proc.wait()
+            except OSError:
+                pass
+
+    # ----------------------------------------------------------------------------------------
+    def report(self, jobs):
+        if len(jobs) == 0:
+            return
+        wall_times = [job.wall_time for job in jobs]
+        print '      %d procs: wall time per proc %.1f - %.1f (mean %.1f), total cpu %.1f, %d reruns' % (len(jobs), min(wall_times), max(wall_times), sum(wall_times) / len(jobs),
+                                                                                                   sum([job.cpu_time for job in jobs]), sum([job.n_tries - 1 for job in jobs]))
+        if self.debug:
+            for job in jobs:
+                print '        %5s   wall %6.1f   cpu %6.1f   tries %d' % (job.name, job.wall_time, job.cpu_time, job.n_tries)
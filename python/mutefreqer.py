@@ -5,8 +5,6 @@ import os
 from subprocess import check_call
 import csv
 
-import plotting
-
 import utils
 import fraction_uncertainty
 import paramutils
@@ -73,6 +71,16 @@ class MuteFreqer(object):
             # NOTE <counts> hold the overall (not per-base) frequencies, while <freqs> holds the per-base frequencies
             counts, freqs, plotting_info = self.counts[gene], self.freqs[gene], self.plotting_info[gene]
             sorted_positions = sorted(counts)
+            if calculate_uncertainty:  # it's kinda slow, so do all the positions for this gene in one go
+                obs, totals = [], []
+                for position in sorted_positions:
+                    obs += [counts[position][nuke] for nuke in utils.nukes]
+                    obs.append(sum([counts[position][nuke] for nuke in utils.nukes if nuke != counts[position]['gl_nuke']]))  # n_mutated
+                    totals += [counts[position]['total'] for _ in range(len(utils.nukes) + 1)]
+                lo_errs, hi_errs, cached = fraction_uncertainty.err_many(obs, totals)
+                self.n_cached += int(cached.sum())
+                self.n_not_cached += len(cached) - int(cached.sum())
+                ierr = 0
             for position in sorted_positions:
                 freqs[position] = {}
                 plotting_info.append({})
@@ -83,12 +91,9 @@ class MuteFreqer(object):
                     nuke_freq = float(counts[position][nuke]) / counts[position]['total']
                     freqs[position][nuke] = nuke_freq
                     plotting_info[-1]['nuke_freqs'][nuke] = nuke_freq
-                    if calculate_uncertainty:  # it's kinda slow
-                        errs = fraction_uncertainty.err(counts[position][nuke], counts[position]['total'])
-                        if errs[2]:
-                            self.n_cached += 1
-                        else:
-                            self.n_not_cached += 1
+                    if calculate_uncertainty:
+                        errs = (float(lo_errs[ierr]), float(hi_errs[ierr]))
+                        ierr += 1
                         # print nuke_freq, errs[0], errs[1], '(', counts[position][nuke], ',', counts[position]['total'], ')'
                         assert errs[0] <= nuke_freq  # these checks are probably unnecessary. EDIT and totally saved my ass about ten minutes after writing the previous statement
                         assert nuke_freq <= errs[1]
@@ -102,12 +107,9 @@ class MuteFreqer(object):
                     # uncert = fraction_uncertainty.err(obs, total)  # uncertainty for each nuke
                 counts[position]['freq'] = float(n_mutated) / counts[position]['total']
                 mutated_fraction_err = (0.0, 0.0)
-                if calculate_uncertainty:  # it's kinda slow
-                    mutated_fraction_err = fraction_uncertainty.err(n_mutated, counts[position]['total'])
-                    if mutated_fraction_err[2]:
-                        self.n_cached += 1
-                    else:
-                        self.n_not_cached += 1
+                if calculate_uncertainty:
+                    mutated_fraction_err = (float(lo_errs[ierr]), float(hi_errs[ierr]))
+                    ierr += 1
                 counts[position]['freq_lo_err'] = mutated_fraction_err[0]
                 counts[position]['freq_hi_err'] = mutated_fraction_err[1]
 
@@ -157,6 +159,7 @@ class MuteFreqer(object):
 
     # ----------------------------------------------------------------------------------------
     def plot(self, base_plotdir, cyst_positions=None, tryp_positions=None, only_csv=False):
+        import plotting
         if not self.finalized:
             self.finalize()
 
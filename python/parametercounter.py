@@ -7,7 +7,6 @@ from subprocess import check_call
 
 import utils
 from opener import opener
-import plotting
 from mutefreqer import MuteFreqer
 
 # ----------------------------------------------------------------------------------------
@@ -104,6 +103,7 @@ class ParameterCounter(object):
 
     # ----------------------------------------------------------------------------------------
     def plot(self, plotdir, subset_by_gene=False, cyst_positions=None, tryp_positions=None, only_csv=False):
+        import plotting
         print '  plotting parameters'
         # start = time.time()
         utils.prep_dir(plotdir + '/plots')  #, multilings=('*.csv', '*.svg'))
@@ -6,20 +6,35 @@ import shutil
 import math
 import os
 import glob
+import resource
+import multiprocessing
 import csv
 csv.field_size_limit(sys.maxsize)  # make sure we can write very large csv fields
 import random
 from collections import OrderedDict
 from subprocess import Popen, check_call, PIPE, check_output, CalledProcessError
 import copy
+import numpy
 
 import utils
+import hamming
 from opener import opener
-from seqfileopener import get_seqfile_info
+import glutils
+from seqfileopener import get_seqfile_info, iterate_seqfile_info
 import annotationclustering
 from glomerator import Glomerator
+from hammingindex import HammingIndex
 from clusterpath import ClusterPath
+from uidmap import default_uidmap
 from waterer import Waterer
+from jobscheduler import Job
+from executor import get_executor
+from workerpool import WorkerPool
+from proccontroller import ProcController
+from progressmonitor import ProgressMonitor, read_progress
+import hmmcache
+import csvmerge
+from seqstore import SequenceStore
 from parametercounter import ParameterCounter
 from performanceplotter import PerformancePlotter
 from hist import Hist
@@ -29,28 +44,35 @@ class PartitionDriver(object):
     """ Class to parse input files, start bcrham jobs, and parse/interpret bcrham output for annotation and partitioning """
     def __init__(self, args):
         self.args = args
-        self.glfo = {}
-        self.glfo['seqs'] = utils.read_germlines(self.args.datadir)
-        self.glfo['aligned-v-genes'] = utils.read_germlines(self.args.datadir, only_region='v', aligned=True)
-        self.glfo['cyst-positions'] = utils.read_cyst_positions(self.args.datadir)
-        with opener('r')(self.args.datadir + '/j_tryp.csv') as csv_file:  # get location of <end> tryptophan in each j region
-            tryp_reader = csv.reader(csv_file)
-            self.glfo['tryp-positions'] = {row[0]:row[1] for row in tryp_reader}  # WARNING: this doesn't filter out the header line
-
-        if self.args.seqfile is not None:
+        self.glfo = glutils.read_glfo(self.args.datadir, debug=self.args.debug)  # NOTE *not* restricted to only_genes, since e.g. the true simulation genes can be outside of it
+
+        self.input_info, self.reco_info = None, None
+        if self.args.seqfile is not None and self.args.chunk_size is None:  # if we're reading in chunks, run_algorithm() reads each chunk as it gets to it
             self.input_info, self.reco_info = get_seqfile_info(self.args.seqfile, self.args.is_data, self.glfo, self.args.n_max_queries, self.args.queries, self.args.reco_ids)
+        self.duplicates = {}  # map from each representative unique id to the ids of its identical-sequence duplicates (empty unless --collapse-duplicates)
+        if self.input_info is not None and self.args.collapse_duplicates:
+            self.collapse_duplicates()
+        if self.input_info is not None:
+            default_uidmap.intern_many(self.input_info.keys())  # give each query a dense integer id (in input order), which is what partitions store internally
+        self.seqstore = SequenceStore()  # compact storage for the sw and naive sequences of each query (filled in by the waterer and get_naive_seqs())
         self.sw_info = None
+        self.ichunk = 0  # index of the chunk of input that we're currently annotating (always zero unless --chunk-size is set)
         self.paths = []
         self.smc_info = []
         self.bcrham_divvied_queries = None
+        self.divvy_predicted_costs = None  # predicted cost for each proc from the most recent python divvy (so we can compare to what actually happened)
         self.n_likelihoods_calculated = None
+        self.hmm_proc_wall_times = None  # wall time for each proc in the most recent call to execute()
+        self.hmm_cpu_time = 0.  # cpu time used by bcrham processes, summed over all calls to execute()
+        self.worker_pool = None  # long-lived bcrham processes (only if --worker-pool is set)
 
-        self.n_max_divvy = 100  # if input info is longer than this, divvy with bcrham
-        self.n_max_calc_per_process = 200  # if a bcrham process calc'd more than this many fwd + vtb values, don't decrease the number of processes in the next step
+        self.n_max_divvy = None  # if input info is longer than this, divvy with bcrham (None: never, since the python divvy handles 100k sequences in a few seconds)
 
         self.hmm_infname = self.args.workdir + '/hmm_input.csv'
         self.hmm_cachefname = self.args.workdir + '/hmm_cached_info.csv'
+        self.hmm_new_cachefname = self.args.workdir + '/hmm_new_cached_info.csv'  # each bcrham process writes its newly-calculated values here (in its subdir), which we then append to the main cache file
         self.hmm_outfname = self.args.workdir + '/hmm_output.csv'
+        self.hmm_progress_fname = self.args.workdir + '/hmm_progress.jsonl'  # when partitioning, each bcrham process writes its calculation counts here (in its subdir) as it goes
         self.annotation_fname = self.hmm_outfname.replace('.csv', '_annotations.csv')  # TODO won't work in parallel
 
         utils.prep_dir(self.args.workdir)
@@ -59,26 +81,23 @@ class PartitionDriver(object):
             if outdir != '' and not os.path.exists(outdir):
                 os.makedirs(outdir)
 
+        self.n_persistent_cache_bytes = 0  # how much of the start of our cache file came from the persistent cache (so we don't merge it back in)
         if self.args.persistent_cachefname is not None:
             if os.path.exists(self.args.persistent_cachefname):  # if it exists, copy it to workdir
-                check_call(['cp', '-v', self.args.persistent_cachefname, self.hmm_cachefname])
+                self.n_persistent_cache_bytes = hmmcache.copy_persistent(self.args.persistent_cachefname, self.hmm_cachefname)
             else:  # otherwise create it with just headers
                 pass  # hm, maybe do it in ham
+        self.hmm_cache = hmmcache.HmmCache(self.hmm_cachefname)
 
     # ----------------------------------------------------------------------------------------
     def clean(self):
+        if self.worker_pool is not None:
+            self.worker_pool.close()
+            self.worker_pool = None
+
         # merge persistent and current cache files into the persistent cache file
         if self.args.persistent_cachefname is not None:
-            lockfname = self.args.persistent_cachefname + '.lock'
-            while os.path.exists(lockfname):
-                print '  waiting for lock on %s' % lockfname
-                time.sleep(0.5)
-            lockfile = open(lockfname, 'w')
-            if not os.path.exists(self.args.persistent_cachefname):
-                open(self.args.persistent_cachefname, 'w').close()
-            self.merge_files(infnames=[self.args.persistent_cachefname, self.hmm_cachefname], outfname=self.args.persistent_cachefname, dereplicate=True)
-            lockfile.close()
-            os.remove(lockfname)
+            hmmcache.merge_into_persistent(self.hmm_cache, self.args.persistent_cachefname, start=self.n_persistent_cache_bytes)
         if not self.args.no_clean and os.path.exists(self.hmm_cachefname):
             os.remove(self.hmm_cachefname)
 
@@ -88,11 +107,21 @@ class PartitionDriver(object):
             except OSError:
                 raise Exception('workdir (%s) not empty: %s' % (self.args.workdir, ' '.join(os.listdir(self.args.workdir))))  # hm... you get weird recursive exceptions if you get here. Oh, well, it still works
 
+    # ----------------------------------------------------------------------------------------
+    def collapse_duplicates(self):
+        """ replace <self.input_info> with one representative for each set of identical sequences (duplicates are added back in when we write output) """
+        if self.args.action == 'cache-parameters':  # collapsing would change the parameter counts, since each sequence is supposed to be counted separately
+            print '  %s not collapsing duplicate sequences for parameter caching' % utils.color('yellow', 'note')
+            return
+        n_before = len(self.input_info)
+        self.input_info, self.duplicates = utils.collapse_duplicate_seqs(self.input_info)
+        print '  collapsed %d queries with identical sequences to %d (ratio %.3f)' % (n_before, len(self.input_info), float(len(self.input_info)) / n_before)
+
     # ----------------------------------------------------------------------------------------
     def cache_parameters(self):
         """ Infer full parameter sets and write hmm files for sequences from <self.input_info>, first with Smith-Waterman, then using the SW output as seed for the HMM """
         sw_parameter_dir = self.args.parameter_dir + '/sw'
-        waterer = Waterer(self.args, self.input_info, self.reco_info, self.glfo['seqs'], parameter_dir=sw_parameter_dir, write_parameters=True)
+        waterer = Waterer(self.args, self.input_info, self.reco_info, self.glfo, parameter_dir=sw_parameter_dir, write_parameters=True, seqstore=self.seqstore)
         waterer.run()
         self.sw_info = waterer.info
         self.write_hmms(sw_parameter_dir)
@@ -105,7 +134,26 @@ class PartitionDriver(object):
         """ Just run <algorithm> (either 'forward' or 'viterbi') on sequences in <self.input_info> and exit. You've got to already have parameters cached in <self.args.parameter_dir> """
         if not os.path.exists(self.args.parameter_dir):
             raise Exception('parameter dir (' + self.args.parameter_dir + ') d.n.e')
-        waterer = Waterer(self.args, self.input_info, self.reco_info, self.glfo['seqs'], parameter_dir=self.args.parameter_dir, write_parameters=False)
+
+        if self.args.chunk_size is None:
+            self.annotate(algorithm)
+            return
+
+        # read, align, annotate, and write <self.args.chunk_size> queries at a time, so memory doesn't grow with the size of the input file
+        initial_match_mismatch = list(self.args.match_mismatch)  # the waterer increases the mismatch score when it reruns queries, which shouldn't carry over to the next chunk
+        for self.input_info, self.reco_info in iterate_seqfile_info(self.args.seqfile, self.args.is_data, self.glfo, self.args.n_max_queries, self.args.queries, self.args.reco_ids, chunk_size=self.args.chunk_size):
+            print '  chunk %d (%d queries)' % (self.ichunk, len(self.input_info))
+            if self.args.collapse_duplicates:  # only collapses duplicates within each chunk
+                self.collapse_duplicates()
+            self.seqstore = SequenceStore()
+            self.args.match_mismatch[:] = initial_match_mismatch
+            self.annotate(algorithm)
+            self.ichunk += 1
+
+    # ----------------------------------------------------------------------------------------
+    def annotate(self, algorithm):
+        """ run smith-waterman and then <algorithm> on the queries in <self.input_info> """
+        waterer = Waterer(self.args, self.input_info, self.reco_info, self.glfo, parameter_dir=self.args.parameter_dir, write_parameters=False, seqstore=self.seqstore)
         waterer.run()
 
         self.sw_info = waterer.info
@@ -115,12 +163,12 @@ class PartitionDriver(object):
     # get number of clusters based on sum of last paths in <self.smc_info>
     def get_n_clusters(self):
         if self.args.smc_particles == 1:
-            return len(self.paths[-1].partitions[self.paths[-1].i_best_minus_x])
+            return len(self.paths[-1].encoded_partitions[self.paths[-1].i_best_minus_x])
 
         nclusters = 0
         for iproc in range(len(self.smc_info[-1])):  # number of processes
             path = self.smc_info[-1][iproc][0]  # uses the first smc particle, but the others will be similar
-            nclusters += len(path.partitions[path.i_best_minus_x])
+            nclusters += len(path.encoded_partitions[path.i_best_minus_x])
         return nclusters
 
     # ----------------------------------------------------------------------------------------
@@ -137,7 +185,7 @@ class PartitionDriver(object):
 
         # run smith-waterman
         start = time.time()
-        waterer = Waterer(self.args, self.input_info, self.reco_info, self.glfo['seqs'], parameter_dir=self.args.parameter_dir, write_parameters=False)
+        waterer = Waterer(self.args, self.input_info, self.reco_info, self.glfo, parameter_dir=self.args.parameter_dir, write_parameters=False, seqstore=self.seqstore)
         waterer.run()
         print '        water time: %.3f' % (time.time()-start)
         self.sw_info = waterer.info
@@ -163,40 +211,43 @@ class PartitionDriver(object):
                     self.smc_info[-1][-1].append(cp)
 
         # cache hmm naive seqs for each single query
-        if len(self.sw_info['queries']) > 50 or self.args.naive_vsearch or self.args.naive_swarm:
+        if len(self.sw_info['queries']) > 50 or self.args.naive_vsearch or self.args.naive_swarm or self.args.naive_single_linkage:
             n_precache_procs = int(math.ceil(float(len(self.sw_info['queries'])) / 100))
             if n_precache_procs > self.args.n_max_procs:
                 print '  naive precache procs too large %d, reducing to args.n_max_procs %d' % (n_precache_procs, self.args.n_max_procs)
                 n_precache_procs = self.args.n_max_procs
             self.run_hmm('viterbi', self.args.parameter_dir, n_procs=n_precache_procs, cache_naive_seqs=True)
 
-        if self.args.naive_vsearch or self.args.naive_swarm:
+        if self.args.naive_vsearch or self.args.naive_swarm or self.args.naive_single_linkage:
             self.cluster_with_naive_vsearch_or_swarm(self.args.parameter_dir)
             return
 
+        if self.args.smc_particles == 1:  # pre-flight report of how much work the first step has ahead of it
+            try:
+                self.estimate_number_of_forward_calculations(self.get_naive_seqs([{'names' : query} for query in self.sw_info['queries']], 'names', 'seqs'))
+            except Exception as e:  # it's only a report, so it shouldn't ever stop us partitioning
+                print '  %s couldn\'t estimate the number of forward calculations (%s: %s)' % (utils.color('red', 'warning'), e.__class__.__name__, e)
+
         # ----------------------------------------------------------------------------------------
         # run that shiznit
+        controller = ProcController(self.args.n_procs_objective, int(self.args.n_max_procs), logfname=self.args.n_procs_logfname)
         while n_procs > 0:
             start = time.time()
+            cpu_before = self.hmm_cpu_time
             nclusters = self.get_n_clusters()
             print '--> %d clusters with %d procs' % (nclusters, n_procs)  # write_hmm_input uses the best-minus-ten partition
-            self.run_hmm('forward', self.args.parameter_dir, n_procs=n_procs, divvy_with_bcrham=(self.get_n_clusters() > self.n_max_divvy and self.args.no_random_divvy))
+            self.run_hmm('forward', self.args.parameter_dir, n_procs=n_procs, divvy_with_bcrham=(self.n_max_divvy is not None and self.get_n_clusters() > self.n_max_divvy and self.args.no_random_divvy))
             n_proc_list.append(n_procs)
 
-            print '      partition step time: %.3f' % (time.time()-start)
+            step_time = time.time() - start
+            print '      partition step time: %.3f' % step_time
+            if self.args.smc_particles == 1:
+                controller.add_step(n_procs, nclusters, self.get_n_calculated(), step_time, self.hmm_cpu_time - cpu_before, self.get_n_clusters(), n_cached=self.get_n_cache_hits())
             if n_procs == 1 or len(n_proc_list) >= self.args.n_partition_steps:
                 break
 
-            if self.args.smc_particles == 1:  # for smc, we merge pairs of processes; otherwise, we do some heuristics to come up with a good number of clusters for the next iteration
-                n_calcd_per_process = self.get_n_calculated_per_process()
-                factor = 1.3
-
-                reduce_n_procs = False
-                if n_calcd_per_process < self.n_max_calc_per_process:  # always reduce if we only calc'd a few the last time through
-                    reduce_n_procs = True
-
-                if reduce_n_procs:
-                    n_procs = int(n_procs / factor)
+            if self.args.smc_particles == 1:  # for smc, we merge pairs of processes; otherwise, we use the measured step times and calculation counts to come up with a good number of procs for the next iteration
+                n_procs = controller.next_n_procs(n_procs)
             else:
                 n_procs = len(self.smc_info[-1])  # if we're doing smc, the number of particles is determined by the file merging process
 
@@ -214,6 +265,7 @@ class PartitionDriver(object):
                     uids = ':'.join(cluster)
                     utils.print_reco_event(self.glfo['seqs'], annotations[uids], extra_str='    ', label='inferred:', indelfos=[self.sw_info['indels'].get(uid, None) for uid in annotations[uids]['unique_ids']])
             if self.args.outfname is not None:
+                path.expand_duplicates(self.duplicates)
                 self.write_clusterpaths(self.args.outfname, [path, ])  # [last agglomeration step]
         else:
             # self.merge_pairs_of_procs(1)  # DAMMIT why did I have this here? I swear there was a reason but I can't figure it out, and it seems to work without it
@@ -225,6 +277,8 @@ class PartitionDriver(object):
                     path = final_paths[ipath]
                     path.print_partition(path.i_best, self.reco_info, extrastr=str(ipath) + ' final')
             if self.args.outfname is not None:
+                for path in final_paths:
+                    path.expand_duplicates(self.duplicates)
                 self.write_clusterpaths(self.args.outfname, final_paths)
 
         if self.args.debug and not self.args.is_data:
@@ -262,16 +316,22 @@ class PartitionDriver(object):
 
     # ----------------------------------------------------------------------------------------
     def cluster_with_naive_vsearch_or_swarm(self, parameter_dir):  # TODO change name of function if you switch to just swarm
+        """ cluster the cached naive seqs with vsearch or swarm (through a fasta file), or by single linkage in python (in memory) """
         start = time.time()
         # read cached naive seqs
         naive_seqs = {}
-        with open(self.hmm_cachefname) as cachefile:
-            reader = csv.DictReader(cachefile)
-            for line in reader:
-                unique_ids = line['unique_ids'].split(':')
-                assert len(unique_ids) == 1
-                unique_id = unique_ids[0]
-                naive_seqs[unique_id] = line['naive_seq']
+        for key, cachefo in self.hmm_cache.read_all().items():  # one pass through the file, rather than a seek for each key
+            unique_ids = key.split(':')
+            assert len(unique_ids) == 1
+            unique_id = unique_ids[0]
+            naive_seqs[unique_id] = cachefo['naive_seq']
+
+        if self.args.naive_single_linkage:
+            bound = self.get_naive_hamming_threshold(parameter_dir, 'tight') /  2.  # same heuristic as for vsearch
+            partition = Glomerator().naive_seq_single_linkage(naive_seqs, bound, n_procs=multiprocessing.cpu_count(), debug=self.args.debug)
+            self.finish_naive_clustering(partition)
+            print '      single linkage time: %.3f' % (time.time()-start)
+            return
 
         # make a fasta file
         fastafname = self.args.workdir + '/simu.fasta'
@@ -317,7 +377,7 @@ class PartitionDriver(object):
             tmpstart = time.time()
             total = 0.
             for key in self.sw_info['queries']:
-                # padded sequence is here: self.sw_info[key]['padded']['seq']
+                # padded sequence is here: self.seqstore.get_padded_seq(key)
                 # but this should be un-padded
                 seq = self.input_info[key]['seq']  # TODO hm, should this be from sw_info?
                 total += float(len(seq))
@@ -346,8 +406,19 @@ class PartitionDriver(object):
                 if self.args.naive_swarm and uid[-2:] == '_1':  # remove (dummy) abundance information
                     uid = uid[:-2]
                 id_clusters[cluster_id].append(uid)
-        partition = id_clusters.values()
+        self.finish_naive_clustering(id_clusters.values())
+
+        if not self.args.no_clean:
+            os.remove(fastafname)
+            os.remove(clusterfname)
+
+        print '      vsearch/swarm time: %.3f' % (time.time()-start)
+
+    # ----------------------------------------------------------------------------------------
+    def finish_naive_clustering(self, partition):
+        """ check, evaluate, and write the partition from naive seq clustering """
         self.check_partition(partition)
+        partition = [utils.expand_duplicate_ids(cluster, self.duplicates) for cluster in partition]
         adj_mi = None
         ccfs = [None, None]
         if not self.args.is_data:  # it's ok to always calculate this since it's only ever for one partition
@@ -358,12 +429,6 @@ class PartitionDriver(object):
         if self.args.outfname is not None:
             self.write_clusterpaths(self.args.outfname, [cp, ])
 
-        if not self.args.no_clean:
-            os.remove(fastafname)
-            os.remove(clusterfname)
-
-        print '      vsearch/swarm time: %.3f' % (time.time()-start)
-
     # ----------------------------------------------------------------------------------------
     def get_naive_hamming_threshold(self, parameter_dir, tightness, debug=False):
         mutehist = Hist(fname=parameter_dir + '/all-mean-mute-freqs.csv')
@@ -391,12 +456,19 @@ class PartitionDriver(object):
             print '      threshold: %.3f' % thold
         return thold
 
+    # ----------------------------------------------------------------------------------------
+    def get_naive_hamming_bounds(self, parameter_dir):
+        """ bcrham merges pairs of clusters whose naive hamming fraction is below the lower bound without running the hmm, skips pairs above the upper bound, and runs the forward algorithm on the ones in between """
+        if self.args.naive_hamming:
+            thold = self.get_naive_hamming_threshold(parameter_dir, 'tight')
+            return thold, thold  # set lo and hi to the same thing, so we don't use log prob ratios
+        else:
+            return 0.01, self.get_naive_hamming_threshold(parameter_dir, 'loose')
+
     # ----------------------------------------------------------------------------------------
     def get_hmm_cmd_str(self, algorithm, csv_infname, csv_outfname, parameter_dir, cache_naive_seqs, n_procs):
         """ Return the appropriate bcrham command string """
         cmd_str = os.getenv('PWD') + '/packages/ham/bcrham'
-        if self.args.slurm or utils.auto_slurm(n_procs):
-            cmd_str = 'srun ' + cmd_str
         cmd_str += ' --algorithm ' + algorithm
         if self.args.n_best_events is not None:
             cmd_str += ' --n_best_events ' + str(int(self.args.n_best_events))
@@ -407,8 +479,6 @@ class PartitionDriver(object):
         cmd_str += ' --infile ' + csv_infname
         cmd_str += ' --outfile ' + csv_outfname
         # cmd_str += ' --cache-naive-hfracs'  # seems to be about the same speed whether you do or not... I guess I should check some more but, aw, screw it. Cache files are big enough as it is.
-        if n_procs > 1:  # only cache vals for sequence sets with newly-calculated vals (initial cache file is copied to each subdir)
-            cmd_str += ' --only-cache-new-vals'
 
         if self.args.smc_particles > 1:
             os.environ['GSL_RNG_TYPE'] = 'ranlux'
@@ -419,7 +489,10 @@ class PartitionDriver(object):
         if self.args.print_cluster_annotations:
             cmd_str += ' --annotationfile ' + self.annotation_fname
         if self.args.action == 'partition':
-            cmd_str += ' --cachefile ' + self.hmm_cachefname
+            cmd_str += ' --input-cachefile ' + self.hmm_cachefname  # every process reads the same one...
+            cmd_str += ' --cachefile ' + self.hmm_new_cachefname  # ...and writes only its new vals to its own file (which we then append to the main one)
+            cmd_str += ' --only-cache-new-vals'
+            cmd_str += ' --progress-file ' + self.hmm_progress_fname
             if self.args.naive_hamming:
                 cmd_str += ' --no-fwd'  # assume that auto hamming bounds means we're naive hamming clustering (which is a good assumption, since we set the lower and upper bounds to the same thing)
             if cache_naive_seqs:  # caching all naive sequences before partitioning
@@ -427,14 +500,7 @@ class PartitionDriver(object):
             else:  # actually partitioning
                 cmd_str += ' --partition'
                 cmd_str += ' --max-logprob-drop ' + str(self.args.max_logprob_drop)
-                if self.args.naive_hamming:
-                    thold = self.get_naive_hamming_threshold(parameter_dir, 'tight')
-                    naive_hamming_lo = thold  # set lo and hi to the same thing, so we don't use log prob ratios
-                    naive_hamming_hi = thold
-                else:
-                    naive_hamming_lo = 0.01
-                    naive_hamming_hi = self.get_naive_hamming_threshold(parameter_dir, 'loose')
-        
+                naive_hamming_lo, naive_hamming_hi = self.get_naive_hamming_bounds(parameter_dir)
                 print '       naive hamming bounds: %.3f %.3f' % (naive_hamming_lo, naive_hamming_hi)
                 cmd_str += ' --hamming-fraction-bound-lo ' + str(naive_hamming_lo)
                 cmd_str += ' --hamming-fraction-bound-hi ' + str(naive_hamming_hi)
@@ -444,32 +510,51 @@ class PartitionDriver(object):
         return cmd_str
 
     # ----------------------------------------------------------------------------------------
-    def execute_iproc(self, cmd_str, workdir):
-        proc = Popen(cmd_str + ' 1>' + workdir + '/out' + ' 2>' + workdir + '/err', shell=True)
-        return proc
-
-    # ----------------------------------------------------------------------------------------
-    def get_n_calculated_per_process(self):
+    def get_n_calculated(self):
+        """ total number of forward and viterbi calculations in the last call to execute(), summed over bcrham runs (or None if we don't know) """
         if self.n_likelihoods_calculated is None:
-            return
+            return None
         total = 0
         for procinfo in self.n_likelihoods_calculated:
             total += procinfo['vtb'] + procinfo['fwd']
         if self.args.debug:
-            print '  n calcd: %d (%.1f per proc)' % (total, float(total) / len(self.n_likelihoods_calculated))
-        return float(total) / len(self.n_likelihoods_calculated)
+            print '  n calcd: %d' % total
+        return total
+
+    # ----------------------------------------------------------------------------------------
+    def get_n_cache_hits(self):
+        """ total number of forward and viterbi values that bcrham already had cached in the last call to execute() (or None if we don't know) """
+        if self.n_likelihoods_calculated is None or any('fwd_cached' not in procinfo for procinfo in self.n_likelihoods_calculated):
+            return None
+        return sum([procinfo['fwd_cached'] + procinfo['vtb_cached'] for procinfo in self.n_likelihoods_calculated])
 
     # ----------------------------------------------------------------------------------------
-    def execute(self, cmd_str, n_procs, total_naive_hamming_cluster_procs=None):
+    def execute(self, cmd_str, n_procs, total_naive_hamming_cluster_procs=None, n_workers=None):
+        """
+        Run <cmd_str> in each of <n_procs> subdirectories.
+        If <n_workers> is less than <n_procs> (i.e. if we've split the input into more shards than processes), only run <n_workers> at a time, starting the
+        biggest shards first and handing out the next shard whenever one finishes.
+        New cache info from all of them is appended to the main cache file once they're all done (not before, since the running ones are reading it).
+        """
         print '    running'
         start = time.time()
         sys.stdout.flush()
+        self.hmm_proc_wall_times = None
         if n_procs == 1:
             if total_naive_hamming_cluster_procs is not None:
                 cmd_str = cmd_str.replace('XXX', str(total_naive_hamming_cluster_procs))
             # print cmd_str
             # sys.exit()
+            cpu_before = resource.getrusage(resource.RUSAGE_CHILDREN)
             check_call(cmd_str.split())
+            cpu_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            self.hmm_cpu_time += cpu_after.ru_utime + cpu_after.ru_stime - cpu_before.ru_utime - cpu_before.ru_stime
+            self.n_likelihoods_calculated = None  # its output went to the terminal, so unless it wrote a progress file we don't know how many it calculated
+            if self.args.action == 'partition':
+                lines, _ = read_progress(self.hmm_progress_fname)
+                if len(lines) > 0:
+                    self.n_likelihoods_calculated = [lines[-1]]
+            workdirs = [self.args.workdir, ]
         else:
 
             # initialize command strings and whatnot
@@ -479,6 +564,7 @@ class PartitionDriver(object):
             for iproc in range(n_procs):
                 workdirs.append(self.args.workdir + '/hmm-' + str(iproc))
                 cmd_strs.append(cmd_str.replace(self.args.workdir, workdirs[-1]))
+                cmd_strs[-1] = cmd_strs[-1].replace('--input-cachefile ' + workdirs[-1] + '/', '--input-cachefile ' + self.args.workdir + '/')  # everybody reads the main cache file
                 if total_naive_hamming_cluster_procs is not None:
                     clusters_this_proc = total_naive_hamming_cluster_procs / n_procs
                     if n_leftover > 0:
@@ -486,66 +572,72 @@ class PartitionDriver(object):
                         n_leftover -= 1
                     cmd_strs[-1] = cmd_strs[-1].replace('XXX', str(clusters_this_proc))
 
-            # start all the procs for the first time
-            procs, n_tries, progress_strings = [], [], []
-            self.n_likelihoods_calculated = []
-            for iproc in range(n_procs):
-                # print cmd_strs[iproc]
-                procs.append(self.execute_iproc(cmd_strs[iproc], workdir=workdirs[iproc]))
-                n_tries.append(1)
-                self.n_likelihoods_calculated.append({})
-
             # ----------------------------------------------------------------------------------------
             def get_outfname(iproc):
                 return self.hmm_outfname.replace(self.args.workdir, workdirs[iproc])
-            def get_progress_fname(iproc):
-                return get_outfname(iproc) + '.progress'
 
             # ----------------------------------------------------------------------------------------
-            def read_progress(iproc):
-                """ meh doesn't work very well """
-                if not os.path.exists(get_progress_fname(iproc)):
-                    return
-                with open(get_progress_fname(iproc)) as outfile:
-                    for line in outfile.readlines():
-                        line = line.strip()
-                        if line not in progress_strings:
-                            progress_strings.append(line)
-                            print line
+            def finish_process(job):  # TODO also check cachefile, if necessary
+                utils.process_out_err('', '', extra_str=job.name, info=self.n_likelihoods_calculated[int(job.name)], subworkdir=job.workdir)
+
+            if n_workers is None:
+                n_workers = n_procs
+            self.n_likelihoods_calculated = [{} for _ in range(n_procs)]
+            jobs = [Job(cmd_strs[iproc] + ' 1>' + workdirs[iproc] + '/out' + ' 2>' + workdirs[iproc] + '/err', str(iproc), outfname=get_outfname(iproc), workdir=workdirs[iproc]) for iproc in range(n_procs)]
+            executor = get_executor(self.args, n_workers)
+            n_concurrent = None
+            if n_workers < n_procs:
+                n_concurrent = n_workers
+                jobs = sorted(jobs, key=lambda job: os.path.getsize(job.workdir + '/' + os.path.basename(self.hmm_infname)), reverse=True)  # longest (well, biggest) first
+            if self.use_worker_pool(executor):
+                for job in jobs:  # the workers write to out and err themselves
+                    job.cmd_str = job.cmd_str[ : job.cmd_str.find(' 1>')]
 
             # ----------------------------------------------------------------------------------------
-            # deal with a process once it's finished (i.e. check if it failed, and restart if so)
-            def finish_process(iproc):
-                # if os.path.exists(get_progress_fname(iproc)):
-                #     os.remove(get_progress_fname(iproc))
-                procs[iproc].communicate()
-                utils.process_out_err('', '', extra_str=str(iproc), info=self.n_likelihoods_calculated[iproc], subworkdir=workdirs[iproc])
-                if procs[iproc].returncode == 0 and os.path.exists(get_outfname(iproc)):  # TODO also check cachefile, if necessary
-                    procs[iproc] = None  # job succeeded
-                elif n_tries[iproc] > 5:
-                    raise Exception('exceeded max number of tries for command\n    %s\nlook for output in %s' % (cmd_strs[iproc], workdirs[iproc]))
-                else:
-                    print '    rerunning proc %d (exited with %d' % (iproc, procs[iproc].returncode),
-                    if not os.path.exists(get_outfname(iproc)):
-                        print ', output %s d.n.e.' % get_outfname(iproc),
-                    print ')'
-                    procs[iproc] = self.execute_iproc(cmd_strs[iproc], workdir=workdirs[iproc])
-                    n_tries[iproc] += 1
-
-            # keep looping over the procs until they're all done
-            while procs.count(None) != len(procs):  # we set each proc to None when it finishes
-                for iproc in range(n_procs):
-                    if procs[iproc] is None:  # already finished
-                        continue
-                    # read_progress(iproc)
-                    if procs[iproc].poll() is not None:  # it's finished
-                        finish_process(iproc)
-                sys.stdout.flush()
-                time.sleep(1)
+            def run_jobs():
+                runner = self.get_worker_pool(cmd_str, n_workers) if self.use_worker_pool(executor) else executor
+                runner.run(jobs, finish_fcn=finish_process, n_concurrent=n_concurrent)
+
+            if self.args.action == 'partition':  # watch the progress files while they run, then take the final counts from them (including cache hits, which aren't in stdout)
+                with ProgressMonitor(jobs, os.path.basename(self.hmm_progress_fname), hung_timeout=self.args.hung_timeout) as monitor:
+                    run_jobs()
+                for job in jobs:
+                    counts = monitor.job_counts(job)
+                    if counts is not None:
+                        self.n_likelihoods_calculated[int(job.name)].update(counts)
+            else:
+                run_jobs()
+            self.hmm_cpu_time += sum([job.cpu_time for job in jobs])
+            self.hmm_proc_wall_times = [0. for _ in range(n_procs)]
+            for job in jobs:
+                self.hmm_proc_wall_times[int(job.name)] = job.wall_time
 
+        if self.args.action == 'partition':
+            for workdir in workdirs:
+                if os.path.exists(workdir + '/' + os.path.basename(self.hmm_progress_fname)):
+                    os.remove(workdir + '/' + os.path.basename(self.hmm_progress_fname))
+            self.hmm_cache.append_files([wd + '/' + os.path.basename(self.hmm_new_cachefname) for wd in workdirs], remove=(not self.args.no_clean))
         sys.stdout.flush()
         print '      hmm run time: %.3f' % (time.time()-start)
 
+    # ----------------------------------------------------------------------------------------
+    def use_worker_pool(self, executor):
+        """ only when partitioning (since otherwise the hmm files can get rewritten while the workers have them in memory), and only when running locally """
+        return self.args.worker_pool and self.args.action == 'partition' and executor.name == 'local'
+
+    # ----------------------------------------------------------------------------------------
+    def get_worker_pool(self, cmd_str, n_workers):
+        """ return a worker pool with at least <n_workers> workers that were started with the same binary, hmmdir, and datadir as in <cmd_str> (replacing any existing pool that wasn't) """
+        argv = cmd_str.split()
+        binary, hmmdir, datadir = argv[0], argv[argv.index('--hmmdir') + 1], argv[argv.index('--datadir') + 1]
+        if self.worker_pool is not None and not self.worker_pool.matches(binary, hmmdir, datadir):
+            self.worker_pool.close()
+            self.worker_pool = None
+        if self.worker_pool is None:
+            self.worker_pool = WorkerPool(binary, hmmdir, datadir, n_workers)
+        self.worker_pool.n_workers = max(n_workers, self.worker_pool.n_workers)
+        return self.worker_pool
+
     # ----------------------------------------------------------------------------------------
     def run_hmm(self, algorithm, parameter_in_dir, parameter_out_dir='', count_parameters=False, n_procs=None, cache_naive_seqs=False, divvy_with_bcrham=False):
         """ 
@@ -569,82 +661,223 @@ class PartitionDriver(object):
         if cache_naive_seqs:
             print '      caching all naive sequences'
 
+        n_shards = n_procs  # number of pieces into which we split the input, each of which gets its own bcrham run
+        if n_procs > 1 and self.args.smc_particles == 1 and self.args.n_shards_per_proc > 1:
+            n_shards = min(n_procs * self.args.n_shards_per_proc, self.count_hmm_input_lines())
+            print '      splitting into %d shards for %d procs' % (n_shards, n_procs)
+
         if n_procs > 1 and self.args.smc_particles == 1:  # if we're doing smc (i.e. if > 1), we have to split things up more complicatedly elsewhere
             if divvy_with_bcrham:
                 print '      bcrham naive hamming clustering'
                 assert '--partition' in cmd_str and algorithm == 'forward'
                 n_divvy_procs = max(1, self.get_n_clusters() / 500)  # number of bcrham procs used to divvy up queries with naive hamming clustering
                 self.split_input(n_divvy_procs, self.hmm_infname, 'hmm', algorithm, cache_naive_seqs, bcrham_naive_hamming_cluster=True)
-                self.execute(cmd_str.replace('--partition', '--naive-hamming-cluster XXX'), n_procs=n_divvy_procs, total_naive_hamming_cluster_procs=n_procs)
+                self.execute(cmd_str.replace('--partition', '--naive-hamming-cluster XXX'), n_procs=n_divvy_procs, total_naive_hamming_cluster_procs=n_shards)
                 self.read_naive_hamming_clusters(n_procs=n_divvy_procs)
-            self.split_input(n_procs, self.hmm_infname, 'hmm', algorithm, cache_naive_seqs, bcrham_naive_hamming_cluster=False)
+            self.split_input(n_shards, self.hmm_infname, 'hmm', algorithm, cache_naive_seqs, bcrham_naive_hamming_cluster=False)
 
-        self.execute(cmd_str, n_procs)
+        self.execute(cmd_str, n_shards, n_workers=n_procs)
+        if self.divvy_predicted_costs is not None:
+            self.report_divvy_balance(n_shards)
+            self.divvy_predicted_costs = None
 
-        self.read_hmm_output(algorithm, n_procs, count_parameters, parameter_out_dir, cache_naive_seqs)
+        self.read_hmm_output(algorithm, n_shards, count_parameters, parameter_out_dir, cache_naive_seqs)
+
+    # ----------------------------------------------------------------------------------------
+    def count_hmm_input_lines(self):
+        with open(self.hmm_infname) as infile:
+            return sum(1 for _ in infile) - 1  # don't count the header
 
     # ----------------------------------------------------------------------------------------
     def read_cachefile(self):
         """ a.t.m. just want to know which values we have """
-        cachefo = {}
-        if not os.path.exists(self.hmm_cachefname):
-            return cachefo
-        with open(self.hmm_cachefname) as cachefile:
-            reader = csv.DictReader(cachefile)
-            for line in reader:
-                cachefo[line['unique_ids']] = {}
-        return cachefo
+        return {key : {} for key in self.hmm_cache.keys()}
+
+    # ----------------------------------------------------------------------------------------
+    def join_names(self, name1, name2):  # mimics function in glomeraor.cc
+        sortedlist = sorted([name1, name2])
+        return ':'.join(sortedlist)
 
     # ----------------------------------------------------------------------------------------
     def get_expected_number_of_forward_calculations(self, info, namekey, seqkey):
+        """ count the uncached pairs in <info> within the naive hamming bounds, i.e. the forward calculations bcrham will need (exact, but much slower than estimate_number_of_forward_calculations()) """
         start = time.time()
-        def join_names(name1, name2):  # mimics function in glomeraor.cc
-            sortedlist = sorted([name1, name2])
-            return ':'.join(sortedlist)
-
-        naive_seqs = self.get_naive_seqs(info, namekey, seqkey)
+        encoded_seqs = self.get_naive_seqs(info, namekey, seqkey)
         cachefo = self.read_cachefile()
+        hamming_bounds = self.get_naive_hamming_bounds(self.args.parameter_dir)
         n_total, n_cached = 0, 0
-        for id_a, id_b in itertools.combinations(naive_seqs.keys(), 2):
-            seq_a, seq_b = naive_seqs[id_a], naive_seqs[id_b]
-            hfrac = utils.hamming_fraction(seq_a, seq_b)
-            if hfrac >= self.args.hamming_fraction_bounds[0] and hfrac <= self.args.hamming_fraction_bounds[1]:  # NOTE not sure the equals match up exactly with what's in ham, but it's an estimate, so it doesn't matter
-                n_total += 1
-                if join_names(id_a, id_b) in cachefo:
-                    n_cached += 1
-                    assert ':'.join(sorted([id_a, id_b], reverse=True)) not in cachefo
-                    assert id_a in cachefo
-                    assert id_b in cachefo
+        ifirst, isecond, _ = HammingIndex(encoded_seqs, hamming_bounds[1]).pairs(min_fraction=hamming_bounds[0])  # NOTE not sure the equals match up exactly with what's in ham, but it's an estimate, so it doesn't matter
+        for ia, ib in zip(ifirst.tolist(), isecond.tolist()):
+            id_a, id_b = encoded_seqs.names[ia], encoded_seqs.names[ib]
+            n_total += 1
+            if self.join_names(id_a, id_b) in cachefo:
+                n_cached += 1
+                assert ':'.join(sorted([id_a, id_b], reverse=True)) not in cachefo
+                assert id_a in cachefo
+                assert id_b in cachefo
 
         print 'expected total: %d  (cached: %d) --> %d' % (n_total, n_cached, n_total - n_cached)
         print '      expected calc time: %.3f' % (time.time()-start)
         return n_total - n_cached
 
+    # ----------------------------------------------------------------------------------------
+    def estimate_number_of_forward_calculations(self, encoded_seqs, n_samples=100000, n_positions=8, seed=1, debug=False):
+        """
+        Fast approximate version of get_expected_number_of_forward_calculations(): estimate the number of uncached pairs in <encoded_seqs> within the naive hamming bounds by
+        sampling random pairs, and return (estimate, lower, upper) where lower and upper bound the 95% confidence interval.
+        Since almost all pairs are far apart, uniform sampling would rarely see an in-bounds pair, so we split the pairs into two strata: those that match at a random set of
+        <n_positions> positions (i.e. that share a locality sensitive hash key, which is where most of the in-bounds pairs are), and the rest. Then we sample a quarter of the
+        <n_samples> pairs from the first, and the rest from the second (which has a much smaller fraction of in-bounds pairs, but so many more pairs that it dominates the
+        variance), and add up the estimates (and variances). If there aren't more than <n_samples> pairs in total, we just count them all.
+        """
+        start = time.time()
+        n_seqs = len(encoded_seqs)
+        n_total_pairs = n_seqs * (n_seqs - 1) / 2
+        if n_total_pairs == 0:
+            return 0., 0., 0.
+        hamming_lo, hamming_hi = self.get_naive_hamming_bounds(self.args.parameter_dir)
+        random_state = numpy.random.RandomState(seed)
+
+        # ----------------------------------------------------------------------------------------
+        def count_new(ifirst, isecond):  # number of pairs that are in bounds and not in the cache
+            fractions = encoded_seqs.pair_fractions(ifirst, isecond)
+            in_bounds = numpy.nonzero((fractions >= hamming_lo) & (fractions <= hamming_hi))[0]
+            return len([i for i in in_bounds if self.join_names(encoded_seqs.names[ifirst[i]], encoded_seqs.names[isecond[i]]) not in self.hmm_cache])
+
+        if n_total_pairs <= n_samples:  # few enough that sampling would take as long as counting (and small strata could end up with no samples)
+            ifirst, isecond = numpy.triu_indices(n_seqs, 1)
+            n_new = count_new(ifirst, isecond)
+            print '      new forward calculations: %d among %d pairs  (%.2fs)' % (n_new, n_total_pairs, time.time() - start)
+            return float(n_new), float(n_new), float(n_new)
+
+        # pairs that share a key (stratum 0) are the pairs within each run of identical keys in sorted order
+        _, _, valid_matrix = encoded_seqs.length_groups.values()[0]
+        columns = numpy.nonzero(valid_matrix.mean(axis=0) > 0.5)[0]  # don't use positions that are mostly padding
+        if len(columns) == 0:
+            columns = numpy.arange(valid_matrix.shape[1])
+        keys = encoded_seqs.position_keys(random_state.choice(columns, min(n_positions, len(columns)), replace=False))
+        order = numpy.argsort(keys, kind='mergesort')
+        _, run_starts, run_sizes = numpy.unique(keys[order], return_index=True, return_counts=True)
+        run_pairs = run_sizes * (run_sizes - 1) / 2
+        n_key_pairs = int(run_pairs.sum())
+
+        estimate, variance, n_unsampled = 0., 0., 0
+        for stratum, n_stratum_pairs, n_stratum_samples in (('key', n_key_pairs, n_samples / 4), ('other', n_total_pairs - n_key_pairs, n_samples - n_samples / 4)):
+            if n_stratum_pairs == 0:
+                continue
+            n_to_sample = max(1, min(n_stratum_samples, n_stratum_pairs))
+            if stratum == 'key':  # choose a run with probability proportional to its number of pairs, then a random pair within it
+                iruns = numpy.searchsorted(numpy.cumsum(run_pairs), random_state.randint(0, n_key_pairs, n_to_sample), side='right')
+                ia = (random_state.rand(n_to_sample) * run_sizes[iruns]).astype(int)
+                ib = (random_state.rand(n_to_sample) * (run_sizes[iruns] - 1)).astype(int)
+                ib += ib >= ia
+                ifirst, isecond = order[run_starts[iruns] + ia], order[run_starts[iruns] + ib]
+            else:  # uniform pairs, throwing out the ones that share a key (there aren't many)
+                ifirst, isecond = random_state.randint(0, n_seqs, 2 * n_to_sample), random_state.randint(0, n_seqs, 2 * n_to_sample)
+                keep = numpy.nonzero((ifirst != isecond) & (keys[ifirst] != keys[isecond]))[0][ : n_to_sample]
+                ifirst, isecond = ifirst[keep], isecond[keep]
+            n_sampled = len(ifirst)
+            if n_sampled == 0:  # we threw out every pair we drew, so all we know is that it's somewhere between none and all of them
+                n_unsampled += n_stratum_pairs
+                continue
+            n_new = count_new(ifirst, isecond)
+            prob = float(n_new + 1) / (n_sampled + 2)  # (for the variance, so it isn't zero when we don't see any)
+            estimate += n_stratum_pairs * float(n_new) / n_sampled
+            variance += n_stratum_pairs**2 * prob * (1. - prob) / n_sampled
+            if debug:
+                print '      %5s pairs: %d   sampled %d   new %d' % (stratum, n_stratum_pairs, n_sampled, n_new)
+
+        half_width = 1.96 * math.sqrt(variance)
+        lower, upper = max(0., estimate - half_width), estimate + half_width + n_unsampled
+        print '      estimated new forward calculations: %.0f (95%% interval %.0f - %.0f) among %d pairs  (%.2fs)' % (estimate, lower, upper, n_total_pairs, time.time() - start)
+        return estimate, lower, upper
+
     # ----------------------------------------------------------------------------------------
     def get_naive_seqs(self, info, namekey, seqkey):
-        def get_query_from_sw(qry):
+        """ return a hamming.EncodedSeqs with the padded naive sequence for each line in <info>, taken straight from the sequence store (where we add any that aren't already there) """
+        def add_naive_seq_from_sw(qry):
             assert qry in self.sw_info
-            naive_seq = utils.get_full_naive_seq(self.glfo['seqs'], self.sw_info[qry])
-            padleft = self.sw_info[qry]['padded']['padleft']  # we're padding the *naive* seq corresponding to qry now, but it'll be the same length as the qry seq
-            padright = self.sw_info[qry]['padded']['padright']
-            assert len(utils.ambiguous_bases) == 1  # could allow more than one, but it's not implemented a.t.m.
-            naive_seq = padleft * utils.ambiguous_bases[0] + naive_seq + padright * utils.ambiguous_bases[0]
-            return naive_seq
+            if not self.seqstore.has_seq(qry, kind='naive'):  # we're padding the *naive* seq corresponding to qry, but it'll be the same length as the qry seq, so it uses the same padding
+                naive_seq = utils.get_full_naive_seq(self.glfo['seqs'], self.sw_info[qry])
+                if naive_seq == '':
+                    raise Exception('zero-length naive sequence found for ' + str(qry))
+                self.seqstore.set_seq(qry, naive_seq, kind='naive')
 
-        naive_seqs = {}
+        queries, representatives = [], []
         for line in info:
             query = line[namekey]
-            seqstr = line['padded'][seqkey] if 'padded' in line else line[seqkey]
             # NOTE cached naive seqs should all be the same length
             if len(query.split(':')) == 1:  # ...but if we don't have them, use smith-waterman (should only be for single queries)
-               naive_seqs[query] = get_query_from_sw(query)
+                representative = query
             elif len(query.split(':')) > 1:
-                naive_seqs[query] = get_query_from_sw(query.split(':')[0])  # just arbitrarily use the naive seq from the first one. This is ok partly because if we cache the logprob but not the naive seq, that's because we thought about merging two clusters but did not -- so they're naive seqs should be similar. Also, this is just for divvying queries.
+                representative = query.split(':')[0]  # just arbitrarily use the naive seq from the first one. This is ok partly because if we cache the logprob but not the naive seq, that's because we thought about merging two clusters but did not -- so they're naive seqs should be similar. Also, this is just for divvying queries.
             else:
                 raise Exception('no naive sequence found for ' + str(query))
-            if naive_seqs[query] == '':
-                raise Exception('zero-length naive sequence found for ' + str(query))
-        return naive_seqs
+            add_naive_seq_from_sw(representative)
+            queries.append(query)
+            representatives.append(representative)
+        return hamming.EncodedSeqs.from_code_matrix(queries, self.seqstore.get_padded_matrix(representatives, kind='naive'))
+
+    # ----------------------------------------------------------------------------------------
+    def estimate_divvy_costs(self, encoded_seqs, clusters, weights=None, hamming_bounds=None, max_pairs_per_cluster=1000, seed=1):
+        """
+        Estimate how much work bcrham will do on each of <clusters> (lists of indices into <encoded_seqs>, whose names are the colon-separated queries in each line of hmm input).
+        Each line costs its number of queries (for its own forward calculation), and each pair of lines costs the sum of their numbers of queries (since that's how the forward
+        calculation time goes) if its naive hamming fraction is within the bounds (so bcrham will run the forward algorithm on it), and it isn't cached. This is the same pair
+        counting as in get_expected_number_of_forward_calculations(), but weighted by size, and only within each cluster. For clusters with more than <max_pairs_per_cluster>
+        pairs, we look at a random sample of that many pairs and scale up.
+        <weights> (number of queries in each line) and <hamming_bounds> are calculated if they aren't passed in (pass them if you're calling this a lot).
+        """
+        if hamming_bounds is None:
+            hamming_bounds = self.get_naive_hamming_bounds(self.args.parameter_dir)
+        hamming_lo, hamming_hi = hamming_bounds
+        names = encoded_seqs.names
+        if weights is None:
+            weights = numpy.array([len(name.split(':')) for name in names], dtype=float)
+        costs = numpy.array([weights[cluster].sum() for cluster in clusters])
+
+        random_state = numpy.random.RandomState(seed)
+        ifirst, isecond, iclusters, scales = [], [], [], []
+        for icluster in range(len(clusters)):
+            cluster = numpy.array(clusters[icluster], dtype=int)
+            n_pairs = len(cluster) * (len(cluster) - 1) / 2
+            if n_pairs == 0:
+                continue
+            if n_pairs <= max_pairs_per_cluster:
+                ia, ib = numpy.triu_indices(len(cluster), k=1)
+            else:
+                ia = random_state.randint(0, len(cluster), max_pairs_per_cluster)
+                ib = random_state.randint(0, len(cluster) - 1, max_pairs_per_cluster)
+                ib += ib >= ia  # so they're never the same
+            ifirst.append(cluster[ia])
+            isecond.append(cluster[ib])
+            iclusters.append(numpy.full(len(ia), icluster, dtype=int))
+            scales.append(numpy.full(len(ia), float(n_pairs) / len(ia)))
+        if len(ifirst) > 0:
+            ifirst, isecond, iclusters, scales = [numpy.concatenate(l) for l in (ifirst, isecond, iclusters, scales)]
+            fractions = encoded_seqs.pair_fractions(ifirst, isecond)
+            in_bounds = (fractions >= hamming_lo) & (fractions <= hamming_hi)
+            for ipair in numpy.nonzero(in_bounds)[0]:
+                if self.join_names(names[ifirst[ipair]], names[isecond[ipair]]) in self.hmm_cache:
+                    in_bounds[ipair] = False
+            pair_costs = (weights[ifirst] + weights[isecond]) * scales * in_bounds
+            costs += numpy.bincount(iclusters, weights=pair_costs, minlength=len(clusters))
+        return costs
+
+    # ----------------------------------------------------------------------------------------
+    def report_divvy_balance(self, n_procs):
+        """ compare the imbalance among procs (max over mean) that we predicted when divvying to what they actually did """
+        def imbalance(vals):
+            return max(vals) / max(1e-10, float(sum(vals)) / len(vals)) if len(vals) > 0 else float('nan')
+        predicted = list(self.divvy_predicted_costs) + [0. for _ in range(n_procs - len(self.divvy_predicted_costs))]  # the divvy drops empty groups, so some procs may not have gotten anything
+        n_calcd = [info['fwd'] + info['vtb'] for info in self.n_likelihoods_calculated] if self.n_likelihoods_calculated is not None and all('fwd' in info for info in self.n_likelihoods_calculated) else None
+        wall_times = self.hmm_proc_wall_times
+        print '      divvy imbalance (max / mean over %d procs): predicted %.2f   calculations %s   wall time %s' % (n_procs, imbalance(predicted), '?' if n_calcd is None else '%.2f' % imbalance(n_calcd),
+                                                                                                                  '?' if wall_times is None else '%.2f' % imbalance(wall_times))
+        if self.args.debug:
+            print '        proc   predicted   calcs   wall'
+            for iproc in range(len(predicted)):
+                print '        %4d   %9.0f   %5s   %5s' % (iproc, predicted[iproc], '?' if n_calcd is None or iproc >= len(n_calcd) else n_calcd[iproc], '?' if wall_times is None or iproc >= len(wall_times) else '%.1f' % wall_times[iproc])
 
     # ----------------------------------------------------------------------------------------
     def divvy_up_queries(self, n_procs, info, namekey, seqkey, debug=True):
@@ -658,7 +891,13 @@ class PartitionDriver(object):
         naive_seqs = self.get_naive_seqs(info, namekey, seqkey)
 
         clust = Glomerator()
-        divvied_queries = clust.naive_seq_glomerate(naive_seqs, n_clusters=n_procs)
+        cost_fcn = None
+        if self.args.divvy_balance == 'cost':
+            weights = numpy.array([len(name.split(':')) for name in naive_seqs.names], dtype=float)
+            hamming_bounds = self.get_naive_hamming_bounds(self.args.parameter_dir)
+            cost_fcn = lambda clusters: self.estimate_divvy_costs(naive_seqs, clusters, weights=weights, hamming_bounds=hamming_bounds)
+        divvied_queries = clust.naive_seq_divvy(naive_seqs, n_clusters=n_procs, cost_fcn=cost_fcn)
+        self.divvy_predicted_costs = clust.divvy_costs
         if debug:
             print '  divvy lengths'
             for dq in divvied_queries:
@@ -687,8 +926,6 @@ class PartitionDriver(object):
             subworkdir = self.args.workdir + '/' + prefix + '-' + str(siproc)
             if mode == 'w':
                 utils.prep_dir(subworkdir)
-                if os.path.exists(self.hmm_cachefname):  # copy cachefile to this subdir
-                    check_call(['cp', self.hmm_cachefname, subworkdir + '/'])
             return open(subworkdir + '/' + os.path.basename(infname), mode)
 
         # ----------------------------------------------------------------------------------------
@@ -709,6 +946,7 @@ class PartitionDriver(object):
         if cluster_divvy:  # cluster similar sequences together (otherwise just do it in order)
             # print 'cluster divvy in split_input'
             divvied_queries = self.divvy_up_queries(n_procs, info, 'names', 'seqs')
+            iproc_of_query = {query : iproc for iproc in range(len(divvied_queries)) for query in divvied_queries[iproc]}  # (checking membership in the lists would be quadratic)
         # else:
         #     print 'modulo divvy'
         for iproc in range(n_procs):
@@ -716,7 +954,7 @@ class PartitionDriver(object):
             writer = get_writer(sub_outfile)
             for iquery in range(len(info)):
                 if cluster_divvy:
-                    if info[iquery]['names'] not in divvied_queries[iproc]:  # NOTE I think the reason this doesn't seem to be speeding things up is that our hierarhical agglomeration time is dominated by the distance calculation, and that distance calculation time is roughly proportional to the number of sequences in the cluster (i.e. larger clusters take longer)
+                    if iproc_of_query.get(info[iquery]['names']) != iproc:  # NOTE I think the reason this doesn't seem to be speeding things up is that our hierarhical agglomeration time is dominated by the distance calculation, and that distance calculation time is roughly proportional to the number of sequences in the cluster (i.e. larger clusters take longer)
                         continue
                 else:
                     if iquery % n_procs != iproc:
@@ -738,66 +976,20 @@ class PartitionDriver(object):
 
     # ----------------------------------------------------------------------------------------
     def merge_files(self, infnames, outfname, dereplicate):
-        """ 
+        """
         Merge <infnames> into <outfname>.
         NOTE that <outfname> is overwritten with the zero-length file if it exists, otherwise it is created.
         Some of <infnames> may not exist.
         """
         start = time.time()
-
-        # check_call(['wc', ] + [fn for fn in infnames if fn != outfname])
-        # if os.path.exists(outfname):
-        #     check_call(['wc', outfname])
-        # else:
-        #     print '  outfname d.n.e.'
-
-        header = ''
-        outfile = None
-        if outfname not in infnames or not os.path.exists(outfname):  # if it *is* in <infnames> we assume we can just tack the other infnames onto the end of it and use <outfname>'s header
-            outfile = open(outfname, 'w')
-        for fname in infnames:
-            if not os.path.exists(fname) or os.stat(fname).st_size == 0:
-                continue
-            with open(fname) as headfile:
-                reader = csv.DictReader(headfile)
-                header = ','.join(reader.fieldnames)
-                if outfile is not None:
-                    writer = csv.DictWriter(outfile, reader.fieldnames)
-                    writer.writeheader()
-            break  # kinda weird to do it this way, but we just need one of the infiles to get the header info (and some may be zero length)
-        if outfile is not None:
-            outfile.close()
-        assert header != ''
-
-        cmd = 'cat ' + ' '.join([fn for fn in infnames if fn != outfname]) + ' | grep -v \'' + header + '\''
-        cmd += ' >>' + outfname
-        try:
-            check_call(cmd, shell=True)
-        except CalledProcessError:
-            print 'nothing to merge into %s' % outfname
-            # raise Exception('only read headers from %s', ' '.join([fn for fn in infnames if fn != outfname]))
-
-        if dereplicate:
-            tmpfname = outfname + '.tmp'
-            check_call('echo ' + header + ' >' + tmpfname, shell=True)
-            check_call('grep -v \'' + header + '\' ' + outfname + ' | sort | uniq >>' + tmpfname, shell=True)
-            check_call(['mv', '-v', tmpfname, outfname])
-
-        if not self.args.no_clean:
-            for infname in infnames:
-                if infname != outfname:
-                    os.remove(infname)
-
+        csvmerge.merge_csvs(infnames, outfname, dereplicate=dereplicate, remove_infiles=(not self.args.no_clean))
         print '    time to merge csv files: %.3f' % (time.time()-start)
 
     # ----------------------------------------------------------------------------------------
     def merge_all_hmm_outputs(self, n_procs, cache_naive_seqs):
         """ Merge any/all output files from subsidiary bcrham processes (used when *not* doing smc) """
         assert self.args.smc_particles == 1  # have to do things more complicatedly for smc
-        if self.args.action == 'partition':  # merge partitions from several files
-            if n_procs > 1:
-                self.merge_subprocess_files(self.hmm_cachefname, n_procs, include_outfile=True)  # sub cache files only have new info
-
+        if self.args.action == 'partition':  # merge partitions from several files (new cache info was already appended in execute())
             if not cache_naive_seqs:
                 if n_procs == 1:
                     infnames = [self.hmm_outfname, ]
@@ -859,7 +1051,6 @@ class PartitionDriver(object):
 
         if n_procs > 1:
             assert False  # TODO I don't think this is right any more...
-            self.merge_subprocess_files(self.hmm_cachefname, n_procs, include_outfile=True)
             
         if not self.args.no_clean:
             if n_procs == 1:
@@ -967,7 +1158,7 @@ class PartitionDriver(object):
             swfo = self.sw_info[name]
             if 'padded' in swfo:
                 k_v = swfo['padded']['k_v']
-                seq = swfo['padded']['seq']
+                seq = self.seqstore.get_padded_seq(name)
                 cpos = swfo['padded']['cyst_position']
             else:
                 k_v = swfo['k_v']
@@ -1048,9 +1239,7 @@ class PartitionDriver(object):
                     fname = self.hmm_infname
                 else:
                     subworkdir = self.args.workdir + '/hmm-' + str(iproc)
-                    utils.prep_dir(subworkdir)
-                    if os.path.exists(self.hmm_cachefname):  # copy cachefile to this subdir
-                        check_call(['cp', self.hmm_cachefname, subworkdir + '/'])  # NOTE this is kind of wasteful to write it to each subdirectory (it could be large) but it's cleaner this way, 'cause then the subdirs are independent
+                    utils.prep_dir(subworkdir)  # NOTE no need to copy the cache file, since they all read the main one
                     fname = subworkdir + '/' + os.path.basename(self.hmm_infname)
                 procinfo = self.smc_info[-1][iproc]  # list of ClusterPaths, one for each smc particle
                 for iptl in range(len(procinfo)):
@@ -1218,9 +1407,10 @@ class PartitionDriver(object):
                 outpath = os.getcwd() + '/' + outpath
             outheader = ['unique_ids', 'v_gene', 'd_gene', 'j_gene', 'cdr3_length', 'seqs', 'aligned_v_seqs', 'naive_seq', 'indelfo']
             outheader += [e + '_del' for e in utils.real_erosions + utils.effective_erosions] + [b + '_insertion' for b in utils.boundaries + utils.effective_boundaries]
-            with open(outpath, 'w') as outfile:
+            with open(outpath, 'w' if self.ichunk == 0 else 'a') as outfile:  # with --chunk-size, each chunk after the first is appended to the output file
                 writer = csv.DictWriter(outfile, utils.presto_headers.values() if self.args.presto_output else outheader)
-                writer.writeheader()
+                if self.ichunk == 0:
+                    writer.writeheader()
                 for uids, line in eroded_annotations.items():
                     outline = {k : line[k] for k in outheader if k != 'indelfo'}
                     if uids in self.sw_info['indels']:  # TODO this needs to actually handle multiple unique ids, not just hope there aren't any
@@ -1232,8 +1422,10 @@ class PartitionDriver(object):
                             raise Exception('passing indel info to presto requires some more thought')
                         else:
                             del outline['indelfo']
-                        outline = utils.convert_to_presto(self.glfo, outline)
-                    writer.writerow(outline)
+                        for dupline in self.expand_duplicate_annotation(outline, one_line_per_id=True):  # presto only handles one sequence per line
+                            writer.writerow(utils.convert_to_presto(self.glfo, dupline))
+                    else:
+                        writer.writerow(self.expand_duplicate_annotation(outline)[0])
 
         if self.args.annotation_clustering is not None:
             if self.args.annotation_clustering != 'vollmers':
@@ -1274,6 +1466,34 @@ class PartitionDriver(object):
 
         return eroded_annotations
 
+    # ----------------------------------------------------------------------------------------
+    def expand_duplicate_annotation(self, line, one_line_per_id=False):
+        """
+        Return a list of annotations with the duplicates of the queries in <line> added back in (the duplicates have the same sequence, so they get the same annotation).
+        If <one_line_per_id>, return a separate line for each duplicate, otherwise return a single line with all of them.
+        """
+        if len(self.duplicates) == 0:
+            return [line, ]
+        per_seq_keys = [k for k in utils.per_seq_columns if k in line]
+        expanded_line = dict(line)
+        for key in per_seq_keys:
+            expanded_line[key] = []
+        for iseq in range(len(line['unique_ids'])):
+            n_copies = 1 + len(self.duplicates.get(line['unique_ids'][iseq], []))
+            expanded_line['unique_ids'] += utils.expand_duplicate_ids([line['unique_ids'][iseq], ], self.duplicates)
+            for key in per_seq_keys:
+                if key != 'unique_ids':
+                    expanded_line[key] += n_copies * [line[key][iseq], ]
+        if not one_line_per_id:
+            return [expanded_line, ]
+        lines = []
+        for iseq in range(len(expanded_line['unique_ids'])):
+            singleline = dict(expanded_line)
+            for key in per_seq_keys:
+                singleline[key] = [expanded_line[key][iseq], ]
+            lines.append(singleline)
+        return lines
+
     # ----------------------------------------------------------------------------------------
     def print_hmm_output(self, line, print_true=False):
         out_str_list = []
@@ -1,6 +1,5 @@
 import sys
 import utils
-import plotting
 import re
 from hist import Hist
 from subprocess import check_call
@@ -195,6 +194,7 @@ class PerformancePlotter(object):
 
     # ----------------------------------------------------------------------------------------
     def plot(self, plotdir, only_csv=False):
+        import plotting
         utils.prep_dir(plotdir + '/plots', wildling=None, multilings=['*.csv', '*.svg', '*.root'])
         for column in self.values:
             if self.only_correct_gene_fractions and column not in bool_columns:
@@ -0,0 +1,114 @@
+""" Choose the number of processes for each partition step, either with the fixed-factor heuristic or by fitting a timing model to the steps we've already run """
+import os
+import csv
+import numpy
+
+# ----------------------------------------------------------------------------------------
+class ProcController(object):
+    """
+    For a step with <n> procs, <N> clusters and <W> forward + viterbi calculations, the model is
+        W(n)    = k * N^2 / n               (each proc does all pairs among its N/n clusters, and k (the fraction that aren't cached, etc.) comes from the last step)
+        cpu(n)  = o * n + c * W(n)          (per-proc overhead, e.g. reading hmms, plus cost per calculation)
+        wall(n) = a + b * n + d * W(n) / n  (fixed overhead, overhead that grows with n (writing input, starting procs, merging output), and the parallel part)
+    where the coefficients are least squares fits to all the steps so far. Until we have enough steps for the fits (and whenever they fail) we use the fixed factor.
+    The model's choice is capped by the fixed-factor choice, so we never keep more procs than the heuristic would (and thus still always get down to one).
+    <objective> is 'fixed-factor', 'wall' or 'cpu'.
+    """
+    def __init__(self, objective, n_max_procs, n_max_calc_per_process=200, factor=1.3, logfname=None):
+        self.objective = objective
+        self.n_max_procs = n_max_procs
+        self.n_max_calc_per_process = n_max_calc_per_process  # if a bcrham process calc'd more than this many fwd + vtb values, don't decrease the number of processes in the next step
+        self.factor = factor
+        self.logfname = logfname
+        self.steps = []  # info for each step
+        self.prediction = None  # (n procs, predicted wall, predicted cpu) for the step that's about to run
+
+    # ----------------------------------------------------------------------------------------
+    def add_step(self, n_procs, n_clusters, n_calcd, wall_time, cpu_time, n_clusters_after, n_cached=None):
+        """ record what happened in the step that just finished (<n_calcd> and <n_cached> (number of cache hits) are None if we don't know) and, if we made a prediction for it, print how we did """
+        step = {'istep' : len(self.steps), 'n_procs' : n_procs, 'n_clusters' : n_clusters, 'n_calcd' : n_calcd, 'n_cached' : n_cached, 'wall' : wall_time, 'cpu' : cpu_time, 'n_clusters_after' : n_clusters_after,
+                'predicted_wall' : None, 'predicted_cpu' : None}
+        if self.prediction is not None and self.prediction[0] == n_procs:
+            step['predicted_wall'], step['predicted_cpu'] = self.prediction[1 : ]
+            print '      n procs controller: predicted wall %.1fs cpu %.1fs, actual wall %.1fs cpu %.1fs' % (step['predicted_wall'], step['predicted_cpu'], wall_time, cpu_time)
+        self.prediction = None
+        self.steps.append(step)
+        if self.logfname is not None:
+            self.write_step(step)
+
+    # ----------------------------------------------------------------------------------------
+    def write_step(self, step):
+        columns = ['istep', 'n_procs', 'n_clusters', 'n_calcd', 'n_cached', 'wall', 'cpu', 'n_clusters_after', 'predicted_wall', 'predicted_cpu']
+        write_header = not os.path.exists(self.logfname) or len(self.steps) == 1
+        with open(self.logfname, 'w' if len(self.steps) == 1 else 'a') as logfile:
+            writer = csv.DictWriter(logfile, columns)
+            if write_header:
+                writer.writeheader()
+            writer.writerow({k : ('' if step[k] is None else step[k]) for k in columns})
+
+    # ----------------------------------------------------------------------------------------
+    def fixed_factor_n_procs(self, n_procs):
+        last = self.steps[-1]
+        if last['n_calcd'] is None or float(last['n_calcd']) / n_procs < self.n_max_calc_per_process:  # always reduce if we only calc'd a few the last time through
+            return int(n_procs / self.factor)
+        return n_procs
+
+    # ----------------------------------------------------------------------------------------
+    def fit(self, columns, yvals, min_rank):
+        """ least squares fit of <yvals> to <columns>, or None if we don't have enough (independent) steps; negative coefficients are set to zero """
+        X = numpy.array(columns, dtype=float).T
+        if len(yvals) < X.shape[1]:
+            return None
+        coefs, _, rank, _ = numpy.linalg.lstsq(X, numpy.array(yvals, dtype=float), rcond=-1)
+        if rank < min_rank:
+            return None
+        return numpy.maximum(coefs, 0.)
+
+    # ----------------------------------------------------------------------------------------
+    def get_model(self):
+        """ return a function that predicts (wall, cpu) for a given number of procs in the next step, or None if we can't fit the model yet """
+        steps = [s for s in self.steps if s['n_calcd'] is not None and s['n_calcd'] > 0]
+        if len(steps) < 2:
+            return None
+        nvals = [s['n_procs'] for s in steps]
+        wvals = [s['n_calcd'] for s in steps]
+        cpu_coefs = self.fit([nvals, wvals], [s['cpu'] for s in steps], min_rank=2)
+        wall_coefs = self.fit([[1 for _ in steps], nvals, [float(w) / n for w, n in zip(wvals, nvals)]], [s['wall'] for s in steps], min_rank=3)
+        if wall_coefs is None:  # e.g. if we've used the same number of procs for every step so far, so we can't tell the overhead that grows with n from the fixed overhead
+            wall_coefs = self.fit([[1 for _ in steps], [float(w) / n for w, n in zip(wvals, nvals)]], [s['wall'] for s in steps], min_rank=2)
+            if wall_coefs is not None:
+                wall_coefs = numpy.array([wall_coefs[0], 0., wall_coefs[1]])
+        if cpu_coefs is None or wall_coefs is None:
+            return None
+
+        last = steps[-1]
+        k = float(last['n_calcd']) * last['n_procs'] / last['n_clusters']**2
+        n_clusters = self.steps[-1]['n_clusters_after']
+        def predict(n):
+            n_calcd = k * n_clusters**2 / n
+            o, c = cpu_coefs
+            a, b, d = wall_coefs
+            return a + b * n + d * n_calcd / n, o * n + c * n_calcd
+        return predict
+
+    # ----------------------------------------------------------------------------------------
+    def next_n_procs(self, n_procs):
+        """ return the number of procs to use for the next step, given that we used <n_procs> for the one that just finished """
+        n_fixed = self.fixed_factor_n_procs(n_procs)
+        if self.objective == 'fixed-factor':
+            return n_fixed
+
+        last = self.steps[-1]
+        if last['n_clusters_after'] == last['n_clusters']:  # no merges, so make sure we don't stay here
+            n_fixed = min(n_fixed, int(n_procs / self.factor))
+        predict = self.get_model()
+        if predict is None:
+            return n_fixed
+
+        iobj = 0 if self.objective == 'wall' else 1
+        candidates = range(1, min(n_fixed, self.n_max_procs) + 1)
+        predictions = {n : predict(n) for n in candidates}
+        n_best = min(candidates, key=lambda n: (predictions[n][iobj], -n))  # break ties in favor of more procs, i.e. closer to what the heuristic would do
+        self.prediction = (n_best, ) + tuple(predictions[n_best])
+        print '      n procs controller: %d procs (minimizes predicted %s, fixed factor would give %d)' % (n_best, self.objective, n_fixed)
+        return n_best
@@ -0,0 +1,137 @@
+""" Tail the json-lines progress files that bcrham writes (with --progress-file) while it's running, so we can report totals and an eta across processes, and kill runs that have stopped making progress """
+import os
+import sys
+import json
+import time
+import threading
+
+import utils
+
+count_keys = ['fwd', 'vtb', 'fwd_cached', 'vtb_cached', 'hamming_merged']
+
+# ----------------------------------------------------------------------------------------
+def read_progress(fname, offset=0):
+    """ return (list of the complete json lines in <fname> after byte offset <offset>, new offset) """
+    if not os.path.exists(fname) or os.path.getsize(fname) <= offset:
+        return [], offset
+    with open(fname) as progfile:
+        progfile.seek(offset)
+        chunk = progfile.read()
+    chunk = chunk[ : chunk.rfind('\n') + 1]  # leave any partial line at the end for next time
+    lines = []
+    for line in chunk.split('\n'):
+        try:
+            lines.append(json.loads(line))
+        except ValueError:  # empty, or the partial last line of a run that got killed (with the start of the rerun's first line tacked on)
+            pass
+    return lines, offset + len(chunk)
+
+# ----------------------------------------------------------------------------------------
+class ProgressMonitor(threading.Thread):
+    """
+    Every <interval> seconds, read any new lines from each running job's <workdir>/<progress_basename>, print totals (and an eta) every <report_interval> seconds,
+    and kill jobs that haven't written anything for <hung_timeout> seconds (the scheduler then reruns them as for any other failure).
+    We also warn (once) about stragglers, i.e. jobs that are still running after <straggler_factor> times the median wall time of the ones that have finished.
+    Use as a context manager around the scheduler's run().
+    """
+    def __init__(self, jobs, progress_basename, interval=1., report_interval=30., hung_timeout=None, straggler_factor=3.):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.jobs = jobs
+        self.progress_basename = progress_basename
+        self.interval = interval
+        self.report_interval = report_interval
+        self.hung_timeout = hung_timeout
+        self.straggler_factor = straggler_factor
+        self.states = {job.name : {'offset' : 0, 'latest' : None, 'start_time' : None, 'last_progress_time' : None, 'straggler' : False} for job in jobs}
+        self.n_killed = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    # ----------------------------------------------------------------------------------------
+    def __enter__(self):
+        self.start_time = time.time()
+        self.last_report_time = self.start_time
+        self.start()
+        return self
+
+    # ----------------------------------------------------------------------------------------
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.join()
+        self.update()  # pick up the final lines
+
+    # ----------------------------------------------------------------------------------------
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.update()
+            self.check_for_problems()
+            if time.time() - self.last_report_time > self.report_interval:
+                self.report()
+                self.last_report_time = time.time()
+
+    # ----------------------------------------------------------------------------------------
+    def running(self, job):
+        return job.start_time is not None and job.returncode is None
+
+    # ----------------------------------------------------------------------------------------
+    def update(self):
+        with self.lock:
+            for job in self.jobs:
+                state = self.states[job.name]
+                if job.start_time != state['start_time']:  # started (or restarted) since we last looked
+                    state['start_time'] = job.start_time
+                    state['last_progress_time'] = job.start_time
+                lines, state['offset'] = read_progress(job.workdir + '/' + self.progress_basename, state['offset'])
+                if len(lines) > 0:
+                    state['latest'] = lines[-1]  # counts are cumulative within each run (and a rerun starts over from zero, which is what we want)
+                    state['last_progress_time'] = time.time()
+
+    # ----------------------------------------------------------------------------------------
+    def check_for_problems(self):
+        finished_times = sorted([job.wall_time for job in self.jobs if job.succeeded])
+        median_time = finished_times[len(finished_times) / 2] if len(finished_times) > 0 else None
+        for job in self.jobs:
+            if not self.running(job):
+                continue
+            state = self.states[job.name]
+            if self.hung_timeout is not None and state['last_progress_time'] is not None and time.time() - state['last_progress_time'] > self.hung_timeout:
+                print '    %s no progress from proc %s in %.0fs, killing it' % (utils.color('yellow', 'warning'), job.name, time.time() - state['last_progress_time'])
+                sys.stdout.flush()
+                job.kill()
+                state['last_progress_time'] = None  # don't keep killing it while we wait for it to be reaped
+                self.n_killed += 1
+            elif median_time is not None and not state['straggler'] and time.time() - job.start_time > self.straggler_factor * max(median_time, self.interval):
+                print '    straggler: proc %s has been running for %.0fs (median for finished procs %.0fs)' % (job.name, time.time() - job.start_time, median_time)
+                sys.stdout.flush()
+                state['straggler'] = True
+
+    # ----------------------------------------------------------------------------------------
+    def totals(self):
+        """ sum of the latest counts over all jobs """
+        with self.lock:
+            return {k : sum([s['latest'][k] for s in self.states.values() if s['latest'] is not None]) for k in count_keys}
+
+    # ----------------------------------------------------------------------------------------
+    def job_counts(self, job):
+        """ latest counts for <job> (None if we haven't seen any) """
+        with self.lock:
+            return self.states[job.name]['latest']
+
+    # ----------------------------------------------------------------------------------------
+    def eta(self):
+        n_done = len([job for job in self.jobs if job.succeeded])
+        if n_done == 0:
+            return None
+        elapsed = time.time() - self.start_time
+        return elapsed * (len(self.jobs) - n_done) / n_done
+
+    # ----------------------------------------------------------------------------------------
+    def report(self):
+        totals = self.totals()
+        n_calcd, n_cached = totals['fwd'] + totals['vtb'], totals['fwd_cached'] + totals['vtb_cached']
+        n_clusters = sum([s['latest']['clusters'] for s in self.states.values() if s['latest'] is not None])
+        eta = self.eta()
+        print '      progress: %d / %d procs finished, %d clusters, calculated fwd %d vtb %d (%.0f%% cache hits), eta %s' % (len([j for j in self.jobs if j.succeeded]), len(self.jobs), n_clusters, totals['fwd'], totals['vtb'],
+                                                                                                                         100. * n_cached / max(1, n_calcd + n_cached), '?' if eta is None else '%.0fs' % eta)
+        sys.stdout.flush()
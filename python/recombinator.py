@@ -2,7 +2,6 @@
 import sys
 import csv
 import time
-import json
 import random
 from cStringIO import StringIO
 import treegenerator
@@ -15,6 +14,7 @@ from Bio import SeqIO, Phylo
 import dendropy
 
 from opener import opener
+import glutils
 import paramutils
 import utils
 from event import RecombinationEvent
@@ -49,12 +49,10 @@ class Recombinator(object):
                 self.mute_models[region][model] = {}
 
         # first read info that doesn't depend on which person we're looking at
-        self.all_seqs = utils.read_germlines(self.args.datadir)
-        with opener('r')(self.args.datadir + '/v-meta.json') as json_file:  # get location of <begin> cysteine in each v region
-            self.cyst_positions = json.load(json_file)
-        with opener('r')(self.args.datadir + '/j_tryp.csv') as csv_file:  # get location of <end> tryptophan in each j region (TGG)
-            tryp_reader = csv.reader(csv_file)
-            self.tryp_positions = {row[0]:row[1] for row in tryp_reader}  # WARNING: this doesn't filter out the header line
+        glfo = glutils.read_glfo(self.args.datadir)
+        self.all_seqs = glfo['seqs']
+        self.cyst_positions = glfo['cyst-positions']
+        self.tryp_positions = glfo['tryp-positions']
 
         # then read stuff that's specific to each person
         self.read_vdj_version_freqs(self.args.parameter_dir + '/' + utils.get_parameter_fname('all'))
@@ -11,70 +11,160 @@ import utils
 from opener import opener
 
 # ----------------------------------------------------------------------------------------
-def get_seqfile_info(fname, is_data, glfo=None, n_max_queries=-1, queries=None, reco_ids=None):
-    """ return list of sequence info from files of several types """
+class RecoInfo(OrderedDict):
+    """
+    OrderedDict of simulation info, keyed by unique id, that waits until a line is first accessed to add the (fairly bulky) germline match info.
+    NOTE py2.7 OrderedDict's values(), items(), and the iter versions all go through __getitem__, so they get the match info as well.
+    """
+    def __init__(self, glfo=None):
+        OrderedDict.__init__(self)
+        self.glfo = glfo
+
+    def __getitem__(self, unique_id):
+        line = OrderedDict.__getitem__(self, unique_id)
+        if self.glfo is not None and 'v_qr_seq' not in line:  # haven't added match info to this line yet
+            utils.add_match_info(self.glfo, line)
+        return line
+
+    def get(self, unique_id, default=None):  # dict.get() doesn't go through __getitem__
+        if unique_id not in self:
+            return default
+        return self[unique_id]
+
+# ----------------------------------------------------------------------------------------
+class InputInfo(object):
+    """
+    Ordered map from unique id to {'unique_id' : ..., 'seq' : ...} that only keeps the id and sequence strings, and builds each query's dict when it's accessed
+    (a dict for each of a few hundred thousand queries is most of the memory for the input info).
+    NOTE so the dicts are copies -- changing one doesn't change what's stored.
+    """
+    def __init__(self):
+        self.index = {}  # unique id : position in input order
+        self.uids = []
+        self.seqs = []
+
+    def __len__(self):
+        return len(self.uids)
+
+    def __contains__(self, unique_id):
+        return unique_id in self.index
+
+    def __iter__(self):
+        return iter(self.uids)
+
+    def __getitem__(self, unique_id):
+        return {'unique_id' : unique_id, 'seq' : self.seqs[self.index[unique_id]]}
+
+    def __setitem__(self, unique_id, query_info):
+        if unique_id in self.index:
+            self.seqs[self.index[unique_id]] = query_info['seq']
+        else:
+            self.index[unique_id] = len(self.uids)
+            self.uids.append(unique_id)
+            self.seqs.append(query_info['seq'])
+
+    def get(self, unique_id, default=None):
+        if unique_id not in self.index:
+            return default
+        return self[unique_id]
+
+    def keys(self):
+        return list(self.uids)
+
+    def iterkeys(self):
+        return iter(self.uids)
+
+    def itervalues(self):
+        for unique_id in self.uids:
+            yield self[unique_id]
+
+    def iteritems(self):
+        for unique_id in self.uids:
+            yield unique_id, self[unique_id]
 
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+# ----------------------------------------------------------------------------------------
+def get_column_names(fname):
+    """ return (name column, seq column) for <fname> """
     if '.csv' in fname:
-        delimiter = ','
-        name_column = 'unique_id'
-        seq_column = 'seq'
-        seqfile = opener('r')(fname)
-        reader = csv.DictReader(seqfile, delimiter=delimiter)
+        return 'unique_id', 'seq'
     elif '.tsv' in fname:
-        delimiter = '\t'
-        name_column = 'name'
-        seq_column = 'nucleotide'
-        seqfile = opener('r')(fname)
-        reader = csv.DictReader(seqfile, delimiter=delimiter)
+        return 'name', 'nucleotide'
     elif '.fasta' in fname or '.fa' in fname or '.fastq' in fname or '.fq' in fname:
-        name_column = 'unique_id'
-        seq_column = 'seq'
-        reader = []
-        n_fasta_queries = 0
-        ftype = 'fasta' if ('.fasta' in fname or '.fa' in fname) else 'fastq'
-        for seq_record in SeqIO.parse(fname, ftype):
-            reader.append({})
-            reader[-1][name_column] = seq_record.name
-            reader[-1][seq_column] = str(seq_record.seq).upper()
-            n_fasta_queries += 1
-            if n_max_queries > 0 and n_fasta_queries >= n_max_queries:
-                break
+        return 'unique_id', 'seq'
     else:
         raise Exception('unrecognized file format %s' % fname)
 
-    input_info = OrderedDict()
-    reco_info = None
-    if not is_data:
-        reco_info = OrderedDict()
+# ----------------------------------------------------------------------------------------
+def iterate_seqfile(fname):
+    """
+    Yield the lines in <fname> one at a time (as dicts), without ever holding the whole file in memory.
+    Handles csv, tsv, fasta, and fastq, each either uncompressed or with .gz or .bz2 (see opener).
+    """
+    name_column, seq_column = get_column_names(fname)
+    with opener('r')(fname) as seqfile:
+        if '.csv' in fname or '.tsv' in fname:
+            reader = csv.DictReader(seqfile, delimiter=(',' if '.csv' in fname else '\t'))
+            for line in reader:
+                yield line
+        else:
+            ftype = 'fasta' if ('.fasta' in fname or '.fa' in fname) else 'fastq'
+            for seq_record in SeqIO.parse(seqfile, ftype):
+                yield {name_column : seq_record.name, seq_column : str(seq_record.seq).upper()}
+
+# ----------------------------------------------------------------------------------------
+def iterate_seqfile_info(fname, is_data, glfo=None, n_max_queries=-1, queries=None, reco_ids=None, chunk_size=None):
+    """
+    Yield (input_info, reco_info) for successive chunks of at most <chunk_size> queries from <fname> (or for all of them at once, if <chunk_size> is None).
+    Each chunk is only read from the file when the previous one has been consumed, so memory goes as <chunk_size> rather than the size of the file.
+    """
+
+    name_column, seq_column = get_column_names(fname)
+
+    def new_chunk():
+        return InputInfo(), (None if is_data else RecoInfo(glfo))  # for simulation, match info is added to each line when it's first accessed
+
+    input_info, reco_info = new_chunk()
     n_queries = 0
-    for line in reader:
+    for line in iterate_seqfile(fname):
         if '.csv' in fname and name_column not in line:  # hackey hackey hackey
             name_column = 'name'
             seq_column = 'nucleotide'
-        utils.process_input_line(line, int_columns=('v_5p_del', 'd_5p_del', 'cdr3_length', 'j_5p_del', 'j_3p_del', 'd_3p_del', 'v_3p_del'), literal_columns=('indels'))
         unique_id = line[name_column]
-        # if command line specified query or reco ids, skip other ones
+        # if command line specified query or reco ids, skip other ones (do this before processing the line, so we don't waste time on lines we're skipping)
         if queries is not None and unique_id not in queries:
             continue
         if reco_ids is not None and line['reco_id'] not in reco_ids:
             continue
+        utils.process_input_line(line, int_columns=('v_5p_del', 'd_5p_del', 'cdr3_length', 'j_5p_del', 'j_3p_del', 'd_3p_del', 'v_3p_del'), literal_columns=('indels'))
 
         input_info[unique_id] = {'unique_id' : unique_id, 'seq' : line[seq_column]}
         if not is_data:
             if 'v_gene' not in line:
                 raise Exception('simulation info not found in %s -- if this is data add option --is-data' % fname)
-            reco_info[unique_id] = dict(line)
+            reco_info[unique_id] = line  # the reader gives us a new dict for each line, so there's no need to copy it
             if 'indels' in line and line['indels']['reversed_seq'] != '':  # TODO unhackify this
-                reco_info[unique_id]['seq'] = line['indels']['reversed_seq']
+                line['seq'] = line['indels']['reversed_seq']
             if 'indels' not in line:  # TODO unhackify this
-                reco_info[unique_id]['indels'] = None
-            if glfo is not None:
-                utils.add_match_info(glfo, reco_info[unique_id])
+                line['indels'] = None
         n_queries += 1
         if n_max_queries > 0 and n_queries >= n_max_queries:
             break
+        if chunk_size is not None and len(input_info) >= chunk_size:
+            yield input_info, reco_info
+            input_info, reco_info = new_chunk()
 
-    if len(input_info) == 0:
+    if n_queries == 0:
         raise Exception('didn\'t end up pulling any input info out of %s while looking for queries: %s reco_ids: %s\n' % (fname, str(queries), str(reco_ids)))
-    
-    return (input_info, reco_info)
+    if len(input_info) > 0:
+        yield input_info, reco_info
+
+# ----------------------------------------------------------------------------------------
+def get_seqfile_info(fname, is_data, glfo=None, n_max_queries=-1, queries=None, reco_ids=None):
+    """ return list of sequence info from files of several types """
+    return next(iterate_seqfile_info(fname, is_data, glfo=glfo, n_max_queries=n_max_queries, queries=queries, reco_ids=reco_ids))
@@ -0,0 +1,138 @@
+""" Compact storage for per-query sequences: each kind of sequence (e.g. the smith-waterman query seq and the naive seq) is kept uint8-encoded in one contiguous buffer, indexed by integer query index """
+import numpy
+
+import utils
+
+pad_char = utils.ambiguous_bases[0]
+pad_code = ord(pad_char)
+
+# ----------------------------------------------------------------------------------------
+def grow(array, min_size, fill=0):
+    """ return <array> if it's at least <min_size> long, otherwise a copy that's been extended (by at least half again) with <fill> """
+    if len(array) >= min_size:
+        return array
+    new_array = numpy.full(max(min_size, 3 * len(array) // 2, 16), fill, dtype=array.dtype)
+    new_array[ : len(array)] = array
+    return new_array
+
+# ----------------------------------------------------------------------------------------
+class SequenceStore(object):
+    """
+    Sequences for each query, keyed by unique id (which gets mapped to an integer query index the first time we see it).
+    The padding for each query (the number of Ns on either side to make everybody the same length) is stored separately from the sequences, so that
+    padded sequences are only built when they're needed (or, for hamming distances, are taken as rows of one uint8 matrix).
+    """
+    def __init__(self, kinds=('seq', 'naive')):
+        self.index = {}  # unique id : query index
+        self.uids = []  # query index : unique id
+        self.padleft = numpy.zeros(0, dtype=numpy.int32)
+        self.padright = numpy.zeros(0, dtype=numpy.int32)
+        self.buffers, self.n_used, self.offsets, self.lengths = {}, {}, {}, {}
+        for kind in kinds:
+            self.buffers[kind] = numpy.zeros(0, dtype=numpy.uint8)
+            self.n_used[kind] = 0  # number of bytes of self.buffers[kind] that are in use
+            self.offsets[kind] = numpy.zeros(0, dtype=numpy.int64)
+            self.lengths[kind] = numpy.zeros(0, dtype=numpy.int32)  # -1 for queries that don't have this kind of sequence
+
+    # ----------------------------------------------------------------------------------------
+    def __len__(self):
+        return len(self.uids)
+
+    # ----------------------------------------------------------------------------------------
+    def __contains__(self, uid):
+        return uid in self.index
+
+    # ----------------------------------------------------------------------------------------
+    def get_index(self, uid):
+        """ return the query index for <uid>, adding it if we haven't seen it before """
+        if uid not in self.index:
+            self.index[uid] = len(self.uids)
+            self.uids.append(uid)
+            n_queries = len(self.uids)
+            self.padleft = grow(self.padleft, n_queries)
+            self.padright = grow(self.padright, n_queries)
+            for kind in self.buffers:
+                self.offsets[kind] = grow(self.offsets[kind], n_queries)
+                self.lengths[kind] = grow(self.lengths[kind], n_queries, fill=-1)
+        return self.index[uid]
+
+    # ----------------------------------------------------------------------------------------
+    def has_seq(self, uid, kind='seq'):
+        return uid in self.index and self.lengths[kind][self.index[uid]] >= 0
+
+    # ----------------------------------------------------------------------------------------
+    def set_seq(self, uid, seq, kind='seq'):
+        iquery = self.get_index(uid)
+        codes = numpy.frombuffer(seq, dtype=numpy.uint8)
+        if self.lengths[kind][iquery] == len(seq):  # same length as what was there before, so reuse the space
+            offset = self.offsets[kind][iquery]
+        else:  # NOTE we don't bother reclaiming the old space, since sequences only rarely get re-set with a different length
+            offset = self.n_used[kind]
+            self.buffers[kind] = grow(self.buffers[kind], offset + len(seq))
+            self.n_used[kind] += len(seq)
+        self.buffers[kind][offset : offset + len(seq)] = codes
+        self.offsets[kind][iquery] = offset
+        self.lengths[kind][iquery] = len(seq)
+
+    # ----------------------------------------------------------------------------------------
+    def clear(self, kind):
+        """ forget all sequences of type <kind> (e.g. naive sequences, if the smith-waterman info they were derived from changed) """
+        self.n_used[kind] = 0
+        self.lengths[kind][:] = -1
+
+    # ----------------------------------------------------------------------------------------
+    def get_codes(self, uid, kind='seq'):
+        """ return a (read-only, so don't go modifying it) view of the uint8 codes for <uid> """
+        iquery = self.index[uid]
+        length = self.lengths[kind][iquery]
+        if length < 0:
+            raise Exception('no %s sequence for %s in sequence store' % (kind, uid))
+        offset = self.offsets[kind][iquery]
+        view = self.buffers[kind][offset : offset + length]
+        view.flags.writeable = False
+        return view
+
+    # ----------------------------------------------------------------------------------------
+    def get_seq(self, uid, kind='seq'):
+        return self.get_codes(uid, kind).tostring()
+
+    # ----------------------------------------------------------------------------------------
+    def set_padding(self, uid, padleft, padright):
+        iquery = self.get_index(uid)
+        self.padleft[iquery] = padleft
+        self.padright[iquery] = padright
+
+    # ----------------------------------------------------------------------------------------
+    def get_padding(self, uid):
+        iquery = self.index[uid]
+        return int(self.padleft[iquery]), int(self.padright[iquery])
+
+    # ----------------------------------------------------------------------------------------
+    def get_padded_seq(self, uid, kind='seq'):
+        """ return the sequence for <uid> with padding Ns added on either side """
+        padleft, padright = self.get_padding(uid)
+        return padleft * pad_char + self.get_seq(uid, kind) + padright * pad_char
+
+    # ----------------------------------------------------------------------------------------
+    def get_padded_matrix(self, uids, kind='seq'):
+        """ return a (len(uids), padded length) uint8 matrix with the padded sequences for <uids> (which must all have the same padded length) """
+        iqueries = numpy.array([self.index[uid] for uid in uids], dtype=int)
+        lengths = self.lengths[kind][iqueries]
+        if (lengths < 0).any():
+            raise Exception('no %s sequence for %s in sequence store' % (kind, ' '.join([uids[i] for i in numpy.nonzero(lengths < 0)[0]])))
+        padded_lengths = self.padleft[iqueries] + lengths + self.padright[iqueries]
+        if len(iqueries) > 0 and (padded_lengths != padded_lengths[0]).any():
+            raise Exception('padded %s sequences have different lengths: %s' % (kind, ' '.join([str(l) for l in sorted(set(padded_lengths))])))
+        matrix = numpy.full((len(iqueries), padded_lengths[0] if len(iqueries) > 0 else 0), pad_code, dtype=numpy.uint8)
+        for irow, iquery in enumerate(iqueries):
+            start, offset = self.padleft[iquery], self.offsets[kind][iquery]
+            matrix[irow, start : start + lengths[irow]] = self.buffers[kind][offset : offset + lengths[irow]]
+        return matrix
+
+    # ----------------------------------------------------------------------------------------
+    def nbytes(self):
+        """ memory used by the arrays (not including the python containers for the uids) """
+        total = self.padleft.nbytes + self.padright.nbytes
+        for kind in self.buffers:
+            total += self.buffers[kind].nbytes + self.offsets[kind].nbytes + self.lengths[kind].nbytes
+        return total
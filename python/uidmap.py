@@ -0,0 +1,124 @@
+""" Intern query unique ids as dense integers, so that partitions can be stored as int arrays (string ids only come back when we print or write them) """
+import itertools
+import numpy
+
+# ----------------------------------------------------------------------------------------
+class UidMap(object):
+    """ two-way map between string unique ids and dense integer ids (in the order that we first saw them) """
+    def __init__(self):
+        self.uids = []  # integer id : unique id
+        self.index = {}  # unique id : integer id
+        self.uid_array = numpy.zeros(0, dtype=object)  # copy of self.uids as a numpy array, so we can look up a whole array of integer ids at once (rebuilt when it falls behind)
+
+    # ----------------------------------------------------------------------------------------
+    def __len__(self):
+        return len(self.uids)
+
+    # ----------------------------------------------------------------------------------------
+    def intern(self, uid):
+        """ return the integer id for <uid>, adding it if we haven't seen it before """
+        iuid = self.index.get(uid)
+        if iuid is None:
+            iuid = len(self.uids)
+            self.index[uid] = iuid
+            self.uids.append(uid)
+        return iuid
+
+    # ----------------------------------------------------------------------------------------
+    def intern_many(self, uids):
+        try:  # usually we've seen all of them already, so try the fast way first
+            return numpy.fromiter(itertools.imap(self.index.__getitem__, uids), dtype=numpy.int32, count=len(uids))
+        except KeyError:
+            return numpy.array([self.intern(uid) for uid in uids], dtype=numpy.int32)
+
+    # ----------------------------------------------------------------------------------------
+    def get_uids(self, iuids):
+        if len(self.uid_array) != len(self.uids):
+            self.uid_array = numpy.array(self.uids, dtype=object)
+        return self.uid_array[iuids].tolist()
+
+default_uidmap = UidMap()  # shared by everybody in this process, so integer ids from different paths/files are comparable
+
+# ----------------------------------------------------------------------------------------
+class EncodedPartition(object):
+    """
+    A partition stored as the integer ids of all its sequences, cluster by cluster, in one int32 array, plus the index in that array at which each cluster starts
+    (so it uses four bytes per sequence and four per cluster, rather than a list per cluster and a pointer per sequence).
+    Treat it as immutable, since the same instance can be shared by several paths.
+    """
+    __slots__ = ('ids', 'bounds')
+
+    def __init__(self, ids, bounds):
+        self.ids = ids  # integer ids of all the sequences, cluster by cluster
+        self.bounds = bounds  # cluster <ic> is ids[bounds[ic] : bounds[ic + 1]]
+
+    # ----------------------------------------------------------------------------------------
+    def __len__(self):
+        return len(self.bounds) - 1
+
+    # ----------------------------------------------------------------------------------------
+    def n_seqs(self):
+        return len(self.ids)
+
+    # ----------------------------------------------------------------------------------------
+    def cluster_sizes(self):
+        return numpy.diff(self.bounds)
+
+    # ----------------------------------------------------------------------------------------
+    def cluster(self, ic):
+        return self.ids[self.bounds[ic] : self.bounds[ic + 1]]
+
+    # ----------------------------------------------------------------------------------------
+    def cluster_tuples(self):
+        """ return a list of tuples, one for each cluster (e.g. for set operations) """
+        return [tuple(self.cluster(ic)) for ic in range(len(self))]
+
+    # ----------------------------------------------------------------------------------------
+    def cluster_labels(self):
+        """ return the cluster index of each entry in self.ids """
+        return numpy.repeat(numpy.arange(len(self), dtype=numpy.int32), self.cluster_sizes())
+
+    # ----------------------------------------------------------------------------------------
+    def decode(self, uidmap=default_uidmap):
+        """ return the partition as a list of lists of unique ids """
+        uids, bounds = uidmap.get_uids(self.ids), self.bounds.tolist()
+        return [uids[bounds[ic] : bounds[ic + 1]] for ic in range(len(self))]
+
+    # ----------------------------------------------------------------------------------------
+    def nbytes(self):
+        return self.ids.nbytes + self.bounds.nbytes
+
+# ----------------------------------------------------------------------------------------
+def encode_partition(partition, uidmap=default_uidmap):
+    """ return an EncodedPartition for <partition>, a list of lists (or strs, if you split them) of unique ids """
+    ids = uidmap.intern_many([uid for cluster in partition for uid in cluster])
+    bounds = numpy.zeros(len(partition) + 1, dtype=numpy.int32)
+    numpy.cumsum([len(cluster) for cluster in partition], out=bounds[1:])
+    return EncodedPartition(ids, bounds)
+
+# ----------------------------------------------------------------------------------------
+def encode_partition_str(partitionstr, uidmap=default_uidmap):
+    """ same as encode_partition(), but for the string representation in partition files (clusters separated by semicolons, unique ids by colons) """
+    ids = uidmap.intern_many(partitionstr.replace(';', ':').split(':'))
+    chars = numpy.frombuffer(partitionstr, dtype=numpy.uint8)
+    separators = chars[(chars == ord(':')) | (chars == ord(';'))]  # so the <i>th separator comes just after the <i>th id
+    bounds = numpy.zeros(partitionstr.count(';') + 2, dtype=numpy.int32)
+    bounds[1 : -1] = numpy.nonzero(separators == ord(';'))[0] + 1
+    bounds[-1] = len(ids)
+    return EncodedPartition(ids, bounds)
+
+# ----------------------------------------------------------------------------------------
+def decode_partition_str(partitionstr):
+    """ return the partition in <partitionstr> (see encode_partition_str()) as a list of lists of unique ids, without interning them """
+    return [cluster_str.split(':') for cluster_str in partitionstr.split(';')]
+
+# ----------------------------------------------------------------------------------------
+def concatenate_partitions(partitions):
+    """ return a single EncodedPartition with all the clusters from each of <partitions> (e.g. from different processes, which had disjoint sets of sequences) """
+    ids = numpy.concatenate([ptn.ids for ptn in partitions])
+    bounds = [numpy.zeros(1, dtype=numpy.int32)]
+    offset = 0
+    for ptn in partitions:
+        bounds.append(ptn.bounds[1:] + offset)
+        offset += ptn.n_seqs()
+    return EncodedPartition(ids, numpy.concatenate(bounds).astype(numpy.int32))
@@ -11,7 +11,6 @@ import glob
 from collections import OrderedDict
 import csv
 from subprocess import check_output, CalledProcessError
-from sklearn.metrics.cluster import adjusted_mutual_info_score
 import multiprocessing
 import shutil
 import copy
@@ -64,6 +63,7 @@ ambiguous_bases = ['N', ]
 gap_chars = ['.', '-']
 naivities = ['M', 'N']
 conserved_codon_names = {'v':'cyst', 'd':'', 'j':'tryp'}
+per_seq_columns = ('unique_ids', 'seqs', 'aligned_v_seqs')  # annotation columns with a list that has an entry for each sequence (rather than one value for the whole event)
 # Infrastrucure to allow hashing all the columns together into a dict key.
 # Uses a tuple with the variables that are used to index selection frequencies
 # NOTE fv and jf insertions are *effective* (not real) insertions between v or j and the framework. They allow query sequences that extend beyond the v or j regions
@@ -164,42 +164,6 @@ def read_cyst_positions(datadir):
 
     return cyst_positions
 
-# ----------------------------------------------------------------------------------------
-def rewrite_germline_fasta(input_dir, output_dir, only_genes):
-    """ rewrite the germline set files in <input_dir> to <output_dir>, only keeping the genes in <only_genes> """
-    print 'rewriting germlines from %s to %s' % (input_dir, output_dir)
-    input_germlines = read_germlines(input_dir)
-    input_aligned_v_genes = read_germlines(input_dir, only_region='v', aligned=True)
-    expected_files = []  # list of files that we write here -- if anything else is in the output dir, we barf
-
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    def write_gl_file(fname, region, igls):
-        expected_files.append(fname)
-        with open(fname, 'w') as outfile:
-            for gene in igls[region]:
-                if gene not in only_genes:
-                    continue
-                outfile.write('>' + gene + '\n')
-                outfile.write(igls[region][gene] + '\n')
-
-    for region in regions:
-        write_gl_file(output_dir + '/igh' + region + '.fasta', region, input_germlines)
-    write_gl_file(output_dir + '/ighv-aligned.fasta', 'v', input_aligned_v_genes)
-
-    for fname in ['v-meta.json', 'v-meta.csv', 'j_tryp.csv']:
-        expected_files.append(output_dir + '/' + fname)
-        shutil.copyfile(input_dir + '/' + fname, output_dir + '/' + fname)
-
-    # make sure there weren't any files lingering in the output dir when we started
-    final_file_list = glob.glob(output_dir + '/*')
-    for fname in final_file_list:
-        if fname not in expected_files:
-            raise Exception('unexpected file %s (expected %s)' % (fname, ' '.join(expected_files)))
-
-    return expected_files  # return the rewritten files so they can be deleted if desired
-
 # ----------------------------------------------------------------------------------------
 def from_same_event(reco_info, query_names):
     if len(query_names) > 1:
@@ -1329,30 +1293,15 @@ def process_input_line(info, splitargs=(), int_columns=(), float_columns=(), lit
 
 # ----------------------------------------------------------------------------------------
 def merge_csvs(outfname, csv_list, cleanup=True):
-    """ NOTE copy of merge_hmm_outputs in partitiondriver, I should really combine the two functions """
-    header = None
-    outfo = []
-    # print 'merging'
-    for infname in csv_list:
-        # print '  ', infname
-        workdir = os.path.dirname(infname)
-        with opener('r')(infname) as sub_outfile:
-            reader = csv.DictReader(sub_outfile)
-            header = reader.fieldnames
-            for line in reader:
-                outfo.append(line)
-        if cleanup:
-            os.remove(infname)
-            os.rmdir(workdir)
-
+    """ merge the csv files in <csv_list> (e.g. from each subprocess's workdir) into <outfname>, and remove them and their directories if <cleanup> """
+    import csvmerge
     outdir = '.' if os.path.dirname(outfname) == '' else os.path.dirname(outfname)
     if not os.path.exists(outdir):
         os.makedirs(outdir)
-    with opener('w')(outfname) as outfile:
-        writer = csv.DictWriter(outfile, header)
-        writer.writeheader()
-        for line in outfo:
-            writer.writerow(line)
+    csvmerge.merge_csvs(csv_list, outfname, remove_infiles=cleanup)
+    if cleanup:
+        for infname in csv_list:
+            os.rmdir(os.path.dirname(infname))
 
 # ----------------------------------------------------------------------------------------
 def get_mutation_rate(germlines, line, restrict_to_region=''):
@@ -1473,6 +1422,36 @@ def get_true_partition(reco_info, ids=None):
         true_partition[rid].append(uid)
     return true_partition.values()
 
+# ----------------------------------------------------------------------------------------
+def collapse_duplicate_seqs(input_info):
+    """
+    Collapse queries in <input_info> with identical sequences, keeping the first one we see as the representative.
+    Returns the collapsed input info, and a dict from each representative's unique id to the (list of) unique ids of its duplicates (only for representatives that have duplicates).
+    """
+    collapsed_info = type(input_info)()
+    representatives = {}  # map from sequence to the unique id of its representative
+    duplicates = {}
+    for uid, query_info in input_info.iteritems():
+        seq = query_info['seq']
+        if seq in representatives:
+            rep_uid = representatives[seq]
+            if rep_uid not in duplicates:
+                duplicates[rep_uid] = []
+            duplicates[rep_uid].append(uid)
+        else:
+            representatives[seq] = uid
+            collapsed_info[uid] = query_info
+    return collapsed_info, duplicates
+
+# ----------------------------------------------------------------------------------------
+def expand_duplicate_ids(uids, duplicates):
+    """ return a new list with the duplicates (from collapse_duplicate_seqs()) of each id in <uids> inserted just after it """
+    expanded_uids = []
+    for uid in uids:
+        expanded_uids.append(uid)
+        expanded_uids += duplicates.get(uid, [])
+    return expanded_uids
+
 # ----------------------------------------------------------------------------------------
 def get_partition_from_str(partition_str):
     """ NOTE there's code in some other places that do the same thing """
@@ -1488,50 +1467,45 @@ def get_str_from_partition(partition):
     return partition_str
 
 # ----------------------------------------------------------------------------------------
-def correct_cluster_fractions(partition, reco_info, debug=False):
-
-    def find_clusters_with_ids(ids, partition):
-        """ find all clusters in <partition> that contain at least one of <ids> """
-        clusters = []
-        for cluster in partition:
-            for uid in ids:
-                if uid in cluster:
-                    clusters.append(cluster)
-                    break
-        return clusters
+def get_partition_labels(partition):
+    """ return a dict from each uid in <partition> to the index of its cluster (so we can look uids up in constant time, instead of searching through the clusters) """
+    labels = {}
+    for iclust in range(len(partition)):
+        for uid in partition[iclust]:
+            labels[uid] = iclust
+    return labels
 
-    uids = []
-    for cluster in partition:
-        uids += cluster
+# ----------------------------------------------------------------------------------------
+def correct_cluster_fractions(partition, reco_info, debug=False):
+    """
+    Return (1 - fraction of true clusters that are under-merged, 1 - fraction that are over-merged), where a true cluster is under-merged if its
+    uids are spread over more than one inferred cluster, and over-merged if any of the inferred clusters containing its uids also contain a uid from another true cluster.
+    Linear in the number of uids: we go through each inferred cluster once, keeping track of which reco ids (i.e. true clusters) it touches.
+    """
+    inferred_clusters = {}  # for each reco id, the indices of the inferred clusters that contain at least one of its uids
+    impure_clusters = set()  # inferred clusters with uids from more than one reco id
+    for iclust in range(len(partition)):
+        reco_ids = set([reco_info[uid]['reco_id'] for uid in partition[iclust]])
+        if len(reco_ids) > 1:
+            impure_clusters.add(iclust)
+        for rid in reco_ids:
+            if rid not in inferred_clusters:
+                inferred_clusters[rid] = set()
+            inferred_clusters[rid].add(iclust)
 
-    true_partition = get_true_partition(reco_info, ids=uids)  # modified without testing
     n_under_merged, n_over_merged = 0, 0
-    for trueclust in true_partition:
+    for rid, iclusts in inferred_clusters.items():
+        under_merged = len(iclusts) > 1  # ids in true cluster are not all in the same inferred cluster
+        over_merged = len(iclusts & impure_clusters) > 0  # at least one inferred cluster with an id in true cluster also contains an id not in true cluster
         if debug:
-            print ''
-            print '  ', trueclust
-        infclusters = find_clusters_with_ids(trueclust, partition)  # lsit of inferred clusters that contain any ids from the true cluster
-        assert len(infclusters) > 0
-        under_merged = len(infclusters) > 1  # ids in true cluster are not all in the same inferred cluster
-        over_merged = False  # at least one inferred cluster with an id in true cluster also contains an id not in true cluster
-        for iclust in infclusters:
-            if debug:
-                print '  ', iclust
-            for uid in iclust:
-                if uid not in trueclust:
-                    over_merged = True
-                    break
-            if over_merged:
-                break
-        if debug:
-            print '  under %s   over %s' % (under_merged, over_merged)
+            print '  %s   under %s   over %s   (inferred clusters: %s)' % (rid, under_merged, over_merged, ' '.join([':'.join(partition[ic]) for ic in sorted(iclusts)]))
         if under_merged:
             n_under_merged += 1
         if over_merged:
             n_over_merged += 1
 
-    under_frac = float(n_under_merged) / len(true_partition)
-    over_frac = float(n_over_merged) / len(true_partition)
+    under_frac = float(n_under_merged) / len(inferred_clusters)
+    over_frac = float(n_over_merged) / len(inferred_clusters)
     if debug:
         print '  under %.2f   over %.2f' % (under_frac, over_frac)
     return (1. - under_frac, 1. - over_frac)
@@ -1539,10 +1513,10 @@ def correct_cluster_fractions(partition, reco_info, debug=False):
 # ----------------------------------------------------------------------------------------
 def partition_similarity_matrix(meth_a, meth_b, partition_a, partition_b, n_biggest_clusters, debug=False):
     """ Return matrix whose ij^th entry is the size of the intersection between <partition_a>'s i^th biggest cluster and <partition_b>'s j^th biggest """
-    def intersection_size(cl_1, cl_2):
+    def intersection_size(cl_1, set_2):
         isize = 0
         for uid in cl_1:
-            if uid in cl_2:
+            if uid in set_2:
                 isize += 1
         return isize
 
@@ -1558,6 +1532,8 @@ def partition_similarity_matrix(meth_a, meth_b, partition_a, partition_b, n_bigg
     a_clusters = sorted(sorted(partition_a), key=len, reverse=True)[ : n_biggest_clusters]  # i.e. the n biggest clusters
     b_clusters = sorted(sorted(partition_b), key=len, reverse=True)[ : n_biggest_clusters]
 
+    b_cluster_sets = [set(clust_b) for clust_b in b_clusters]  # so each membership check is constant time
+
     smatrix = []
     pair_info = []  # list of full pair info (e.g. [0.8, ick)
     max_pair_info = 5
@@ -1565,11 +1541,11 @@ def partition_similarity_matrix(meth_a, meth_b, partition_a, partition_b, n_bigg
         # if debug:
         #     print clust_a
         smatrix.append([])
-        for clust_b in b_clusters:
+        for clust_b, set_b in zip(b_clusters, b_cluster_sets):
             # norm_factor = 1.  # don't normalize
             norm_factor = 0.5 * (len(clust_a) + len(clust_b))  # mean size
             # norm_factor = min(len(clust_a), len(clust_b))  # smaller size
-            intersection = intersection_size(clust_a, clust_b)
+            intersection = intersection_size(clust_a, set_b)
             isize = float(intersection) / norm_factor
             # if debug:
             #     print '    %.2f  %5d   %5d %5d' % (isize, intersection, len(clust_a), len(clust_b))
@@ -1615,36 +1591,76 @@ def find_uid_in_partition(uid, partition):
 # ----------------------------------------------------------------------------------------
 def check_intersection_and_complement(part_a, part_b):
     """ make sure two partitions have identical uid lists """
-    for cluster in part_a:
-        for uid in cluster:
-            find_uid_in_partition(uid, part_b)
-    for cluster in part_b:  # NOTE we could avoid looping over some of these if we were so inclined
-        for uid in cluster:
-            find_uid_in_partition(uid, part_a)
+    uids_a = set([uid for cluster in part_a for uid in cluster])
+    uids_b = set([uid for cluster in part_b for uid in cluster])
+    if uids_a != uids_b:
+        missing_uid = sorted(uids_a ^ uids_b)[0]
+        raise Exception('couldn\'t find %s in %s\n' % (missing_uid, part_b if missing_uid in uids_a else part_a))
 
 # ----------------------------------------------------------------------------------------
 def get_cluster_list_for_sklearn(part_a, part_b):
-    # convert from partition format {cl_1 : [seq_a, seq_b], cl_2 : [seq_c]} to [cl_1, cl_1, cl_2]
-    # NOTE this will be really slow for larger partitions
-
-    # first make sure that <part_a> has every uid in <part_b> (the converse is checked below)
-    for jclust in range(len(part_b)):
-        for uid in part_b[jclust]:
-            find_uid_in_partition(uid, part_a)  # raises exception if not found
-
-    # then make the cluster lists
+    """ convert from partition format [[seq_a, seq_b], [seq_c]] to lists of cluster labels [0, 0, 1] (in the order of the uids in <part_a>) for each partition """
+    labels_b = get_partition_labels(part_b)
     clusts_a, clusts_b = [], []
     for iclust in range(len(part_a)):
         for uid in part_a[iclust]:
+            if uid not in labels_b:
+                raise Exception('couldn\'t find %s in %s\n' % (uid, part_b))
             clusts_a.append(iclust)
-            clusts_b.append(find_uid_in_partition(uid, part_b))
+            clusts_b.append(labels_b[uid])
+    if len(clusts_b) != len(labels_b):  # <part_b> has uids that aren't in <part_a>
+        uids_a = set([uid for cluster in part_a for uid in cluster])
+        raise Exception('couldn\'t find %s in %s\n' % ([uid for uid in labels_b if uid not in uids_a][0], part_a))
 
     return clusts_a, clusts_b
 
 # ----------------------------------------------------------------------------------------
 def adjusted_mutual_information(partition_a, partition_b):
+    """
+    Same as sklearn's adjusted_mutual_info_score() (with its default 'max' normalization), but working from the (sparse) contingency table of the two partitions.
+    In particular the expected mutual information only depends on the two clusters' sizes, so we sum over pairs of distinct cluster sizes rather than all pairs of
+    clusters, which is what made it unaffordable for large partitions.
+    """
+    import numpy  # not imported at the top since they're slow, and a lot of things import utils
+    from scipy.special import gammaln
     clusts_a, clusts_b = get_cluster_list_for_sklearn(partition_a, partition_b)
-    return adjusted_mutual_info_score(clusts_a, clusts_b)
+    n_seqs = len(clusts_a)
+    sizes_a = numpy.bincount(clusts_a) if n_seqs > 0 else numpy.zeros(0, dtype=int)
+    sizes_b = numpy.bincount(clusts_b) if n_seqs > 0 else numpy.zeros(0, dtype=int)
+    sizes_a, sizes_b = sizes_a[sizes_a > 0], sizes_b[sizes_b > 0]  # skip any empty clusters
+    if len(sizes_a) == len(sizes_b) == 1 or len(sizes_a) == len(sizes_b) == 0:  # no clustering, since the data isn't split, i.e. a perfect match
+        return 1.0
+
+    # mutual information from the nonzero entries in the contingency table
+    pair_counts = {}
+    for ia, ib in zip(clusts_a, clusts_b):
+        pair_counts[(ia, ib)] = pair_counts.get((ia, ib), 0) + 1
+    all_sizes_a, all_sizes_b = numpy.bincount(clusts_a), numpy.bincount(clusts_b)
+    nij = numpy.array(pair_counts.values(), dtype=float)
+    outer = numpy.array([all_sizes_a[ia] * all_sizes_b[ib] for ia, ib in pair_counts.keys()], dtype=float)
+    mi = (nij / n_seqs * (numpy.log(nij) - math.log(n_seqs) - numpy.log(outer) + 2 * math.log(n_seqs))).sum()
+
+    # expected mutual information (see sklearn's expected_mutual_information()), for each pair of distinct cluster sizes, times the number of cluster pairs with those sizes
+    unique_a, counts_a = numpy.unique(sizes_a, return_counts=True)
+    unique_b, counts_b = numpy.unique(sizes_b, return_counts=True)
+    gln_n = gammaln(n_seqs + 1)
+    emi = 0.
+    for size_a, count_a in zip(unique_a, counts_a):
+        for size_b, count_b in zip(unique_b, counts_b):
+            nijs = numpy.arange(max(1, size_a + size_b - n_seqs), min(size_a, size_b) + 1, dtype=float)
+            if len(nijs) == 0:
+                continue
+            log_terms = numpy.log(n_seqs * nijs) - math.log(size_a) - math.log(size_b)
+            gln = gammaln(size_a + 1) + gammaln(size_b + 1) + gammaln(n_seqs - size_a + 1) + gammaln(n_seqs - size_b + 1) - gln_n - gammaln(nijs + 1) - gammaln(size_a - nijs + 1) - gammaln(size_b - nijs + 1) - gammaln(n_seqs - size_a - size_b + nijs + 1)
+            emi += count_a * count_b * (nijs / n_seqs * log_terms * numpy.exp(gln)).sum()
+
+    def entropy(sizes):
+        return -(sizes / float(n_seqs) * (numpy.log(sizes) - math.log(n_seqs))).sum()
+
+    denominator = max(entropy(sizes_a), entropy(sizes_b)) - emi
+    eps = numpy.finfo('float64').eps
+    denominator = min(denominator, -eps) if denominator < 0 else max(denominator, eps)  # avoid 0/0 for perfect matches (preserving the sign, in case floating point error makes emi a bit bigger)
+    return (mi - emi) / denominator
 
 # ----------------------------------------------------------------------------------------
 def subset_files(uids, fnames, outdir, uid_header='Sequence ID', delimiter='\t', debug=False):
@@ -1,9 +1,7 @@
 import time
 import sys
-import json
 import math
 import re
-import csv
 import os
 import itertools
 import operator
@@ -14,13 +12,17 @@ from collections import OrderedDict
 
 import utils
 from opener import opener
+import glutils
+from seqstore import SequenceStore
+from jobscheduler import Job
+from executor import get_executor
 from parametercounter import ParameterCounter
 from performanceplotter import PerformancePlotter
 
 # ----------------------------------------------------------------------------------------
 class Waterer(object):
     """ Run smith-waterman on the query sequences in <infname> """
-    def __init__(self, args, input_info, reco_info, germline_seqs, parameter_dir, write_parameters=False):
+    def __init__(self, args, input_info, reco_info, glfo, parameter_dir, write_parameters=False, seqstore=None):
         self.parameter_dir = parameter_dir
         self.args = args
         self.debug = self.args.debug if self.args.sw_debug is None else self.args.sw_debug
@@ -34,7 +36,12 @@ class Waterer(object):
         self.new_indels = 0  # number of new indels that were kicked up this time through
 
         self.reco_info = reco_info
-        self.germline_seqs = germline_seqs
+        self.seqstore = seqstore if seqstore is not None else SequenceStore()  # we put the sw query seqs and their padding in here (rather than keeping another, padded, copy of each sequence)
+        self.seqstore.clear('naive')  # any naive seqs in there were derived from a previous sw run
+        self.glfo = glfo
+        self.germline_seqs = glfo['seqs']
+        self.cyst_positions = glfo['cyst-positions']
+        self.tryp_positions = glfo['tryp-positions']
         self.pcounter, self.true_pcounter, self.perfplotter = None, None, None
         if write_parameters:
             self.pcounter = ParameterCounter(self.germline_seqs)
@@ -51,11 +58,12 @@ class Waterer(object):
                 print '  reading gene choice probs from', parameter_dir
             self.gene_choice_probs = utils.read_overall_gene_probs(parameter_dir)
 
-        with opener('r')(self.args.datadir + '/v-meta.json') as json_file:  # get location of <begin> cysteine in each v region
-            self.cyst_positions = json.load(json_file)
-        with opener('r')(self.args.datadir + '/j_tryp.csv') as csv_file:  # get location of <end> tryptophan in each j region (TGG)
-            tryp_reader = csv.reader(csv_file)
-            self.tryp_positions = {row[0]:row[1] for row in tryp_reader}  # WARNING: this doesn't filter out the header line
+        # if only_genes was specified, write the restricted germline set once for vdjalign to use on every pass
+        self.my_datadir = self.args.datadir
+        self.rewritten_files = []
+        if self.args.only_genes is not None:
+            self.my_datadir = self.args.workdir + '/germline-sets'
+            self.rewritten_files = glutils.write_glfo(self.my_datadir, glutils.get_restricted_glfo(self.glfo, self.args.only_genes))
 
         self.outfile = None
         if self.args.outfname is not None:
@@ -93,6 +101,11 @@ class Waterer(object):
                 break
             self.nth_try += 1  # it's set to 1 before we begin the first try, and increases to 2 just before we start the second try
 
+        if len(self.rewritten_files) > 0:
+            for fname in self.rewritten_files:
+                os.remove(fname)
+            os.rmdir(self.my_datadir)
+
         self.finalize()
 
     # ----------------------------------------------------------------------------------------
@@ -136,12 +149,7 @@ class Waterer(object):
 
     # ----------------------------------------------------------------------------------------
     def execute_commands(self, base_infname, base_outfname, n_procs):
-        # rewrite input germline sets if only_genes was specified
-        datadir = self.args.datadir
-        if self.args.only_genes is not None:
-            datadir = self.args.workdir + '/germline-sets'
-            rewritten_files = utils.rewrite_germline_fasta(self.args.datadir, datadir, self.args.only_genes)
-
+        datadir = self.my_datadir  # NOTE not necessarily <self.args.datadir> (if only_genes was specified)
         if n_procs == 1:
             cmd_str = self.get_vdjalign_cmd_str(self.args.workdir, base_infname, base_outfname, datadir)
             proc = Popen(cmd_str.split(), stdout=PIPE, stderr=PIPE)
@@ -157,54 +165,17 @@ class Waterer(object):
                 workdirs.append(self.args.workdir + '/sw-' + str(iproc))
                 cmd_strs.append(self.get_vdjalign_cmd_str(workdirs[iproc], base_infname, base_outfname, datadir, iproc, n_procs, shell))
 
-            # start all procs for the first time
-            procs, n_tries = [], []
-            for iproc in range(n_procs):
-                procs.append(Popen(cmd_strs[iproc], shell=shell))
-                n_tries.append(1)
-                time.sleep(0.1)
-
             # ----------------------------------------------------------------------------------------
-            def get_outfname(iproc):
-                return workdirs[iproc] + '/' + base_outfname
+            def finish_process(job):
+                utils.process_out_err('', '', extra_str=job.name, subworkdir=job.workdir)
 
-            # ----------------------------------------------------------------------------------------
-            # deal with a process once it's finished (i.e. check if it failed, and restart if so)
-            def finish_process(iproc):
-                procs[iproc].communicate()
-                utils.process_out_err('', '', extra_str=str(iproc), subworkdir=workdirs[iproc])
-                if procs[iproc].returncode == 0 and os.path.exists(get_outfname(iproc)):
-                    procs[iproc] = None  # job succeeded
-                elif n_tries[iproc] > 5:
-                    raise Exception('exceeded max number of tries for command\n    %s\nlook for output in %s' % (cmd_strs[iproc], workdirs[iproc]))
-                else:
-                    print '    rerunning proc %d (exited with %d' % (iproc, procs[iproc].returncode),
-                    if not os.path.exists(get_outfname(iproc)):
-                        print ', output %s d.n.e.' % get_outfname(iproc),
-                    print ')'
-                    procs[iproc] = Popen(cmd_strs[iproc], shell=shell)
-                    n_tries[iproc] += 1
-
-            # keep looping over the procs until they're all done
-            while procs.count(None) != len(procs):  # we set each proc to None when it finishes
-                for iproc in range(n_procs):
-                    if procs[iproc] is None:  # already finished
-                        continue
-                    # read_progress(iproc)
-                    if procs[iproc].poll() is not None:  # it's finished
-                        finish_process(iproc)
-                sys.stdout.flush()
-                time.sleep(1)
+            jobs = [Job(cmd_strs[iproc], str(iproc), outfname=workdirs[iproc] + '/' + base_outfname, workdir=workdirs[iproc]) for iproc in range(n_procs)]
+            get_executor(self.args, n_procs).run(jobs, finish_fcn=finish_process)
 
             if not self.args.no_clean:
                 for iproc in range(n_procs):
                     os.remove(workdirs[iproc] + '/' + base_infname)
 
-        if self.args.only_genes is not None:  # this'll rewrite them for each time through, which is ok and probably preferable
-            for fname in rewritten_files:
-                os.remove(fname)
-            os.rmdir(datadir)
-
         sys.stdout.flush()
 
     # ----------------------------------------------------------------------------------------
@@ -214,26 +185,34 @@ class Waterer(object):
         n_queries_per_proc = int(math.ceil(queries_per_proc))
         if n_procs == 1:  # double check for rounding problems or whatnot
             assert n_queries_per_proc == n_remaining
-        for iproc in range(n_procs):
+
+        # ----------------------------------------------------------------------------------------
+        def open_sub_infile(iproc):
             workdir = self.args.workdir
             if n_procs > 1:
                 workdir += '/sw-' + str(iproc)
                 utils.prep_dir(workdir)
-            with opener('w')(workdir + '/' + base_infname) as sub_infile:
-                iquery = 0
-                for query_name in self.remaining_queries:  # NOTE this is wasteful to loop of all the remaining queries for each process... but maybe not that wasteful
-                    if iquery >= n_remaining:
-                        break
-                    if iquery < iproc*n_queries_per_proc or iquery >= (iproc + 1)*n_queries_per_proc:  # not for this process
-                        iquery += 1
-                        continue
-                    sub_infile.write('>' + query_name + ' NUKES\n')
-
-                    seq = self.input_info[query_name]['seq']
-                    if query_name in self.info['indels']:
-                        seq = self.info['indels'][query_name]['reversed_seq']  # use the query sequence with shm insertions and deletions reversed
-                    sub_infile.write(seq + '\n')
-                    iquery += 1
+            return opener('w')(workdir + '/' + base_infname)
+
+        # make a single pass through the remaining queries, writing each process's contiguous chunk in turn (so we only ever have one file open, and we don't loop over all the queries for each process)
+        iproc = 0
+        sub_infile = open_sub_infile(iproc)
+        iquery = 0
+        for query_name in self.remaining_queries:
+            if iquery >= (iproc + 1)*n_queries_per_proc:  # finished this process's chunk
+                sub_infile.close()
+                iproc += 1
+                sub_infile = open_sub_infile(iproc)
+            sub_infile.write('>' + query_name + ' NUKES\n')
+
+            seq = self.input_info[query_name]['seq']
+            if query_name in self.info['indels']:
+                seq = self.info['indels'][query_name]['reversed_seq']  # use the query sequence with shm insertions and deletions reversed
+            sub_infile.write(seq + '\n')
+            iquery += 1
+        sub_infile.close()
+        for iproc in range(iproc + 1, n_procs):  # if there were fewer queries than procs (or rounding went the wrong way), make sure every process still gets an (empty) input file
+            open_sub_infile(iproc).close()
 
     # ----------------------------------------------------------------------------------------
     def get_vdjalign_cmd_str(self, workdir, base_infname, base_outfname, datadir, iproc=None, n_procs=None, shell=False):
@@ -247,8 +226,6 @@ class Waterer(object):
         if not os.path.exists(self.args.ighutil_dir + '/bin/vdjalign'):
             raise Exception('ERROR ighutil path d.n.e: ' + self.args.ighutil_dir + '/bin/vdjalign')
         cmd_str = self.args.ighutil_dir + '/bin/vdjalign align-fastq -q'
-        if self.args.slurm or utils.auto_slurm(n_procs):
-            cmd_str = 'srun ' + cmd_str
         cmd_str += ' --max-drop 50'
         match, mismatch = self.args.match_mismatch
         cmd_str += ' --match ' + str(match) + ' --mismatch ' + str(mismatch)
@@ -618,7 +595,10 @@ class Waterer(object):
             self.info[query_name][region + '_qr_seq'] = best[region + '_qr_seq']
             self.info['all_best_matches'].add(best[region])
 
+        if query_seq == self.input_info[query_name]['seq']:  # use the input string if it's the same, rather than keeping vdjalign's copy around
+            query_seq = self.input_info[query_name]['seq']
         self.info[query_name]['seq'] = query_seq  # NOTE this is the seq output by vdjalign, i.e. if we reversed any indels it is the reversed sequence
+        self.seqstore.set_seq(query_name, query_seq)
         if self.debug:
             if not self.args.is_data:
                 utils.print_reco_event(self.germline_seqs, self.reco_info[query_name], extra_str='      ', label='true:', indelfo=self.reco_info[query_name]['indels'])
@@ -877,7 +857,7 @@ class Waterer(object):
             swfo['padded'] = {}
             padfo = swfo['padded']  # shorthand
             assert len(utils.ambiguous_bases) == 1  # could allow more than one, but it's not implemented a.t.m.
-            padfo['seq'] = padleft * utils.ambiguous_bases[0] + seq + padright * utils.ambiguous_bases[0]
+            self.seqstore.set_padding(query, padleft, padright)  # NOTE the padded sequence itself only lives in the sequence store (use self.seqstore.get_padded_seq())
             if query in self.info['indels']:
                 if debug:
                     print '    also padding reversed sequence'
@@ -888,11 +868,11 @@ class Waterer(object):
             padfo['padright'] = padright
             if debug:
                 print '      pad %d %d   %s' % (padleft, padright, query)
-                print '     %d --> %d (%d-%d --> %d-%d)' % (len(seq), len(padfo['seq']),
+                print '     %d --> %d (%d-%d --> %d-%d)' % (len(seq), padleft + len(seq) + padright,
                                                             k_v['min'], k_v['max'],
                                                             padfo['k_v']['min'], padfo['k_v']['max'])
 
         if debug:
             for query in self.info['queries']:
-                print '%20s %s' % (query, self.info[query]['padded']['seq'])
+                print '%20s %s' % (query, self.seqstore.get_padded_seq(query))
 
@@ -0,0 +1,153 @@
+""" Keep a pool of long-lived bcrham processes (started with --server), so each one only reads the germline info and hmm files once, rather than once per step """
+import os
+import sys
+import time
+import select
+from subprocess import Popen, PIPE
+
+# ----------------------------------------------------------------------------------------
+# protocol (see run_server() in packages/ham/src/bcrham.cc): we send one line per request, with tab-separated fields
+#   run <workdir> <arg> <arg> ...    (args as for a normal bcrham command line, stdout/stderr go to <workdir>/out and <workdir>/err)
+#   quit
+# and after each run it sends back one line
+#   done <status> <cpu seconds> <hmm loading cpu seconds>
+# NOTE so no argument can contain a tab or newline
+
+# ----------------------------------------------------------------------------------------
+class BcrhamWorker(object):
+    def __init__(self, binary, hmmdir, datadir):
+        self.proc = Popen([binary, '--server', '--hmmdir', hmmdir, '--datadir', datadir], stdin=PIPE, stdout=PIPE, close_fds=True)
+        self.job = None  # job that's currently running
+        self.start_time = None
+        self.n_runs = 0
+
+    # ----------------------------------------------------------------------------------------
+    def fileno(self):  # so we can select() on it
+        return self.proc.stdout.fileno()
+
+    # ----------------------------------------------------------------------------------------
+    def send(self, job, argv):
+        for arg in argv + [job.workdir]:
+            if '\t' in arg or '\n' in arg:
+                raise Exception('can\'t send argument with tab or newline to bcrham worker: %s' % repr(arg))
+        self.job = job
+        self.start_time = time.time()
+        job.start_time, job.returncode, job.proc = self.start_time, None, self.proc  # so it looks like a running jobscheduler.Job (e.g. to the progress monitor, which calls job.kill() if it hangs)
+        self.proc.stdin.write('\t'.join(['run', job.workdir] + argv) + '\n')
+        self.proc.stdin.flush()
+
+    # ----------------------------------------------------------------------------------------
+    def receive(self):
+        """ return (status, cpu time, hmm load time) for the current job, or None if the worker died """
+        line = self.proc.stdout.readline()
+        if line == '':
+            return None
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) != 4 or fields[0] != 'done':
+            raise Exception('unexpected reply from bcrham worker: %s' % repr(line))
+        self.n_runs += 1
+        return int(fields[1]), float(fields[2]), float(fields[3])
+
+    # ----------------------------------------------------------------------------------------
+    def close(self):
+        if self.proc.poll() is None:
+            try:
+                self.proc.stdin.write('quit\n')
+                self.proc.stdin.close()
+            except IOError:  # already dead
+                pass
+        self.proc.wait()
+
+# ----------------------------------------------------------------------------------------
+class WorkerPool(object):
+    """
+    Run jobscheduler.Job-style jobs (with <cmd_str> a plain bcrham command line, i.e. no redirection) on up to <n_workers> long-lived bcrham servers.
+    Workers are started the first time they're needed and kept until close() (they also die with us, since their stdin closes).
+    """
+    def __init__(self, binary, hmmdir, datadir, n_workers, max_tries=6):
+        self.binary = binary
+        self.hmmdir = hmmdir
+        self.datadir = datadir
+        self.n_workers = n_workers
+        self.max_tries = max_tries
+        self.workers = []
+        self.cold_load_times = []  # hmm loading time for the first run on each worker (i.e. what it costs to start from scratch)
+
+    # ----------------------------------------------------------------------------------------
+    def matches(self, binary, hmmdir, datadir):
+        return (binary, hmmdir, datadir) == (self.binary, self.hmmdir, self.datadir)
+
+    # ----------------------------------------------------------------------------------------
+    def get_argv(self, job):
+        argv = job.cmd_str.split()
+        if os.path.basename(argv[0]) != os.path.basename(self.binary):
+            raise Exception('worker pool can only run %s, not %s' % (self.binary, job.cmd_str))
+        return argv[1:]
+
+    # ----------------------------------------------------------------------------------------
+    def run(self, jobs, finish_fcn=None, n_concurrent=None):
+        """ run <jobs>, at most <n_concurrent> (default all the workers) at a time, calling <finish_fcn> on each one when it finishes """
+        if n_concurrent is None or n_concurrent > self.n_workers:
+            n_concurrent = self.n_workers
+        while len(self.workers) < n_concurrent:
+            self.workers.append(BcrhamWorker(self.binary, self.hmmdir, self.datadir))
+        workers = self.workers[ : n_concurrent]
+
+        total_cpu, total_load = 0., 0.
+        waiting = list(jobs)
+        while len(waiting) > 0 or any(w.job is not None for w in workers):
+            for worker in workers:
+                if worker.job is None and len(waiting) > 0:
+                    job = waiting.pop(0)
+                    job.n_tries += 1
+                    worker.send(job, self.get_argv(job))
+            busy = [w for w in workers if w.job is not None]
+            readable, _, _ = select.select(busy, [], [])
+            for worker in readable:
+                job = worker.job
+                was_cold = worker.n_runs == 0
+                reply = worker.receive()
+                job.wall_time += time.time() - worker.start_time
+                worker.job = None
+                if reply is None:  # it died, so replace it
+                    print '    bcrham worker died (exit code %s) while running %s, restarting it' % (worker.proc.wait(), job.name)
+                    iworker = self.workers.index(worker)
+                    self.workers[iworker] = workers[workers.index(worker)] = BcrhamWorker(self.binary, self.hmmdir, self.datadir)
+                    job.returncode = -1
+                else:
+                    job.returncode, cpu_time, load_time = reply
+                    job.cpu_time += cpu_time
+                    total_cpu += cpu_time
+                    total_load += load_time
+                    if was_cold:
+                        self.cold_load_times.append(load_time)
+                job.succeeded = job.returncode == 0 and (job.outfname is None or os.path.exists(job.outfname))
+                if finish_fcn is not None:
+                    finish_fcn(job)
+                if job.succeeded:
+                    continue
+                if job.n_tries >= self.max_tries:
+                    raise Exception('exceeded max number of tries for command\n    %s\nlook for output in %s' % (job.cmd_str, job.workdir))
+                print '    rerunning proc %s (exited with %d' % (job.name, job.returncode),
+                if job.outfname is not None and not os.path.exists(job.outfname):
+                    print ', output %s d.n.e.' % job.outfname,
+                print ')'
+                waiting.append(job)
+            sys.stdout.flush()
+
+        self.report(jobs, len(workers), total_cpu, total_load)
+
+    # ----------------------------------------------------------------------------------------
+    def report(self, jobs, n_workers, total_cpu, total_load):
+        """ estimate the loading time we saved by assuming each run would otherwise have to load as much as the first run on each worker did """
+        if len(jobs) == 0 or len(self.cold_load_times) == 0:
+            return
+        n_runs = sum([job.n_tries for job in jobs])
+        cold_estimate = n_runs * sum(self.cold_load_times) / len(self.cold_load_times)
+        print '      worker pool: %d runs on %d workers, cpu %.1f, hmm loading %.2f (saved ~%.2f vs a new process for each run)' % (n_runs, n_workers, total_cpu, total_load, cold_estimate - total_load)
+
+    # ----------------------------------------------------------------------------------------
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+        self.workers = []
@@ -6,6 +6,7 @@ import csv
 import glob
 import math
 import shutil
+import time
 from collections import OrderedDict
 from subprocess import Popen, PIPE, check_call, check_output
 import sys
@@ -68,9 +69,21 @@ class Tester(object):
 
         self.perf_info = { version_stype : OrderedDict() for version_stype in self.stypes }
 
+        # make sure nobody sneaks a slow import (e.g. sklearn or matplotlib) back onto the startup path
+        self.startup_tests = OrderedDict()
+        self.startup_tests['help'] = {'cmd' : self.partis + ' --help', 'budget' : 1.5}  # wall time in seconds
+        self.startup_tests['tiny-viterbi'] = {'cmd' : self.partis + ' --action run-viterbi --profile-startup --n-max-queries 1 --seqfile ' + simfnames['ref'] + ' --parameter-dir ' + param_dirs['ref']['simu'] + ' --only-genes ' + utils.test_only_genes + ' --outfname ' + self.dirs['new'] + '/tiny-viterbi.csv',
+                                              'budget' : 1.}  # total import time (from --profile-startup), since the wall time is mostly bcrham and vdjalign
+
     # ----------------------------------------------------------------------------------------
     def test(self, args):
         if not args.dont_run:
+            self.test_startup_time()
+            self.test_cache_concurrency()
+            self.test_batch_systems()
+            self.test_divvy()
+            self.test_hamming_index()
+            self.test_single_linkage()
             self.run(args)
         print 'reading performance info'
         for version_stype in self.stypes:
@@ -80,6 +93,239 @@ class Tester(object):
         for input_stype in self.stypes:
             self.compare_partition_cachefiles(input_stype=input_stype)
 
+    # ----------------------------------------------------------------------------------------
+    def test_startup_time(self):
+        print 'startup time'
+        for name, info in self.startup_tests.items():
+            start = time.time()
+            out = check_output(info['cmd'], shell=True)
+            startup_time = time.time() - start
+            if '--profile-startup' in info['cmd']:
+                total_lines = [l for l in out.split('\n') if 'total import time' in l]
+                if len(total_lines) != 1:
+                    raise Exception('couldn\'t find import time in output of %s' % info['cmd'])
+                startup_time = float(total_lines[0].split()[3])
+            print '  %-15s %6.3f  (budget %.3f)' % (name, startup_time, info['budget'])
+            if startup_time > info['budget']:
+                raise Exception('%s went over its startup time budget: %.3f > %.3f' % (name, startup_time, info['budget']))
+
+    # ----------------------------------------------------------------------------------------
+    def test_cache_concurrency(self, n_writers=16, n_batches=5, n_keys=200):
+        """ have lots of processes merge into the same persistent cache file at once, then make sure nothing got lost or mangled """
+        import multiprocessing
+        import hmmcache
+        print 'cache concurrency'
+        workdir = self.dirs['new'] + '/cache-concurrency'
+        if os.path.exists(workdir):
+            shutil.rmtree(workdir)
+        os.makedirs(workdir)
+        persistent_fname = workdir + '/persistent-cache.csv'
+
+        # each writer has some keys of its own, plus some shared keys for which even writers know the log prob and odd ones the naive seq
+        def write_and_merge(iwriter):
+            for ibatch in range(n_batches):
+                fname = '%s/cache-%d-%d.csv' % (workdir, iwriter, ibatch)
+                with open(fname, 'w') as cachefile:
+                    cachefile.write(','.join(hmmcache.headers) + '\n')
+                    for ikey in range(ibatch, n_keys, n_batches):
+                        cachefile.write('w%d-q%d,%f,,,,\n' % (iwriter, ikey, -ikey))
+                        if iwriter % 2 == 0:
+                            cachefile.write('shared-q%d,%f,,,,\n' % (ikey, -ikey))
+                        else:
+                            cachefile.write('shared-q%d,,ACGT%d,0.1,3,\n' % (ikey, ikey))
+                hmmcache.merge_into_persistent(hmmcache.HmmCache(fname), persistent_fname, debug=False)
+
+        start = time.time()
+        procs = [multiprocessing.Process(target=write_and_merge, args=(iwriter,)) for iwriter in range(n_writers)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+            if proc.exitcode != 0:
+                raise Exception('cache writer exited with %d' % proc.exitcode)
+
+        with open(persistent_fname) as persistentfile:
+            lines = persistentfile.readlines()
+        if lines[0].strip().split(',') != hmmcache.headers or any(l.strip().split(',') == hmmcache.headers for l in lines[1:]):
+            raise Exception('should be exactly one header, at the top of %s' % persistent_fname)
+        if any(not l.endswith('\n') or len(l.split(',')) != len(hmmcache.headers) for l in lines[1:]):
+            raise Exception('partial line in %s' % persistent_fname)
+        cacheinfo = hmmcache.HmmCache(persistent_fname).read_all()
+        expected_keys = set(['w%d-q%d' % (iw, ik) for iw in range(n_writers) for ik in range(n_keys)] + ['shared-q%d' % ik for ik in range(n_keys)])
+        if set(cacheinfo) != expected_keys:
+            raise Exception('keys in %s don\'t match: %d missing, %d extra' % (persistent_fname, len(expected_keys - set(cacheinfo)), len(set(cacheinfo) - expected_keys)))
+        if any(cacheinfo['shared-q%d' % ik]['logprob'] == '' or cacheinfo['shared-q%d' % ik]['naive_seq'] == '' for ik in range(n_keys)):
+            raise Exception('lost some info for shared keys in %s' % persistent_fname)
+        print '  %d writers x %d batches: %d lines, %d keys in %.2fs' % (n_writers, n_batches, len(lines) - 1, len(cacheinfo), time.time() - start)
+        shutil.rmtree(workdir)
+
+    # ----------------------------------------------------------------------------------------
+    def test_batch_systems(self, n_jobs=12, jobs_per_batch=4):
+        """ run the same little jobs (a third of which fail the first time) with the local executor and through a file queue served by ./bin/serve-queue.py, and make sure they all get run exactly once more than they failed """
+        import executor
+        from jobscheduler import Job
+        print 'batch systems'
+        workdir = self.dirs['new'] + '/batch-systems'
+        if os.path.exists(workdir):
+            shutil.rmtree(workdir)
+        os.makedirs(workdir)
+
+        server = Popen([sys.executable, './bin/serve-queue.py', '--queue-dir', workdir + '/queue', '--n-procs', '2', '--exit-when-idle', '60'], stdout=PIPE)  # not just its shebang, which might find a different python
+        try:
+            for label, exe in [('local', executor.LocalExecutor()), ('queue', executor.QueueExecutor(workdir, workdir + '/queue', claim_timeout=60., server=server, jobs_per_batch=jobs_per_batch))]:
+                jobs = []
+                for ijob in range(n_jobs):
+                    outfname = '%s/%s-%d.out' % (workdir, label, ijob)
+                    fail_str = ('test -e %s.tried || { touch %s.tried; exit 1; }; ' % (outfname, outfname)) if ijob % 3 == 0 else ''
+                    jobs.append(Job(fail_str + 'echo %d >>%s' % (ijob, outfname), str(ijob), outfname=outfname, workdir=workdir))
+                start = time.time()
+                exe.run(jobs)
+                for ijob in range(n_jobs):
+                    with open('%s/%s-%d.out' % (workdir, label, ijob)) as outfile:
+                        if outfile.read().split() != [str(ijob)]:
+                            raise Exception('job %d didn\'t run exactly once with %s batch system' % (ijob, label))
+                    if jobs[ijob].n_tries != (2 if ijob % 3 == 0 else 1):
+                        raise Exception('job %d had %d tries with %s batch system' % (ijob, jobs[ijob].n_tries, label))
+                print '  %-6s %d jobs in %.2fs' % (label, n_jobs, time.time() - start)
+        finally:
+            server.kill()
+            server.wait()
+        shutil.rmtree(workdir)
+
+    # ----------------------------------------------------------------------------------------
+    def simulate_naive_families(self, n_seqs, max_family_size, length=360, seed=1):
+        """ return (names, code matrix, family sizes, family of each sequence) for families of nearly-identical padded naive sequences, with a few germlines shared between families """
+        random_state = numpy.random.RandomState(seed)
+        bases = numpy.frombuffer(''.join(utils.nukes), dtype=numpy.uint8)
+        germlines = bases[random_state.randint(0, len(bases), (20, length))]
+        family_sizes = numpy.minimum(random_state.pareto(1.5, n_seqs) + 1, max_family_size).astype(int)
+        family_sizes = family_sizes[numpy.cumsum(family_sizes) <= n_seqs]
+        seqs, families = [], []
+        for ifam, size in enumerate(family_sizes):
+            naive_seq = germlines[random_state.randint(len(germlines))].copy()
+            mutated = random_state.rand(length) < 0.08
+            naive_seq[mutated] = bases[random_state.randint(0, len(bases), mutated.sum())]
+            family_seqs = numpy.repeat(naive_seq[None, :], size, axis=0)
+            mutated = random_state.rand(size, length) < 0.01
+            family_seqs[mutated] = bases[random_state.randint(0, len(bases), mutated.sum())]
+            family_seqs[:, : random_state.randint(20)] = ord(utils.ambiguous_bases[0])  # padding
+            seqs.append(family_seqs)
+            families += [ifam for _ in range(size)]
+        names = ['q%d' % i for i in range(len(families))]
+        return names, numpy.concatenate(seqs), family_sizes, families
+
+    # ----------------------------------------------------------------------------------------
+    def test_divvy(self, n_seqs=20000, n_groups=50, budget=5.):
+        """ divvy families of nearly-identical sequences into equal groups, and make sure it's quick and keeps most families together """
+        from glomerator import Glomerator
+        import hamming
+        print 'divvy'
+        names, seqs, family_sizes, families = self.simulate_naive_families(n_seqs, n_seqs / n_groups)
+        start = time.time()
+        groups = Glomerator().naive_seq_divvy(hamming.EncodedSeqs.from_code_matrix(names, seqs), n_groups)
+        divvy_time = time.time() - start
+        igroups = {}
+        for igroup in range(len(groups)):
+            for name in groups[igroup]:
+                igroups.setdefault(families[int(name[1:])], set()).add(igroup)
+        multi_families = [ifam for ifam in range(len(family_sizes)) if family_sizes[ifam] > 1]
+        fraction_intact = float(len([ifam for ifam in multi_families if len(igroups[ifam]) == 1])) / len(multi_families)
+        sizes = [len(g) for g in groups]
+        print '  %d seqs into %d groups (sizes %d - %d) in %.2fs, %.0f%% of families intact  (budget %.1fs)' % (len(names), len(groups), min(sizes), max(sizes), divvy_time, 100 * fraction_intact, budget)
+        if len(groups) != n_groups or sum(sizes) != len(names) or max(sizes) > math.ceil(float(len(names)) / n_groups):
+            raise Exception('bad divvy group sizes: %s' % ' '.join([str(s) for s in sizes]))
+        if fraction_intact < 0.8:
+            raise Exception('divvy split up too many families (only %.2f intact)' % fraction_intact)
+        if divvy_time > budget:
+            raise Exception('divvy went over its time budget: %.2f > %.1f' % (divvy_time, budget))
+
+        # then balance by cost instead (pairs within each family, as a stand-in for forward calculations) and make sure the most expensive group isn't much more expensive than average
+        def family_costs(clusters):
+            costs = []
+            for cluster in clusters:
+                family_counts = numpy.bincount([families[i] for i in cluster]) if len(cluster) > 0 else numpy.zeros(1, dtype=int)
+                costs.append(len(cluster) + (family_counts * (family_counts - 1)).sum())
+            return costs
+        def imbalance(groups):
+            costs = family_costs([[int(name[1:]) for name in group] for group in groups])
+            return max(costs) / (float(sum(costs)) / len(costs))
+        clust = Glomerator()
+        cost_groups = clust.naive_seq_divvy(hamming.EncodedSeqs.from_code_matrix(names, seqs), n_groups, cost_fcn=family_costs)
+        size_imbalance, cost_imbalance = imbalance(groups), imbalance(cost_groups)
+        print '  cost imbalance (max / mean): %.2f dividing by size, %.2f by cost (predicted %.2f)' % (size_imbalance, cost_imbalance, max(clust.divvy_costs) / (sum(clust.divvy_costs) / len(clust.divvy_costs)))
+        if len(cost_groups) != n_groups or sum([len(g) for g in cost_groups]) != len(names):
+            raise Exception('bad cost divvy group sizes: %s' % ' '.join([str(len(g)) for g in cost_groups]))
+        if cost_imbalance > 1.3:
+            raise Exception('cost divvy too unbalanced: %.2f' % cost_imbalance)
+
+    # ----------------------------------------------------------------------------------------
+    def test_hamming_index(self, n_seqs=2000, bounds=(0.01, 0.08)):
+        """ make sure the hamming index finds exactly the same pairs (and neighbors) as comparing every pair, both with the default and with no ambiguous segments allowed (i.e. mostly brute force) """
+        from hammingindex import HammingIndex
+        import hamming
+        print 'hamming index'
+        names, seqs, _, _ = self.simulate_naive_families(n_seqs, n_seqs / 20)
+        encoded_seqs = hamming.EncodedSeqs.from_code_matrix(names, seqs)
+        start = time.time()
+        expected = set()
+        for istart, istop, hfracs in encoded_seqs.all_pairs_blocks():
+            in_bounds = (hfracs >= bounds[0]) & (hfracs <= bounds[1]) & (numpy.arange(istart, istop)[:, None] < numpy.arange(len(encoded_seqs))[None, :])
+            expected |= set([(istart + ia, ib) for ia, ib in zip(*numpy.nonzero(in_bounds))])
+        all_pairs_time = time.time() - start
+        for n_allowed_ambiguous in [None, 0]:
+            start = time.time()
+            index = HammingIndex(encoded_seqs, bounds[1], n_allowed_ambiguous=n_allowed_ambiguous)
+            ifirst, isecond, _ = index.pairs(min_fraction=bounds[0])
+            print '  %d pairs within %.2f - %.2f: %.2fs with index (%d brute force seqs), %.2fs comparing all pairs' % (len(ifirst), bounds[0], bounds[1], time.time() - start, len(index.brute_force), all_pairs_time)
+            found = set(zip(ifirst.tolist(), isecond.tolist()))
+            if found != expected or len(found) != len(ifirst):
+                raise Exception('hamming index found %d pairs (%d unique) but there should be %d (%d missing)' % (len(ifirst), len(found), len(expected), len(expected - found)))
+            for iseq in range(0, len(names), len(names) / 10):
+                neighbors, _ = index.neighbors(iseq, min_fraction=bounds[0])
+                if set(neighbors.tolist()) != set([ib for ia, ib in expected if ia == iseq] + [ia for ia, ib in expected if ib == iseq]):
+                    raise Exception('wrong neighbors for %d' % iseq)
+
+        # a pair exactly at the bound, with one difference in each segment (where max fraction * length isn't exactly representable)
+        length, max_fraction = 100, 0.29
+        seq_a = numpy.full(length, ord('A'), dtype=numpy.uint8)
+        seq_b = seq_a.copy()
+        seq_b[[seg[0] for seg in numpy.array_split(numpy.arange(length), 29)]] = ord('C')
+        index = HammingIndex(hamming.EncodedSeqs.from_code_matrix(['a', 'b'], numpy.array([seq_a, seq_b])), max_fraction)
+        if len(index.pairs()[0]) != 1:
+            raise Exception('hamming index missed a pair at exactly the max fraction')
+
+    # ----------------------------------------------------------------------------------------
+    def test_single_linkage(self, max_fractions=(0.005, 0.02, 0.1)):
+        """ make sure single-linkage naive clustering gives the connected components of the graph with an edge between each pair within the bound (from utils.hamming_fraction() on every pair), with two sequence lengths and some Ns """
+        from glomerator import Glomerator
+        print 'single linkage'
+        naive_seqs = OrderedDict()
+        for length, n_seqs, seed in [(360, 160, 1), (300, 80, 2)]:
+            names, seqs, _, _ = self.simulate_naive_families(n_seqs, 8, length=length, seed=seed)
+            seqs[numpy.random.RandomState(seed).rand(*seqs.shape) < 0.005] = ord(utils.ambiguous_bases[0])
+            for name, seq in zip(names, seqs):
+                naive_seqs['%s-%d' % (name, length)] = seq.tostring()
+        names = naive_seqs.keys()
+        pairs = [(ia, ib, utils.hamming_fraction(naive_seqs[names[ia]], naive_seqs[names[ib]])) for ia in range(len(names)) for ib in range(ia + 1, len(names)) if len(naive_seqs[names[ia]]) == len(naive_seqs[names[ib]])]
+        for max_fraction in max_fractions:
+            parents = range(len(names))  # union-find forest
+            def find(i):
+                while parents[i] != i:
+                    i = parents[i]
+                return i
+            for ia, ib, hfrac in pairs:
+                if hfrac <= max_fraction:
+                    parents[find(ia)] = find(ib)
+            expected = {}
+            for iseq in range(len(names)):
+                expected.setdefault(find(iseq), set()).add(names[iseq])
+            expected = set([frozenset(cluster) for cluster in expected.values()])
+            clusters = Glomerator().naive_seq_single_linkage(naive_seqs, max_fraction)
+            found = set([frozenset(cluster) for cluster in clusters])
+            if found != expected or len(found) != len(clusters):
+                raise Exception('single linkage within %.3f gave %d clusters, but there should be %d connected components (%d of them missing)' % (max_fraction, len(clusters), len(expected), len(expected - found)))
+            print '  %.3f: %d clusters from %d sequences' % (max_fraction, len(clusters), len(names))
+
     # ----------------------------------------------------------------------------------------
     def run(self, args):
         open(self.logfname, 'w').close()